@@ -0,0 +1,404 @@
+"""拷卡性能基准：生成仿真 SD 卡，端到端运行拷卡引擎，输出 JSON 结果
+
+仿真卡的目录结构与索尼相机一致：
+    DCIM/100MSDCF/DSC00001.JPG + DSC00001.ARW   成对的照片（带 EXIF 拍摄时间）
+    PRIVATE/M4ROOT/CLIP/C0001.MP4 + C0001M01.XML  视频（稀疏或随机内容）和元数据文件
+拍摄时间分布在多天内，一部分文件的修改时间与拍摄时间不一致。
+同样的参数和随机种子生成的卡完全相同，便于不同版本之间对比。
+
+示例（默认在 /dev/shm 等 tmpfs 上生成，也可以用 --workdir 指向 loop 设备挂载的目录）：
+    python benchmark.py --preset quick --repeat 3 --output bench.json
+    python benchmark.py --preset standard --compare bench.json
+"""
+import argparse
+import json
+import logging
+import os
+import platform
+import random
+import resource
+import shutil
+import struct
+import sys
+import tempfile
+import time
+
+from capture_metadata import metadata_cache
+from card_scanner import scan_card
+from copy_engine import hash_file
+from hashing import ALGORITHM_AUTO, resolve_algorithm
+from ingest_engine import DEFAULT_IMAGE_WORKERS, DEFAULT_VIDEO_WORKERS, IngestEngine, IngestOptions
+from instrumentation import configure_logging, instrumentation
+from progress import STAGE_COPY, STAGE_DONE, STAGE_VERIFY
+from scheduler import DEFAULT_ORDER, ORDER_POLICIES
+from verifier import drop_page_cache
+
+BENCHMARK_VERSION = 1
+MB = 1024 * 1024
+
+# 预设规模：照片对数、JPG/ARW 平均大小、视频个数和大小
+PRESETS = {
+    'quick': {'photos': 200, 'jpg_size': 200 * 1024, 'raw_size': 800 * 1024, 'videos': 2, 'video_size': 128 * MB},
+    'standard': {'photos': 2000, 'jpg_size': 400 * 1024, 'raw_size': 1536 * 1024, 'videos': 4,
+                 'video_size': 1024 * MB},
+    'large': {'photos': 5000, 'jpg_size': 8 * MB, 'raw_size': 24 * MB, 'videos': 8, 'video_size': 4096 * MB},
+}
+# 修改时间与拍摄时间不一致的文件比例（模拟在电脑上改过的文件）
+MTIME_MISMATCH_RATIO = 0.1
+_QUICKTIME_EPOCH_OFFSET = 2082844800
+_FILL_BLOCK_SIZE = 1 * MB
+
+
+def _tiff_header(captured_at, model=b'ILCE-7M4'):
+    """最小的 TIFF/EXIF 头：IFD0 中的相机型号和 EXIF 子 IFD 中的 DateTimeOriginal"""
+    date_text = time.strftime('%Y:%m:%d %H:%M:%S', time.localtime(captured_at)).encode()
+    ifd0_offset = 8
+    model_offset = ifd0_offset + 2 + 2 * 12 + 4
+    exif_offset = model_offset + len(model) + 1
+    date_offset = exif_offset + 2 + 12 + 4
+    header = b'II*\x00' + struct.pack('<I', ifd0_offset)
+    header += struct.pack('<H', 2)
+    header += struct.pack('<HHII', 0x0110, 2, len(model) + 1, model_offset)
+    header += struct.pack('<HHII', 0x8769, 4, 1, exif_offset) + b'\0\0\0\0'
+    header += model + b'\0'
+    header += struct.pack('<H', 1) + struct.pack('<HHII', 0x9003, 2, len(date_text) + 1, date_offset) + b'\0\0\0\0'
+    header += date_text + b'\0'
+    return header
+
+
+def _jpeg_header(captured_at):
+    app1 = b'Exif\0\0' + _tiff_header(captured_at)
+    return (b'\xff\xd8' + b'\xff\xe1' + struct.pack('>H', len(app1) + 2) + app1
+            + b'\xff\xda' + struct.pack('>H', 2))
+
+
+def _mp4_boxes(captured_at):
+    created = int(captured_at) + _QUICKTIME_EPOCH_OFFSET
+    mvhd_body = b'\0\0\0\0' + struct.pack('>II', created, created) + b'\0' * 88
+    mvhd = struct.pack('>I', 8 + len(mvhd_body)) + b'mvhd' + mvhd_body
+    moov = struct.pack('>I', 8 + len(mvhd)) + b'moov' + mvhd
+    ftyp = struct.pack('>I', 16) + b'ftypXAVC\0\0\0\0'
+    return ftyp, moov
+
+
+def _write_filled(f, size, rng, fill_block):
+    """写入 size 字节的伪随机数据：复用同一块随机数据，块首写入序号，避免内容完全重复"""
+    written = 0
+    counter = rng.getrandbits(32)
+    while written < size:
+        chunk = struct.pack('<Q', counter) + fill_block[8:]
+        chunk = chunk[:size - written]
+        f.write(chunk)
+        written += len(chunk)
+        counter += 1
+
+
+def _write_file(path, header, size, rng, fill_block, mtime):
+    with open(path, 'wb') as f:
+        f.write(header)
+        _write_filled(f, max(0, size - len(header)), rng, fill_block)
+    os.utime(path, (mtime, mtime))
+
+
+def _jitter(rng, size):
+    # 同一相机拍出的照片大小在 ±20% 内波动
+    return max(1024, int(size * rng.uniform(0.8, 1.2)))
+
+
+def generate_card(card_dir, photos, jpg_size, raw_size, videos, video_size, days=3, video_fill='sparse', seed=0):
+    """生成一张仿真 SD 卡，返回 (文件数, 总字节数)"""
+    rng = random.Random(seed)
+    fill_block = rng.randbytes(_FILL_BLOCK_SIZE) if hasattr(rng, 'randbytes') else os.urandom(_FILL_BLOCK_SIZE)
+    photo_dir = os.path.join(card_dir, 'DCIM', '100MSDCF')
+    clip_dir = os.path.join(card_dir, 'PRIVATE', 'M4ROOT', 'CLIP')
+    os.makedirs(photo_dir, exist_ok=True)
+    os.makedirs(clip_dir, exist_ok=True)
+    # 固定的起始时间，保证同样的种子生成同样的日期分布
+    start = time.mktime((2025, 5, 1, 9, 0, 0, 0, 0, -1))
+    span = max(1, days) * 86400
+    files = total = 0
+
+    def capture_and_mtime():
+        captured_at = start + rng.uniform(0, span)
+        mtime = captured_at
+        if rng.random() < MTIME_MISMATCH_RATIO:
+            mtime = captured_at + rng.uniform(2, 30) * 86400
+        return captured_at, mtime
+
+    for i in range(1, photos + 1):
+        captured_at, mtime = capture_and_mtime()
+        for ext, header, size in (('JPG', _jpeg_header(captured_at), jpg_size),
+                                  ('ARW', _tiff_header(captured_at), raw_size)):
+            size = _jitter(rng, size)
+            _write_file(os.path.join(photo_dir, f'DSC{i:05d}.{ext}'), header, size, rng, fill_block, mtime)
+            files += 1
+            total += size
+
+    for i in range(1, videos + 1):
+        captured_at, mtime = capture_and_mtime()
+        path = os.path.join(clip_dir, f'C{i:04d}.MP4')
+        ftyp, moov = _mp4_boxes(captured_at)
+        payload = max(0, video_size - len(ftyp) - len(moov) - 16)
+        with open(path, 'wb') as f:
+            f.write(ftyp)
+            f.write(struct.pack('>I', 1) + b'mdat' + struct.pack('>Q', 16 + payload))
+            if video_fill == 'sparse':
+                f.seek(payload, os.SEEK_CUR)
+            else:
+                _write_filled(f, payload, rng, fill_block)
+            f.write(moov)
+        os.utime(path, (mtime, mtime))
+        xml_path = os.path.join(clip_dir, f'C{i:04d}M01.XML')
+        with open(xml_path, 'w', encoding='utf-8') as f:
+            created = time.strftime('%Y-%m-%dT%H:%M:%S', time.localtime(captured_at))
+            f.write(f'<?xml version="1.0" encoding="UTF-8"?>\n<NonRealTimeMeta>'
+                    f'<CreationDate value="{created}+08:00"/></NonRealTimeMeta>\n')
+        os.utime(xml_path, (mtime, mtime))
+        files += 1
+        total += os.path.getsize(path)
+    return files, total
+
+
+def drop_card_cache(card_dir):
+    """把卡上的文件从页缓存中丢弃，模拟冷读取（不支持时静默跳过）"""
+    for root, _, files in os.walk(card_dir):
+        for file in files:
+            try:
+                fd = os.open(os.path.join(root, file), os.O_RDONLY)
+            except OSError:
+                continue
+            try:
+                drop_page_cache(fd)
+            except OSError:
+                pass
+            finally:
+                os.close(fd)
+
+
+def peak_rss_bytes():
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux 以 KB 为单位，macOS 以字节为单位
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+
+def filesystem_type(path):
+    """从 /proc/mounts 找出目录所在的文件系统类型（如 tmpfs、ext4），其他系统返回 None"""
+    path = os.path.realpath(path)
+    best, fs_type = '', None
+    try:
+        with open('/proc/mounts', encoding='utf-8') as f:
+            for line in f:
+                parts = line.split()
+                if len(parts) >= 3 and (path == parts[1] or path.startswith(parts[1].rstrip('/') + '/')):
+                    if len(parts[1]) > len(best):
+                        best, fs_type = parts[1], parts[2]
+    except OSError:
+        pass
+    return fs_type
+
+
+def run_once(card_dir, dest_dir, hash_algorithm, image_workers, video_workers, cold=False, stream=False,
+             order=DEFAULT_ORDER):
+    """端到端跑一次拷卡，返回各阶段耗时和吞吐量
+
+    stream 为 True 时不预先扫描建索引，与命令行一样边扫描边拷贝（此时 scan/plan 阶段与拷贝重叠）。
+    """
+    shutil.rmtree(dest_dir, ignore_errors=True)
+    metadata_cache.clear()
+    if cold:
+        drop_card_cache(card_dir)
+    stage_started = {}
+
+    def on_progress(snapshot):
+        stage_started.setdefault(snapshot.stage, time.perf_counter())
+        if snapshot.bytes_done:
+            stage_started.setdefault('first_byte', time.perf_counter())
+        if snapshot.files_verified:
+            stage_started.setdefault('first_file', time.perf_counter())
+
+    start = time.perf_counter()
+    index = None if stream else scan_card(card_dir)
+    scan_done = time.perf_counter()
+
+    options = IngestOptions(os.path.join(dest_dir, 'images'), os.path.join(dest_dir, 'videos'), card_dir,
+                            'benchmark', image_workers=image_workers, video_workers=video_workers,
+                            hash_algorithm=hash_algorithm, order=order)
+    engine = IngestEngine(options, card_index=index, on_progress=on_progress)
+    result = engine.run()
+    end = time.perf_counter()
+
+    copy_started = stage_started.get(STAGE_COPY, end)
+    # 最后一个文件拷完后进入纯校验阶段；没有进入时说明校验与拷贝同时结束
+    verify_started = stage_started.get(STAGE_VERIFY, stage_started.get(STAGE_DONE, end))
+    bytes_total = sum(task.size for task in result.tasks)
+    files_total = len(result.tasks)
+    elapsed = end - start
+
+    # 单独测一遍源文件的哈希速度（页缓存已热），用来区分拷贝慢在 I/O 还是哈希
+    hash_start = time.perf_counter()
+    for task in result.tasks:
+        hash_file(task.src_path, algorithm=result.hash_algorithm)
+    hash_seconds = time.perf_counter() - hash_start
+
+    return {
+        'files': files_total,
+        'bytes': bytes_total,
+        'failed_files': len(result.failed_tasks),
+        'seconds': round(elapsed, 3),
+        'files_per_second': round(files_total / elapsed, 1) if elapsed else None,
+        'mb_per_second': round(bytes_total / MB / elapsed, 1) if elapsed else None,
+        # 从开始（含扫描）到第一批数据写出的时间（进度回调限频，精度约 50ms）
+        'first_byte_seconds': round(stage_started['first_byte'] - start, 3) if 'first_byte' in stage_started else None,
+        # 到第一个文件校验通过、可以开始选片的时间（对比拷贝顺序策略时关注）
+        'first_file_seconds': round(stage_started['first_file'] - start, 3) if 'first_file' in stage_started else None,
+        'stages': {
+            'scan': round(scan_done - start, 3),
+            'plan': round(copy_started - scan_done, 3),
+            'copy': round(verify_started - copy_started, 3),
+            'verify': round(end - verify_started, 3),
+            'hash': round(hash_seconds, 3),
+        },
+        'hash_mb_per_second': round(bytes_total / MB / hash_seconds, 1) if hash_seconds else None,
+        'peak_rss_bytes': peak_rss_bytes(),
+        # --instrument 时为各环节（open/read/hash/write/verify）的累计耗时
+        'timings': result.timings,
+    }
+
+
+def _median(values):
+    values = sorted(value for value in values if value is not None)
+    if not values:
+        return None
+    middle = len(values) // 2
+    return values[middle] if len(values) % 2 else round((values[middle - 1] + values[middle]) / 2, 3)
+
+
+def summarize(runs):
+    """多次运行取中位数，减少偶然波动的影响"""
+    summary = {key: _median([run[key] for run in runs])
+               for key in ('seconds', 'first_byte_seconds', 'first_file_seconds', 'files_per_second',
+                           'mb_per_second', 'hash_mb_per_second')}
+    summary['stages'] = {stage: _median([run['stages'][stage] for run in runs]) for stage in runs[0]['stages']}
+    summary['peak_rss_bytes'] = max(run['peak_rss_bytes'] for run in runs)
+    return summary
+
+
+def compare(baseline, current):
+    """与基线结果对比，返回 {指标: 变化百分比}（吞吐量为正表示变快，耗时为正表示变慢）"""
+    changes = {}
+    old, new = baseline['summary'], current['summary']
+    for key in ('files_per_second', 'mb_per_second', 'seconds', 'first_byte_seconds', 'first_file_seconds',
+                'peak_rss_bytes'):
+        if old.get(key) and new.get(key) is not None:
+            changes[key] = round((new[key] - old[key]) * 100 / old[key], 1)
+    for stage, seconds in new['stages'].items():
+        old_seconds = old.get('stages', {}).get(stage)
+        if old_seconds and seconds is not None:
+            changes[f'stage_{stage}'] = round((seconds - old_seconds) * 100 / old_seconds, 1)
+    return changes
+
+
+def _default_workdir():
+    # 优先使用 tmpfs，测出的是程序本身的开销而不是某块磁盘的速度
+    return '/dev/shm' if os.path.isdir('/dev/shm') and os.access('/dev/shm', os.W_OK) else tempfile.gettempdir()
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description='拷卡性能基准：生成仿真 SD 卡并端到端测量拷卡速度')
+    parser.add_argument('--preset', choices=sorted(PRESETS), default='quick', help='仿真卡规模')
+    parser.add_argument('--photos', type=int, help='照片对数（JPG+ARW），覆盖预设')
+    parser.add_argument('--jpg-size', type=int, help='JPG 平均大小（字节），覆盖预设')
+    parser.add_argument('--raw-size', type=int, help='ARW 平均大小（字节），覆盖预设')
+    parser.add_argument('--videos', type=int, help='视频个数，覆盖预设')
+    parser.add_argument('--video-size', type=int, help='每个视频的大小（字节），覆盖预设')
+    parser.add_argument('--video-fill', choices=('sparse', 'random'), default='sparse',
+                        help='视频内容：sparse 为稀疏文件（不占卡上空间），random 为伪随机数据')
+    parser.add_argument('--days', type=int, default=3, help='拍摄时间分布的天数')
+    parser.add_argument('--seed', type=int, default=0, help='随机种子')
+    parser.add_argument('--workdir', default=_default_workdir(), help='生成仿真卡和目标目录的位置')
+    parser.add_argument('--card-dir', help='使用已有的卡目录（如 loop 设备挂载点），不再生成')
+    parser.add_argument('--keep', action='store_true', help='结束后保留生成的卡和目标目录')
+    parser.add_argument('--repeat', type=int, default=1, help='重复运行次数，结果取中位数')
+    parser.add_argument('--cold', action='store_true', help='每次运行前把卡上的文件从页缓存中丢弃')
+    parser.add_argument('--stream', action='store_true', help='不预先扫描建索引，边扫描边拷贝（与命令行相同）')
+    parser.add_argument('--order', choices=ORDER_POLICIES, default=DEFAULT_ORDER, help='拷贝顺序策略')
+    parser.add_argument('--hash', default=ALGORITHM_AUTO, help='校验算法')
+    parser.add_argument('--image-workers', type=int, default=DEFAULT_IMAGE_WORKERS)
+    parser.add_argument('--video-workers', type=int, default=DEFAULT_VIDEO_WORKERS)
+    parser.add_argument('--instrument', action='store_true',
+                        help='开启埋点，结果中附带各环节的累计耗时（会带来少量额外开销）')
+    parser.add_argument('--output', help='把结果写入 JSON 文件')
+    parser.add_argument('--compare', help='与之前保存的 JSON 结果对比')
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    configure_logging(logging.WARNING)
+    if args.instrument:
+        instrumentation.enable()
+    card = dict(PRESETS[args.preset])
+    for key in card:
+        if getattr(args, key) is not None:
+            card[key] = getattr(args, key)
+
+    session_dir = tempfile.mkdtemp(prefix='sd_copy_hub_bench_', dir=args.workdir)
+    card_dir = args.card_dir or os.path.join(session_dir, 'card')
+    dest_dir = os.path.join(session_dir, 'dest')
+    try:
+        generate_seconds = None
+        if not args.card_dir:
+            generate_start = time.perf_counter()
+            generate_card(card_dir, days=args.days, video_fill=args.video_fill, seed=args.seed, **card)
+            generate_seconds = round(time.perf_counter() - generate_start, 3)
+        # auto 的测速放在计时之外
+        hash_algorithm = resolve_algorithm(args.hash)
+        runs = []
+        for _ in range(max(1, args.repeat)):
+            runs.append(run_once(card_dir, dest_dir, hash_algorithm, args.image_workers, args.video_workers,
+                                 cold=args.cold, stream=args.stream, order=args.order))
+    finally:
+        if not args.keep:
+            shutil.rmtree(session_dir, ignore_errors=True)
+
+    report = {
+        'benchmark_version': BENCHMARK_VERSION,
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'environment': {
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'cpu_count': os.cpu_count(),
+            'workdir': args.workdir,
+            'filesystem': filesystem_type(args.card_dir or args.workdir),
+        },
+        'parameters': {
+            'preset': args.preset,
+            'card': card if not args.card_dir else {'card_dir': args.card_dir},
+            'video_fill': args.video_fill,
+            'days': args.days,
+            'seed': args.seed,
+            'cold': args.cold,
+            'stream': args.stream,
+            'order': args.order,
+            'hash_algorithm': hash_algorithm,
+            'image_workers': args.image_workers,
+            'video_workers': args.video_workers,
+            'instrument': args.instrument,
+        },
+        'generate_seconds': generate_seconds,
+        'runs': runs,
+        'summary': summarize(runs),
+    }
+    if args.compare:
+        with open(args.compare, encoding='utf-8') as f:
+            report['compare'] = {'baseline': args.compare, 'changes_percent': compare(json.load(f), report)}
+    text = json.dumps(report, ensure_ascii=False, indent=2)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(text + '\n')
+    print(text)
+    return 0 if all(not run['failed_files'] for run in runs) else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
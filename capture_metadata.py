@@ -0,0 +1,260 @@
+import datetime
+import logging
+import re
+import struct
+import threading
+
+# 只解析文件头部：绝大多数相机把 EXIF / mvhd 写在文件前几 KB 内，
+# 超出首次读取范围的偏移再按需定位读取，整个过程不解码图像
+HEADER_READ_SIZE = 16 * 1024
+
+# EXIF 标签
+TAG_MODEL = 0x0110
+TAG_DATETIME = 0x0132
+TAG_EXIF_IFD = 0x8769
+TAG_DATETIME_ORIGINAL = 0x9003
+
+# 基于 TIFF 结构的 RAW 格式（文件开头就是 TIFF 头）
+TIFF_BASED_EXTENSIONS = {'.arw', '.nef', '.cr2', '.dng', '.orf', '.pef', '.srw', '.raw', '.tif', '.tiff'}
+JPEG_EXTENSIONS = {'.jpg', '.jpeg'}
+QUICKTIME_EXTENSIONS = {'.mp4', '.mov', '.m4v'}
+# 索尼视频旁边的 C0001M01.XML 元数据文件（记录拍摄地的本地时间和机型）
+XML_EXTENSIONS = {'.xml'}
+_XML_CREATION_DATE = re.compile(rb'<CreationDate\s+value="(\d{4})-(\d{2})-(\d{2})T(\d{2}):(\d{2}):(\d{2})')
+_XML_MODEL_NAME = re.compile(rb'<Device\b[^>]*\bmodelName="([^"]+)"')
+
+# QuickTime 时间从 1904-01-01 开始计秒
+_QUICKTIME_EPOCH_OFFSET = 2082844800
+
+
+class CaptureInfo:
+    """从文件头解析出的拍摄信息，解析失败的字段为 None"""
+    __slots__ = ('captured_at', 'camera')
+
+    def __init__(self, captured_at=None, camera=None):
+        self.captured_at = captured_at
+        self.camera = camera
+
+
+class _HeaderReader:
+    """带首段缓存的随机读取：首段命中时不再访问磁盘"""
+    def __init__(self, f, base=0):
+        self.f = f
+        self.base = base
+        f.seek(base)
+        self.head = f.read(HEADER_READ_SIZE)
+
+    def read(self, offset, length):
+        end = offset + length
+        if end <= len(self.head):
+            return self.head[offset:end]
+        self.f.seek(self.base + offset)
+        return self.f.read(length)
+
+
+def _parse_exif_datetime(value):
+    # 格式为 "YYYY:MM:DD HH:MM:SS"，手工切片比 strptime 快得多
+    try:
+        text = value.decode('ascii', 'ignore')
+        return datetime.datetime(int(text[0:4]), int(text[5:7]), int(text[8:10]),
+                                 int(text[11:13]), int(text[14:16]), int(text[17:19]))
+    except (ValueError, IndexError):
+        return None
+
+
+def _read_ifd(reader, offset, endian, wanted):
+    """读取一个 IFD 中需要的标签，返回 {tag: 原始值}"""
+    count_data = reader.read(offset, 2)
+    if len(count_data) < 2:
+        return {}
+    count = struct.unpack(endian + 'H', count_data)[0]
+    entries = reader.read(offset + 2, count * 12)
+    values = {}
+    for i in range(min(count, len(entries) // 12)):
+        tag, field_type, value_count, value_offset = struct.unpack_from(endian + 'HHII', entries, i * 12)
+        if tag not in wanted:
+            continue
+        if field_type == 2:  # ASCII
+            if value_count <= 4:
+                raw = entries[i * 12 + 8:i * 12 + 8 + value_count]
+            else:
+                raw = reader.read(value_offset, value_count)
+            values[tag] = raw.rstrip(b'\x00 ')
+        else:
+            values[tag] = value_offset
+    return values
+
+
+def _parse_tiff(reader):
+    """解析 TIFF 头，返回 CaptureInfo；reader 的 0 偏移为 TIFF 头起点"""
+    header = reader.read(0, 8)
+    if len(header) < 8:
+        return None
+    if header[:2] == b'II':
+        endian = '<'
+    elif header[:2] == b'MM':
+        endian = '>'
+    else:
+        return None
+    ifd0_offset = struct.unpack(endian + 'I', header[4:8])[0]
+    ifd0 = _read_ifd(reader, ifd0_offset, endian, (TAG_MODEL, TAG_DATETIME, TAG_EXIF_IFD))
+    captured_at = None
+    if TAG_EXIF_IFD in ifd0:
+        exif = _read_ifd(reader, ifd0[TAG_EXIF_IFD], endian, (TAG_DATETIME_ORIGINAL,))
+        if TAG_DATETIME_ORIGINAL in exif:
+            captured_at = _parse_exif_datetime(exif[TAG_DATETIME_ORIGINAL])
+    if captured_at is None and TAG_DATETIME in ifd0:
+        captured_at = _parse_exif_datetime(ifd0[TAG_DATETIME])
+    camera = ifd0.get(TAG_MODEL)
+    return CaptureInfo(captured_at, camera.decode('utf-8', 'ignore') if camera else None)
+
+
+def _parse_jpeg(f, base=0):
+    """在 JPEG 的 APP1 段中查找 EXIF"""
+    f.seek(base)
+    if f.read(2) != b'\xff\xd8':
+        return None
+    position = base + 2
+    while True:
+        f.seek(position)
+        marker = f.read(4)
+        if len(marker) < 4 or marker[0] != 0xFF:
+            return None
+        segment_type = marker[1]
+        segment_length = struct.unpack('>H', marker[2:4])[0]
+        if segment_type == 0xE1:
+            if f.read(6) == b'Exif\x00\x00':
+                return _parse_tiff(_HeaderReader(f, position + 10))
+        elif segment_type == 0xDA:  # 图像数据开始，后面不会再有 EXIF
+            return None
+        position += 2 + segment_length
+
+
+def _parse_raf(f):
+    # 富士 RAF：文件头偏移 84 处记录内嵌 JPEG 的位置，EXIF 在内嵌 JPEG 中
+    f.seek(0)
+    header = f.read(92)
+    if not header.startswith(b'FUJIFILMCCD-RAW'):
+        return None
+    jpeg_offset = struct.unpack('>I', header[84:88])[0]
+    return _parse_jpeg(f, jpeg_offset)
+
+
+def _parse_cr3(f):
+    # 佳能 CR3：CMT1 / CMT2 盒子中分别是 IFD0 和 EXIF IFD，都是完整的 TIFF 结构
+    head = _HeaderReader(f).head
+    info = CaptureInfo()
+    for box_name in (b'CMT2', b'CMT1'):
+        position = head.find(box_name)
+        if position < 0:
+            continue
+        parsed = _parse_tiff(_HeaderReader(f, position + 4))
+        if parsed is None:
+            continue
+        info.captured_at = info.captured_at or parsed.captured_at
+        info.camera = info.camera or parsed.camera
+    return info
+
+
+def _find_box(f, start, end, box_type):
+    """在 [start, end) 范围内按盒子大小跳跃查找指定类型的 MP4 盒子"""
+    position = start
+    while position + 8 <= end:
+        f.seek(position)
+        header = f.read(16)
+        if len(header) < 8:
+            return None
+        size, kind = struct.unpack('>I4s', header[:8])
+        header_size = 8
+        if size == 1:
+            size = struct.unpack('>Q', header[8:16])[0]
+            header_size = 16
+        elif size == 0:
+            size = end - position
+        if size < header_size:
+            return None
+        if kind == box_type:
+            return position + header_size, position + size
+        position += size
+    return None
+
+
+def _parse_quicktime(f):
+    # 只读取 moov/mvhd 中的创建时间；moov 在文件末尾时也只需几次跳跃定位
+    f.seek(0, 2)
+    file_size = f.tell()
+    moov = _find_box(f, 0, file_size, b'moov')
+    if moov is None:
+        return None
+    mvhd = _find_box(f, moov[0], moov[1], b'mvhd')
+    if mvhd is None:
+        return None
+    f.seek(mvhd[0])
+    data = f.read(12)
+    if len(data) < 12:
+        return None
+    if data[0] == 1:
+        creation_time = struct.unpack('>Q', data[4:12])[0]
+    else:
+        creation_time = struct.unpack('>I', data[4:8])[0]
+    if creation_time <= _QUICKTIME_EPOCH_OFFSET:
+        return None
+    # mvhd 中记录的是 UTC 时间，转换为本地时间与照片保持一致
+    return CaptureInfo(datetime.datetime.fromtimestamp(creation_time - _QUICKTIME_EPOCH_OFFSET))
+
+
+def _parse_sony_xml(f):
+    # 只在文件开头查找 CreationDate 和 Device 标签，不做完整的 XML 解析
+    head = f.read(HEADER_READ_SIZE)
+    match = _XML_CREATION_DATE.search(head)
+    if match is None:
+        return None
+    captured_at = datetime.datetime(*(int(value) for value in match.groups()))
+    model = _XML_MODEL_NAME.search(head)
+    return CaptureInfo(captured_at, model.group(1).decode('utf-8', 'ignore').strip() if model else None)
+
+
+def read_capture_info(file_path, ext):
+    """读取拍摄时间和相机型号（只解析文件头），不支持或解析失败时返回 None"""
+    try:
+        with open(file_path, 'rb') as f:
+            if ext in JPEG_EXTENSIONS:
+                return _parse_jpeg(f)
+            if ext in TIFF_BASED_EXTENSIONS:
+                return _parse_tiff(_HeaderReader(f))
+            if ext in QUICKTIME_EXTENSIONS:
+                return _parse_quicktime(f)
+            if ext == '.cr3':
+                return _parse_cr3(f)
+            if ext == '.raf':
+                return _parse_raf(f)
+            if ext in XML_EXTENSIONS:
+                return _parse_sony_xml(f)
+    except (OSError, struct.error) as e:
+        logging.debug(f"Failed to read capture metadata for {file_path}: {e}")
+    return None
+
+
+class MetadataCache:
+    """按 (路径, 大小, 修改时间) 缓存解析结果，同一会话内重复扫描不再读文件"""
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._cache = {}
+
+    def get(self, file_path, ext, size, mtime_ns):
+        key = (file_path, size, mtime_ns)
+        with self._lock:
+            if key in self._cache:
+                return self._cache[key]
+        info = read_capture_info(file_path, ext)
+        with self._lock:
+            self._cache[key] = info
+        return info
+
+    def clear(self):
+        with self._lock:
+            self._cache.clear()
+
+
+# 全局共享的缓存（扫描线程和拷贝线程共用）
+metadata_cache = MetadataCache()
@@ -0,0 +1,222 @@
+import datetime
+import logging
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+from capture_metadata import metadata_cache
+from instrumentation import instrumentation
+from routing import KIND_VIDEO, default_routing
+
+# 每扫描到这么多个文件回调一次，让界面在扫描过程中就能逐步显示日期
+SCAN_BATCH_SIZE = 500
+# 读取文件头拍摄时间的并发线程数
+METADATA_WORKERS = 8
+
+
+class FileEntry:
+    """扫描得到的单个媒体文件：路径、类型、大小和日期"""
+    __slots__ = ('path', 'rel_path', 'name', 'ext', 'is_video', 'size', 'mtime', 'mtime_ns', 'date',
+                 'captured_at', 'camera', 'sidecars')
+
+    def __init__(self, path, rel_path, name, ext, is_video, size, mtime, mtime_ns, date,
+                 captured_at=None, camera=None, sidecars=()):
+        self.path = path
+        self.rel_path = rel_path
+        self.name = name
+        self.ext = ext
+        self.is_video = is_video
+        self.size = size
+        self.mtime = mtime
+        self.mtime_ns = mtime_ns
+        self.date = date
+        # 从文件头读取的拍摄时间和相机型号（读取失败时为 None，日期回退到修改时间）
+        self.captured_at = captured_at
+        self.camera = camera
+        # 附属文件（FileEntry），跟随本文件拷贝到同一目录并同步改名
+        self.sidecars = sidecars
+
+    @property
+    def is_image(self):
+        return not self.is_video
+
+
+class CardIndex:
+    """一张卡的内存索引，按日期分组，供获取日期和拷贝线程共用"""
+    def __init__(self, sd_card):
+        self.sd_card = sd_card
+        self.entries = []
+        self.by_date = {}
+        self.complete = False
+
+    def add(self, entry):
+        self.entries.append(entry)
+        self.by_date.setdefault(entry.date, []).append(entry)
+
+    def dates(self):
+        return sorted(self.by_date)
+
+    def select(self, selected_dates=None):
+        """返回选中日期的文件（按扫描顺序）；selected_dates 为空表示全部日期"""
+        if not selected_dates:
+            return list(self.entries)
+        selected_dates = set(selected_dates)
+        return [entry for entry in self.entries if entry.date in selected_dates]
+
+    @property
+    def total_bytes(self):
+        return sum(entry.size for entry in self.entries)
+
+
+def classify(file_name, routing):
+    """根据路由表判断文件类型，返回 (小写扩展名, 'image' / 'video'，不需要拷贝的文件为 None)"""
+    ext = os.path.splitext(file_name)[1].lower()
+    return ext, routing.kind_for(ext)
+
+
+def _sidecar_entries(rel_folder, dir_entries):
+    sidecars = []
+    for dir_entry in dir_entries:
+        try:
+            st = dir_entry.stat()
+        except OSError as e:
+            logging.error(f"Failed to stat sidecar {dir_entry.name}: {e}")
+            continue
+        sidecars.append(FileEntry(dir_entry.path, os.path.join(rel_folder, dir_entry.name), dir_entry.name,
+                                  os.path.splitext(dir_entry.name)[1].lower(),
+                                  False, st.st_size, st.st_mtime, st.st_mtime_ns, None))
+    return sidecars
+
+
+def _read_entry(dir_entry, rel_folder, ext, is_video, read_metadata, sidecar_entries=()):
+    file = dir_entry.name
+    try:
+        with instrumentation.timer('scan.stat'):
+            # DirEntry 缓存 stat 结果（Windows 上直接来自目录列表，不需要额外的系统调用）
+            file_stat = dir_entry.stat()
+    except OSError as e:
+        logging.error(f"Failed to get modification time for {file}: {e}")
+        return None
+    sidecars = _sidecar_entries(rel_folder, sidecar_entries) if sidecar_entries else ()
+    info = None
+    if read_metadata:
+        with instrumentation.timer('scan.metadata'):
+            # 索尼视频优先使用 M01.XML 中的拍摄地本地时间和机型，比 mvhd 中的 UTC 时间更准确
+            for sidecar in sidecars:
+                if sidecar.ext == '.xml':
+                    info = metadata_cache.get(sidecar.path, sidecar.ext, sidecar.size, sidecar.mtime_ns)
+                    break
+            if info is None or info.captured_at is None:
+                info = metadata_cache.get(dir_entry.path, ext, file_stat.st_size, file_stat.st_mtime_ns) or info
+    captured_at = info.captured_at if info else None
+    camera = info.camera if info else None
+    # 优先使用拍摄时间，拷贝或被其他工具改动过的文件修改时间并不可靠
+    taken = captured_at or datetime.datetime.fromtimestamp(file_stat.st_mtime)
+    date = taken.strftime('%Y%m%d')
+    for sidecar in sidecars:
+        sidecar.is_video = is_video
+        sidecar.date = date
+    return FileEntry(dir_entry.path, os.path.join(rel_folder, file), file, ext, is_video,
+                     file_stat.st_size, file_stat.st_mtime, file_stat.st_mtime_ns, date,
+                     captured_at, camera, sidecars)
+
+
+def match_sidecars(media_files, files, routing):
+    """为目录中的媒体文件找出附属文件，返回 {媒体文件名: [附属文件名]}
+
+    同名的 JPG 和 RAW 共用一个 XMP 时只归属一个文件：视频优先，其次 RAW。
+    """
+    names = {name.upper(): name for name in files}
+    claimed = set()
+    matches = {}
+    ordered = sorted(media_files, key=lambda item: (not item[2], not routing.is_raw(item[1]), item[0]))
+    for file, ext, is_video in ordered:
+        stem = os.path.splitext(file)[0].upper()
+        for suffix in routing.sidecar_suffixes:
+            name = names.get(stem + suffix)
+            if name is not None and name not in claimed:
+                claimed.add(name)
+                matches.setdefault(file, []).append(name)
+    return matches
+
+
+def _list_folder(folder):
+    """列出目录，返回 ({文件名: DirEntry}, [子目录 DirEntry])；与 os.walk 一样不进入符号链接指向的目录"""
+    files = {}
+    subfolders = []
+    with os.scandir(folder) as it:
+        for dir_entry in it:
+            try:
+                is_dir = dir_entry.is_dir()
+            except OSError:
+                is_dir = False
+            if not is_dir:
+                files[dir_entry.name] = dir_entry
+            elif not dir_entry.is_symlink():
+                subfolders.append(dir_entry)
+    return files, subfolders
+
+
+def iter_card(sd_card, routing=None, read_metadata=True, should_stop=None):
+    """用 os.scandir 流式遍历 SD 卡，逐个产出需要拷贝的 FileEntry
+
+    遍历顺序与 os.walk 相同（先本目录的文件，再深度优先进入子目录），任何时候只在内存中保留
+    当前目录和待遍历目录的列表，十万个文件以上的卡也不会占用更多内存。
+    同一目录下的文件由线程池并发读取文件头中的拍摄时间。should_stop() 返回 True 时提前结束。
+    """
+    routing = routing or default_routing()
+    pending_folders = [(sd_card, '')]
+    with ThreadPoolExecutor(max_workers=METADATA_WORKERS) as pool:
+        while pending_folders:
+            if should_stop and should_stop():
+                return
+            folder, rel_folder = pending_folders.pop()
+            try:
+                files, subfolders = _list_folder(folder)
+            except OSError as e:
+                logging.error(f"Failed to list folder {folder}: {e}")
+                continue
+            pending_folders.extend((dir_entry.path, os.path.join(rel_folder, dir_entry.name))
+                                   for dir_entry in reversed(subfolders))
+            media_files = []
+            for file in files:
+                ext, kind = classify(file, routing)
+                if kind is not None:
+                    media_files.append((file, ext, kind == KIND_VIDEO))
+            if not media_files:
+                continue
+            sidecars = match_sidecars(media_files, files, routing)
+            entries = pool.map(lambda item: _read_entry(files[item[0]], rel_folder, item[1], item[2], read_metadata,
+                                                        [files[name] for name in sidecars.get(item[0], ())]),
+                               media_files)
+            for entry in entries:
+                if entry is not None:
+                    yield entry
+
+
+def scan_card(sd_card, on_batch=None, batch_size=SCAN_BATCH_SIZE, should_stop=None, read_metadata=True,
+              routing=None):
+    """扫描 SD 卡，构建 CardIndex
+
+    on_batch(新出现的日期列表, 已扫描文件数) 会在扫描过程中分批回调；
+    should_stop() 返回 True 时提前结束扫描。read_metadata 为 True 时从文件头读取拍摄时间。
+    routing 为路由表（见 routing），决定哪些文件需要拷贝，默认使用内置规则。
+    """
+    index = CardIndex(sd_card)
+    new_dates = []
+    pending = 0
+    for entry in iter_card(sd_card, routing, read_metadata, should_stop):
+        if entry.date not in index.by_date:
+            new_dates.append(entry.date)
+        index.add(entry)
+        pending += 1
+        if on_batch and pending >= batch_size:
+            on_batch(new_dates, len(index.entries))
+            new_dates = []
+            pending = 0
+    if should_stop and should_stop():
+        return index
+    index.complete = True
+    instrumentation.count('scan.files', len(index.entries))
+    if on_batch:
+        on_batch(new_dates, len(index.entries))
+    return index
@@ -0,0 +1,247 @@
+"""插卡自动识别：监视挂载目录，出现带 DCIM / PRIVATE 目录的新卷时回调，并提供按卷选择的拷卡配置
+
+Linux 上用 inotify 监视挂载根目录（/media、/run/media 及其下的用户目录），有变化时立即重新检查；
+同时每隔几秒列一次目录兜底（手动 mount 到已有目录时不会产生 inotify 事件），
+macOS、Windows 或 inotify 不可用时只靠这种轮询，开销也只是几次 listdir。
+任意普通目录都可以充当挂载根目录：在其中新建含 DCIM 的子目录就相当于插入了一张卡。
+"""
+import fnmatch
+import logging
+import os
+import select
+import string
+import sys
+import time
+
+# 轮询间隔（秒）：有 inotify 时只是兜底，可以长一些
+POLL_INTERVAL = 2.0
+INOTIFY_POLL_INTERVAL = 5.0
+# 相机卡的标志目录：照片在 DCIM 下，索尼等相机的视频在 PRIVATE 下
+CARD_MARKERS = ('DCIM', 'PRIVATE')
+PROFILE_SECTION_PREFIX = 'Profile:'
+
+# inotify 事件：子目录的新建、删除、移入移出，以及被监视的目录本身被删除或卸载
+_IN_MOVED_FROM = 0x00000040
+_IN_MOVED_TO = 0x00000080
+_IN_CREATE = 0x00000100
+_IN_DELETE = 0x00000200
+_IN_DELETE_SELF = 0x00000400
+_IN_UNMOUNT = 0x00002000
+_IN_ONLYDIR = 0x01000000
+_INOTIFY_MASK = (_IN_MOVED_FROM | _IN_MOVED_TO | _IN_CREATE | _IN_DELETE | _IN_DELETE_SELF | _IN_UNMOUNT
+                 | _IN_ONLYDIR)
+
+
+def default_mount_roots():
+    """各平台上可移动存储的挂载根目录"""
+    if sys.platform == 'darwin':
+        return ['/Volumes']
+    if os.name == 'nt':
+        return [f'{letter}:\\' for letter in string.ascii_uppercase[3:]]
+    return ['/media', '/run/media', '/mnt']
+
+
+def default_card_directory():
+    """界面中 SD 卡目录的默认值：当前已插入的第一张卡，没有时为平台上的挂载根目录"""
+    cards = find_cards(default_mount_roots())
+    if cards:
+        return cards[0]
+    if sys.platform == 'darwin':
+        return '/Volumes/Untitled'
+    for root in default_mount_roots():
+        if os.path.isdir(root):
+            return root
+    return ''
+
+
+def is_camera_card(path):
+    """目录下有 DCIM 或 PRIVATE 目录（不区分大小写）"""
+    try:
+        with os.scandir(path) as it:
+            for dir_entry in it:
+                if dir_entry.name.upper() in CARD_MARKERS and dir_entry.is_dir():
+                    return True
+    except OSError:
+        pass
+    return False
+
+
+def _subfolders(path):
+    try:
+        with os.scandir(path) as it:
+            return [dir_entry.path for dir_entry in it
+                    if not dir_entry.name.startswith('.') and dir_entry.is_dir()]
+    except OSError:
+        return []
+
+
+def find_cards(roots):
+    """在挂载根目录下查找相机卡：根目录本身、其子目录，以及 /media/用户名/卷名 这样的下一级目录"""
+    cards = []
+    for root in roots:
+        if is_camera_card(root):
+            cards.append(root)
+            continue
+        for child in _subfolders(root):
+            if is_camera_card(child):
+                cards.append(child)
+            elif not os.path.ismount(child):
+                # 不是挂载点的子目录（如 /media/用户名）再往下看一层；其他卷（如移动硬盘）不深入
+                cards.extend(grandchild for grandchild in _subfolders(child) if is_camera_card(grandchild))
+    return cards
+
+
+class _Inotify:
+    """最小的 inotify 封装（ctypes），只用来唤醒轮询，不解析具体事件"""
+    def __init__(self):
+        import ctypes
+        import ctypes.util
+        libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+        self._libc = libc
+        self.fd = libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), 'inotify_init1 failed')
+        self._watched = set()
+
+    def watch(self, path):
+        if path in self._watched:
+            return
+        if self._libc.inotify_add_watch(self.fd, os.fsencode(path), _INOTIFY_MASK) >= 0:
+            self._watched.add(path)
+
+    def wait(self, timeout):
+        """等待事件或超时，有事件时读空缓冲区并返回 True"""
+        ready, _, _ = select.select([self.fd], [], [], timeout)
+        if not ready:
+            return False
+        try:
+            while os.read(self.fd, 65536):
+                pass
+        except BlockingIOError:
+            pass
+        # 被删除或卸载的目录的监视会自动失效，之后重新添加
+        self._watched.clear()
+        return True
+
+    def close(self):
+        os.close(self.fd)
+
+
+class CardWatcher:
+    """监视挂载根目录，新出现相机卡时调用 on_card(路径)，卡被拔出时调用 on_removed(路径)
+
+    run() 在当前线程中循环，直到 should_stop() 返回 True；report_existing 为 True 时
+    启动时已经插着的卡也会回调一次。
+    """
+    def __init__(self, roots=None, on_card=None, on_removed=None, use_inotify=True, report_existing=True):
+        self.roots = [os.path.abspath(root) for root in (roots or default_mount_roots())]
+        self.on_card = on_card
+        self.on_removed = on_removed
+        self.report_existing = report_existing
+        self.known = set()
+        self._inotify = None
+        if use_inotify and sys.platform.startswith('linux'):
+            try:
+                self._inotify = _Inotify()
+            except (OSError, AttributeError) as e:
+                logging.info(f"inotify unavailable, polling mount roots instead: {e}")
+
+    @property
+    def poll_interval(self):
+        return INOTIFY_POLL_INTERVAL if self._inotify is not None else POLL_INTERVAL
+
+    def check(self):
+        """检查一次挂载根目录，回调新插入和已拔出的卡，返回当前的卡列表"""
+        cards = find_cards(self.roots)
+        current = set(cards)
+        for card in cards:
+            if card not in self.known:
+                logging.info(f"Card detected: {card}")
+                if self.on_card:
+                    self.on_card(card)
+        for card in sorted(self.known - current):
+            logging.info(f"Card removed: {card}")
+            if self.on_removed:
+                self.on_removed(card)
+        self.known = current
+        return cards
+
+    def _watch_roots(self):
+        for root in self.roots:
+            if os.path.isdir(root):
+                self._inotify.watch(root)
+                for child in _subfolders(root):
+                    if not os.path.ismount(child) and not is_camera_card(child):
+                        self._inotify.watch(child)
+
+    def run(self, should_stop=None):
+        if not self.report_existing:
+            self.known = set(find_cards(self.roots))
+        try:
+            while not (should_stop and should_stop()):
+                if self._inotify is not None:
+                    self._watch_roots()
+                self.check()
+                if should_stop and should_stop():
+                    break
+                if self._inotify is not None:
+                    self._inotify.wait(self.poll_interval)
+                else:
+                    time.sleep(self.poll_interval)
+        finally:
+            if self._inotify is not None:
+                self._inotify.close()
+                self._inotify = None
+
+
+class IngestProfile:
+    """保存在 config.ini 的 [Profile:名称] 段中的一套拷卡设置
+
+    volumes 为卷名通配符（如 SONY_A7*），插入匹配的卡时自动选用这套设置；
+    auto_ingest 为 True 时扫描完成后直接开始拷贝，无需点击；checksum_formats 为要写的校验清单格式。
+    """
+    def __init__(self, name, image_target='', video_target='', event_name='', separate_raw=False,
+                 hash_algorithm='', backup_roots=(), auto_ingest=False, volumes=(), checksum_formats=()):
+        self.name = name
+        self.image_target = image_target
+        self.video_target = video_target
+        self.event_name = event_name
+        self.separate_raw = separate_raw
+        self.hash_algorithm = hash_algorithm
+        self.backup_roots = list(backup_roots)
+        self.auto_ingest = auto_ingest
+        self.volumes = list(volumes)
+        self.checksum_formats = list(checksum_formats)
+
+    @classmethod
+    def from_section(cls, name, section):
+        return cls(
+            name,
+            image_target=section.get('image_target', ''),
+            video_target=section.get('video_target', ''),
+            event_name=section.get('event_name', ''),
+            separate_raw=section.getboolean('separate_raw', fallback=False),
+            hash_algorithm=section.get('hash_algorithm', ''),
+            backup_roots=[path.strip() for path in section.get('backup_directories', '').split(';') if path.strip()],
+            auto_ingest=section.getboolean('auto_ingest', fallback=False),
+            volumes=section.get('volumes', '').split(),
+            checksum_formats=section.get('checksum_formats', '').split())
+
+    def matches(self, card_path):
+        name = os.path.basename(os.path.normpath(card_path))
+        return any(fnmatch.fnmatch(name.lower(), pattern.lower()) for pattern in self.volumes)
+
+
+def load_profiles(config):
+    """从 ConfigParser 中读取所有 [Profile:名称] 段，返回 {名称: IngestProfile}"""
+    return {section[len(PROFILE_SECTION_PREFIX):].strip(): IngestProfile.from_section(
+                section[len(PROFILE_SECTION_PREFIX):].strip(), config[section])
+            for section in config.sections() if section.startswith(PROFILE_SECTION_PREFIX)}
+
+
+def select_profile(profiles, card_path, default_name=''):
+    """卷名匹配的配置优先，其次是默认配置，都没有时返回 None"""
+    for profile in profiles.values():
+        if profile.matches(card_path):
+            return profile
+    return profiles.get(default_name) if default_name else None
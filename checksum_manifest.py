@@ -0,0 +1,297 @@
+"""校验清单导出与导入：每个 日期_活动名称 文件夹一份，供 DIT 和后期核对
+
+拷贝时每个文件校验通过后立即把哈希追加到所在活动文件夹的清单中，不需要拷完后再用其他工具重新读一遍：
+    md5     活动文件夹名.md5     md5sum 格式（哈希␣␣相对路径），md5sum -c 可直接核对
+    sha256  活动文件夹名.sha256  sha256sum 格式
+    xxh     活动文件夹名.xxh     xxhsum -H2（XXH128）格式，需要安装 xxhash
+    mhl     ascmhl/ 目录         ASC MHL v2.0，每次拷卡追加一代（generation）并更新 ascmhl_chain.xml
+清单要求的算法与拷贝时的校验算法相同时直接复用拷贝得到的哈希，不同时在拷贝的数据流上顺带计算，卡只读一遍。
+目标目录中已有的清单（包括其他工具生成的 .md5/.sha256/.xxh/.mhl）会被读入：
+判断目标中是否已有相同文件（重复插卡、拷卡记录丢失后重拷）时优先使用其中的哈希，不再重新读取目标文件。
+"""
+import glob
+import hashlib
+import logging
+import os
+import socket
+import time
+import xml.etree.ElementTree as ElementTree
+from xml.sax.saxutils import escape
+
+from copy_engine import hash_file
+from hashing import available_algorithms, new_hasher
+
+FORMAT_MD5 = 'md5'
+FORMAT_SHA256 = 'sha256'
+FORMAT_XXH = 'xxh'
+FORMAT_MHL = 'mhl'
+CHECKSUM_FORMATS = (FORMAT_MD5, FORMAT_SHA256, FORMAT_XXH, FORMAT_MHL)
+
+# 文本清单：格式 → (哈希算法, 扩展名)
+_TEXT_FORMATS = {
+    FORMAT_MD5: ('md5', '.md5'),
+    FORMAT_SHA256: ('sha256', '.sha256'),
+    FORMAT_XXH: ('xxh128', '.xxh'),
+}
+# 读取已有清单时按扩展名识别算法（.xxh 系列按哈希长度区分）
+_IMPORT_EXTENSIONS = {'.md5': 'md5', '.sha256': 'sha256', '.xxh': None, '.xxh128': 'xxh128', '.xxh3': 'xxh3_64'}
+_XXH_BY_LENGTH = {32: 'xxh128', 16: 'xxh3_64'}
+
+MHL_DIR_NAME = 'ascmhl'
+MHL_CHAIN_NAME = 'ascmhl_chain.xml'
+_MHL_NAMESPACE = 'urn:ASC:MHL:v2.0'
+_MHL_CHAIN_NAMESPACE = 'urn:ASC:MHL:DIRECTORY:v2.0'
+# ASC MHL 中的哈希元素名 ↔ hashing 模块中的算法名
+_MHL_TAGS = {'md5': 'md5', 'xxh128': 'xxh128', 'xxh3_64': 'xxh3'}
+_MHL_ALGORITHMS = {tag: algorithm for algorithm, tag in _MHL_TAGS.items()}
+# MHL 中的算法优先顺序：拷贝算法不在其中时按此顺序选一个可用的
+_MHL_PREFERENCE = ('xxh128', 'xxh3_64', 'md5')
+# 不属于素材、不记入 MHL 的文件
+_MHL_IGNORE = ('.DS_Store', MHL_DIR_NAME, MHL_DIR_NAME + '/', '.previews', '*.md5', '*.sha256', '*.xxh')
+
+# 校验清单文件的扩展名（本程序和其他工具生成的），这些文件不是素材
+_CHECKSUM_EXTENSIONS = set(_IMPORT_EXTENSIONS) | {'.mhl'}
+
+_BASE58 = '123456789ABCDEFGHJKLMNPQRSTUVWXYZabcdefghijkmnopqrstuvwxyz'
+
+
+def check_formats(formats):
+    """检查清单格式和所需的哈希算法是否可用，不可用时抛出 ValueError"""
+    for checksum_format in formats:
+        if checksum_format not in CHECKSUM_FORMATS:
+            raise ValueError(f'未知的校验清单格式：{checksum_format}（可选 {", ".join(CHECKSUM_FORMATS)}）')
+        if checksum_format in _TEXT_FORMATS:
+            new_hasher(_TEXT_FORMATS[checksum_format][0])
+
+
+def is_checksum_name(name):
+    """文件或目录名是否属于校验清单：.md5/.sha256/.xxh/.mhl 文件以及 ascmhl 目录"""
+    return (name in (MHL_DIR_NAME, MHL_CHAIN_NAME)
+            or os.path.splitext(name)[1].lower() in _CHECKSUM_EXTENSIONS)
+
+
+def c4_id(data):
+    """C4 ID（SMPTE ST 2114）：SHA-512 的 base58 编码，ASC MHL 的链文件用它标识每一代清单"""
+    number = int.from_bytes(hashlib.sha512(data).digest(), 'big')
+    digits = []
+    while number:
+        number, remainder = divmod(number, 58)
+        digits.append(_BASE58[remainder])
+    return 'c4' + ''.join(reversed(digits)).rjust(88, '1')
+
+
+def _iso_time(timestamp):
+    return time.strftime('%Y-%m-%dT%H:%M:%S+00:00', time.gmtime(timestamp))
+
+
+def _parse_text_manifest(manifest_path, algorithm):
+    """解析 md5sum/sha256sum/xxhsum 格式（哈希␣␣路径 或 哈希␣*路径）以及 BSD 格式（MD5 (路径) = 哈希）"""
+    checksums = {}
+    with open(manifest_path, encoding='utf-8', errors='replace') as f:
+        for line in f:
+            line = line.rstrip('\r\n')
+            if not line or line.startswith('#'):
+                continue
+            if ') = ' in line and line.partition(' (')[0].isupper():
+                path, _, file_hash = line.partition(' (')[2].rpartition(') = ')
+            else:
+                file_hash, _, path = line.partition(' ')
+                path = path[1:] if path[:1] in (' ', '*') else path
+            file_hash = file_hash.strip().lower()
+            file_algorithm = algorithm or _XXH_BY_LENGTH.get(len(file_hash))
+            if path and file_hash and file_algorithm:
+                checksums.setdefault(path.replace('\\', '/'), {})[file_algorithm] = file_hash
+    return checksums
+
+
+def _parse_mhl(mhl_path):
+    checksums = {}
+    for hash_element in ElementTree.parse(mhl_path).getroot().iter(f'{{{_MHL_NAMESPACE}}}hash'):
+        path = hash_element.findtext(f'{{{_MHL_NAMESPACE}}}path')
+        if not path:
+            continue
+        for child in hash_element:
+            algorithm = _MHL_ALGORITHMS.get(child.tag.rpartition('}')[2])
+            if algorithm and child.text:
+                checksums.setdefault(path, {})[algorithm] = child.text.strip().lower()
+    return checksums
+
+
+def load_checksums(event_folder):
+    """读取活动文件夹中已有的所有校验清单，返回 {相对路径（/ 分隔）: {算法: 哈希}}，后读到的覆盖先读到的"""
+    checksums = {}
+    try:
+        names = sorted(os.listdir(event_folder))
+    except OSError:
+        return checksums
+    sources = [(os.path.join(event_folder, name), _IMPORT_EXTENSIONS[os.path.splitext(name)[1].lower()])
+               for name in names if os.path.splitext(name)[1].lower() in _IMPORT_EXTENSIONS]
+    for manifest_path, algorithm in sources:
+        try:
+            for path, hashes in _parse_text_manifest(manifest_path, algorithm).items():
+                checksums.setdefault(path, {}).update(hashes)
+        except OSError as e:
+            logging.error(f"Failed to read checksum manifest {manifest_path}: {e}")
+    for mhl_path in sorted(glob.glob(os.path.join(glob.escape(event_folder), MHL_DIR_NAME, '*.mhl'))):
+        try:
+            for path, hashes in _parse_mhl(mhl_path).items():
+                checksums.setdefault(path, {}).update(hashes)
+        except (OSError, ElementTree.ParseError) as e:
+            logging.error(f"Failed to read MHL {mhl_path}: {e}")
+    return checksums
+
+
+def locate_event_folder(path, roots):
+    """返回 (活动文件夹, 文件在其中的相对路径，/ 分隔)，活动文件夹即根目录下的第一级目录；不在其中时返回 (None, None)"""
+    path = os.path.abspath(path)
+    for root in sorted({os.path.abspath(root) for root in roots}, key=len, reverse=True):
+        if path.startswith(root + os.sep):
+            parts = os.path.relpath(path, root).split(os.sep)
+            if len(parts) > 1:
+                return os.path.join(root, parts[0]), '/'.join(parts[1:])
+    return None, None
+
+
+class ChecksumIndex:
+    """按目标根目录下的活动文件夹缓存已导入的校验清单，按文件路径查询哈希
+
+    roots 为目标根目录列表，活动文件夹即根目录下的第一级目录。
+    """
+    def __init__(self, roots):
+        self.roots = list(roots)
+        self._folders = {}
+
+    def checksums(self, event_folder):
+        if event_folder not in self._folders:
+            self._folders[event_folder] = load_checksums(event_folder)
+        return self._folders[event_folder]
+
+    def lookup(self, path, algorithm):
+        """清单中记录的哈希，没有记录时返回 None"""
+        event_folder, rel_path = locate_event_folder(path, self.roots)
+        if event_folder is None:
+            return None
+        return self.checksums(event_folder).get(rel_path, {}).get(algorithm)
+
+
+class ChecksumManifestWriter:
+    """拷贝过程中逐个文件写校验清单（只在调用方线程中使用）
+
+    文本清单每个文件追加一行并立即 flush，中途中断也是有效的清单；MHL 在 close() 时写出这一代。
+    已有清单中哈希相同的文件不再重复记录。
+    """
+    def __init__(self, formats, copy_algorithm):
+        check_formats(formats)
+        self.formats = list(dict.fromkeys(formats))
+        self.copy_algorithm = copy_algorithm
+        self.mhl_algorithm = None
+        if FORMAT_MHL in self.formats:
+            available = set(available_algorithms())
+            self.mhl_algorithm = (copy_algorithm if copy_algorithm in _MHL_TAGS else
+                                  next(algorithm for algorithm in _MHL_PREFERENCE if algorithm in available))
+        self._files = {}
+        self._existing = {}
+        self._mhl_entries = {}
+
+    @property
+    def algorithms(self):
+        algorithms = {_TEXT_FORMATS[checksum_format][0] for checksum_format in self.formats
+                      if checksum_format in _TEXT_FORMATS}
+        if self.mhl_algorithm:
+            algorithms.add(self.mhl_algorithm)
+        return algorithms
+
+    @property
+    def extra_algorithms(self):
+        """除拷贝算法外还需要在拷贝数据流上顺带计算的算法"""
+        return sorted(self.algorithms - {self.copy_algorithm})
+
+    def _manifest_file(self, event_folder, checksum_format):
+        key = (event_folder, checksum_format)
+        if key not in self._files:
+            extension = _TEXT_FORMATS[checksum_format][1]
+            self._files[key] = open(os.path.join(event_folder, os.path.basename(event_folder) + extension), 'a',
+                                    encoding='utf-8', newline='\n')
+        return self._files[key]
+
+    def add(self, event_folder, rel_path, file_path, digests):
+        """记录一个校验通过的文件；digests 中缺少的算法（如续传的文件）从 file_path 计算并补进 digests"""
+        if event_folder not in self._existing:
+            self._existing[event_folder] = load_checksums(event_folder)
+        existing = self._existing[event_folder].get(rel_path, {})
+        for algorithm in self.algorithms:
+            if algorithm not in digests:
+                digests[algorithm] = hash_file(file_path, algorithm=algorithm)
+        for checksum_format in self.formats:
+            if checksum_format == FORMAT_MHL:
+                if existing.get(self.mhl_algorithm) != digests[self.mhl_algorithm]:
+                    st = os.stat(file_path)
+                    self._mhl_entries.setdefault(event_folder, []).append(
+                        (rel_path, st.st_size, st.st_mtime, digests[self.mhl_algorithm]))
+                continue
+            algorithm = _TEXT_FORMATS[checksum_format][0]
+            if existing.get(algorithm) == digests[algorithm]:
+                continue
+            f = self._manifest_file(event_folder, checksum_format)
+            f.write(f'{digests[algorithm]}  {rel_path}\n')
+            f.flush()
+
+    def _write_mhl(self, event_folder, entries):
+        """写出一代 ASC MHL 并登记到 ascmhl_chain.xml"""
+        mhl_dir = os.path.join(event_folder, MHL_DIR_NAME)
+        os.makedirs(mhl_dir, exist_ok=True)
+        chain_path = os.path.join(mhl_dir, MHL_CHAIN_NAME)
+        generations = []
+        if os.path.exists(chain_path):
+            root = ElementTree.parse(chain_path).getroot()
+            for hashlist in root.iter(f'{{{_MHL_CHAIN_NAMESPACE}}}hashlist'):
+                generations.append((int(hashlist.get('sequencenr')),
+                                    hashlist.findtext(f'{{{_MHL_CHAIN_NAMESPACE}}}path'),
+                                    hashlist.findtext(f'{{{_MHL_CHAIN_NAMESPACE}}}c4')))
+        sequence = max((generation[0] for generation in generations), default=0) + 1
+        now = time.time()
+        tag = _MHL_TAGS[self.mhl_algorithm]
+        lines = ['<?xml version="1.0" encoding="UTF-8"?>',
+                 f'<hashlist version="2.0" xmlns="{_MHL_NAMESPACE}">',
+                 '  <creatorinfo>',
+                 f'    <creationdate>{_iso_time(now)}</creationdate>',
+                 f'    <hostname>{escape(socket.gethostname())}</hostname>',
+                 '    <tool version="1.2">sd_copy_hub</tool>',
+                 '  </creatorinfo>',
+                 '  <processinfo>',
+                 '    <process>transfer</process>',
+                 '    <ignore>']
+        lines += [f'      <pattern>{escape(pattern)}</pattern>' for pattern in _MHL_IGNORE]
+        lines += ['    </ignore>', '  </processinfo>', '  <hashes>']
+        for rel_path, size, mtime, file_hash in entries:
+            lines += ['    <hash>',
+                      f'      <path size="{size}" lastmodificationdate="{_iso_time(mtime)}">{escape(rel_path)}</path>',
+                      f'      <{tag} action="original" hashdate="{_iso_time(now)}">{file_hash}</{tag}>',
+                      '    </hash>']
+        lines += ['  </hashes>', '</hashlist>', '']
+        data = '\n'.join(lines).encode('utf-8')
+        stamp = time.strftime('%Y-%m-%d_%H%M%SZ', time.gmtime(now))
+        name = f'{sequence:04d}_{os.path.basename(event_folder)}_{stamp}.mhl'
+        with open(os.path.join(mhl_dir, name), 'wb') as f:
+            f.write(data)
+        generations.append((sequence, name, c4_id(data)))
+        chain = ['<?xml version="1.0" encoding="UTF-8"?>', f'<ascmhldirectory xmlns="{_MHL_CHAIN_NAMESPACE}">']
+        for number, path, c4 in generations:
+            chain += [f'  <hashlist sequencenr="{number}">', f'    <path>{escape(path)}</path>',
+                      f'    <c4>{c4}</c4>', '  </hashlist>']
+        chain += ['</ascmhldirectory>', '']
+        temp_path = chain_path + '.tmp'
+        with open(temp_path, 'w', encoding='utf-8', newline='\n') as f:
+            f.write('\n'.join(chain))
+        os.replace(temp_path, chain_path)
+
+    def close(self):
+        for f in self._files.values():
+            f.close()
+        self._files = {}
+        for event_folder, entries in self._mhl_entries.items():
+            try:
+                self._write_mhl(event_folder, entries)
+            except (OSError, ElementTree.ParseError) as e:
+                logging.error(f"Failed to write MHL in {event_folder}: {e}")
+        self._mhl_entries = {}
@@ -0,0 +1,276 @@
+"""拷卡助手命令行入口（无需图形界面）
+
+示例：
+    python cli.py --source /media/card1 --source /media/card2 \\
+        --image-target ~/Pictures --video-target ~/Movies --event 公司活动 --separate-raw
+
+等待插卡并自动拷贝（使用 config.ini 中的 [Profile:婚礼] 拷卡配置，任意目录都可以充当挂载根目录）：
+    python cli.py --watch --ingest-profile 婚礼
+
+为每个活动文件夹写 ASC MHL 和 md5sum 校验清单（拷贝时顺带计算，不需要拷完再读一遍）：
+    python cli.py --source /media/card1 --dest /mnt/raid --event 广告片 --checksum-format mhl --checksum-format md5
+
+每张卡的进度和结果以 JSON Lines 输出到标准输出，便于接入自动化流程。
+"""
+import argparse
+import configparser
+import json
+import logging
+import os
+import re
+import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from card_watcher import CardWatcher, load_profiles, select_profile
+from checksum_manifest import CHECKSUM_FORMATS, check_formats
+from durability import DEFAULT_FSYNC_BATCH_SIZE, DEFAULT_FSYNC_POLICY, FSYNC_POLICIES
+from hashing import ALGORITHM_AUTO
+from ingest_engine import DEFAULT_IMAGE_WORKERS, DEFAULT_VIDEO_WORKERS, IngestEngine, IngestOptions
+from instrumentation import configure_logging, instrumentation
+from library_index import DEDUP_REPORT, DEDUP_SKIP
+from previews import DEFAULT_PREVIEW_SIZE
+from rename_template import DEFAULT_IMAGE_TEMPLATE, DEFAULT_VIDEO_TEMPLATE, FIELDS, compile_template
+from routing import load_routing
+from scheduler import DEFAULT_ORDER, ORDER_POLICIES
+from staging import BackgroundMover
+
+# 监视模式下同时拷贝的卡数上限（同一设备上还受 --per-device 限制）
+WATCH_MAX_CARDS = 8
+# USB 端口路径，如 /sys/devices/pci0000:00/.../usb2/2-1/2-1.3/...
+_USB_PORT_PATTERN = re.compile(r'^\d+-\d+(\.\d+)*$')
+
+
+def device_group(path):
+    """返回卡所在的设备分组，同一分组的卡共享并发上限
+
+    Linux 上按 USB 拓扑归到同一个集线器（插在同一个 USB Hub 上的读卡器互相抢带宽），
+    其他系统或无法识别时按文件系统所在设备（st_dev）分组。
+    """
+    try:
+        st_dev = os.stat(path).st_dev
+    except OSError:
+        return path
+    sys_path = f'/sys/dev/block/{os.major(st_dev)}:{os.minor(st_dev)}' if hasattr(os, 'major') else ''
+    if sys_path and os.path.exists(sys_path):
+        ports = [part for part in os.path.realpath(sys_path).split('/') if _USB_PORT_PATTERN.match(part)]
+        if ports:
+            # 最后一个端口是读卡器本身，它的上一级就是所在的集线器
+            return ports[-2] if len(ports) > 1 else ports[-1]
+    return f'dev:{st_dev}'
+
+
+class JsonEmitter:
+    """多线程安全地输出 JSON Lines"""
+    def __init__(self, stream=sys.stdout):
+        self.stream = stream
+        self._lock = threading.Lock()
+
+    def emit(self, event, **fields):
+        line = json.dumps({'event': event, **fields}, ensure_ascii=False)
+        with self._lock:
+            self.stream.write(line + '\n')
+            self.stream.flush()
+
+
+def ingest_card(sd_card, args, emitter, device_semaphores, mover=None):
+    group = device_group(sd_card)
+    emitter.emit('queued', sd_card=sd_card, device_group=group)
+    with device_semaphores[group]:
+        options = IngestOptions(
+            args.image_target, args.video_target, sd_card, args.event, selected_dates=args.date,
+            separate_raw=args.separate_raw, image_workers=args.image_workers,
+            video_workers=args.video_workers, backup_roots=args.backup, hash_algorithm=args.hash,
+            library_dedup=args.library_dedup, fsync_policy=args.fsync, fsync_batch_size=args.fsync_batch,
+            image_template=args.rename_images, video_template=args.rename_videos,
+            previews=args.previews, preview_size=args.preview_size, routing=args.routing,
+            order=args.order, staging_dir=args.staging, checksum_formats=args.checksum_format)
+
+        on_progress = None
+        if args.progress:
+            def on_progress(snapshot):
+                emitter.emit('progress', sd_card=sd_card, **snapshot.to_dict())
+
+        emitter.emit('started', sd_card=sd_card, device_group=group)
+        try:
+            result = IngestEngine(options, on_progress=on_progress).run()
+        except Exception as e:
+            logging.exception(f"Ingest failed for {sd_card}")
+            emitter.emit('error', sd_card=sd_card, error=str(e))
+            return False
+        payload = result.to_dict()
+        if not args.file_details:
+            payload.pop('files')
+            payload['failed_files'] = [task.src_path for task in result.failed_tasks]
+        emitter.emit('result', **payload)
+        if mover is not None:
+            # 卡已经拷到暂存目录并校验完，可以拔卡了；搬运到目标目录在后台进行
+            mover.wake()
+        return not result.failed_tasks
+
+
+def apply_profile(args, profile):
+    """命令行未指定的选项用拷卡配置补全（命令行优先），返回新的参数对象"""
+    args = argparse.Namespace(**vars(args))
+    if profile is not None:
+        args.image_target = args.image_target or profile.image_target or None
+        args.video_target = args.video_target or profile.video_target or None
+        args.event = args.event or profile.event_name
+        args.separate_raw = args.separate_raw or profile.separate_raw
+        args.backup = args.backup or profile.backup_roots
+        if args.hash == ALGORITHM_AUTO and profile.hash_algorithm:
+            args.hash = profile.hash_algorithm
+        args.checksum_format = args.checksum_format or profile.checksum_formats
+    check_formats(args.checksum_format)
+    if not args.image_target or not args.video_target:
+        raise ValueError('请通过 --dest 或 --image-target/--video-target（或拷卡配置）指定目标目录')
+    return args
+
+
+def watch_cards(args, profiles, emitter, device_semaphores, per_device, mover=None):
+    """等待插卡，每张新卡按匹配的拷卡配置自动拷贝；拷完 --watch-limit 张卡后退出（0 表示一直运行，Ctrl+C 结束）"""
+    pool = ThreadPoolExecutor(max_workers=WATCH_MAX_CARDS)
+    futures = []
+
+    def on_card(sd_card):
+        emitter.emit('card_detected', sd_card=sd_card)
+        try:
+            card_args = apply_profile(args, select_profile(profiles, sd_card, args.ingest_profile))
+        except ValueError as e:
+            emitter.emit('error', sd_card=sd_card, error=str(e))
+            futures.append(None)
+            return
+        device_semaphores.setdefault(device_group(sd_card), threading.Semaphore(per_device))
+        futures.append(pool.submit(ingest_card, sd_card, card_args, emitter, device_semaphores, mover))
+
+    watcher = CardWatcher(args.watch_root or None, on_card=on_card,
+                          on_removed=lambda sd_card: emitter.emit('card_removed', sd_card=sd_card))
+    emitter.emit('watching', roots=watcher.roots)
+    try:
+        watcher.run(should_stop=lambda: args.watch_limit and len(futures) >= args.watch_limit)
+    except KeyboardInterrupt:
+        pass
+    pool.shutdown(wait=True)
+    return [future is not None and future.result() for future in futures]
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description='拷卡助手命令行：把 SD 卡中的图片和视频拷贝到目标目录并校验')
+    parser.add_argument('--source', action='append', default=[],
+                        help='SD 卡目录，可重复指定多张卡同时拷贝')
+    parser.add_argument('--watch', action='store_true',
+                        help='监视挂载目录，插入带 DCIM/PRIVATE 目录的卡后自动拷贝')
+    parser.add_argument('--watch-root', action='append', default=[],
+                        help='--watch 监视的挂载根目录，可重复指定（默认 /media、/run/media、/mnt 或 /Volumes）')
+    parser.add_argument('--watch-limit', type=int, default=0, help='--watch 拷完多少张卡后退出，0 表示一直运行')
+    parser.add_argument('--ingest-profile',
+                        help='使用配置文件中 [Profile:名称] 段的拷卡配置补全未指定的选项；卷名匹配 volumes 的配置优先')
+    parser.add_argument('--config', default='config.ini', help='读取拷卡配置的配置文件')
+    parser.add_argument('--dest', help='图片和视频共用的目标目录（未单独指定时使用）')
+    parser.add_argument('--image-target', help='图片目标目录')
+    parser.add_argument('--video-target', help='视频目标目录')
+    parser.add_argument('--event', default='', help='活动名称，用于生成 日期_活动名称 文件夹')
+    parser.add_argument('--date', action='append', default=[], help='只拷贝指定日期（YYYYMMDD），可重复指定')
+    parser.add_argument('--separate-raw', action='store_true', help='RAW 和 JPG 文件分开保存')
+    parser.add_argument('--rename-images', default=DEFAULT_IMAGE_TEMPLATE,
+                        help=f'图片重命名模板，如 {{date}}_{{time}}_{{camera}}_{{orig}}；为空保留原名。'
+                             f'可用字段：{", ".join(sorted(FIELDS))}')
+    parser.add_argument('--rename-videos', default=DEFAULT_VIDEO_TEMPLATE,
+                        help=f'视频重命名模板（默认 {DEFAULT_VIDEO_TEMPLATE}），附属的 M01.XML 等文件同步改名')
+    parser.add_argument('--previews', action='store_true',
+                        help='拷贝时从 RAW 中提取内嵌预览（JPG 缩小）到活动文件夹的 .previews 目录')
+    parser.add_argument('--preview-size', type=int, default=DEFAULT_PREVIEW_SIZE, help='预览图长边像素数')
+    parser.add_argument('--rules', help='路由规则文件（python routing.py 打印内置规则，可在其基础上修改）')
+    parser.add_argument('--backup', action='append', default=[], help='备份目录，可重复指定')
+    parser.add_argument('--staging',
+                        help='暂存目录（本地高速盘）：卡先拷到这里并校验，之后在后台搬运到目标目录和备份目录，'
+                             '中断后再次运行继续搬运')
+    parser.add_argument('--checksum-format', action='append', default=[], choices=CHECKSUM_FORMATS,
+                        help='在每个活动文件夹中写校验清单：md5 / sha256 / xxh（XXH128）/ mhl（ASC MHL），可重复指定')
+    parser.add_argument('--hash', default=ALGORITHM_AUTO, help='校验算法：auto / sha256 / blake2b / xxh128')
+    parser.add_argument('--library-dedup', choices=(DEDUP_SKIP, DEDUP_REPORT),
+                        help='检查图库中是否已归档过相同文件：skip 跳过，report 只报告')
+    parser.add_argument('--image-workers', type=int, default=DEFAULT_IMAGE_WORKERS, help='每张卡拷贝小文件的线程数')
+    parser.add_argument('--video-workers', type=int, default=DEFAULT_VIDEO_WORKERS, help='每张卡拷贝大文件的顺序通道数')
+    parser.add_argument('--fsync', choices=FSYNC_POLICIES, default=DEFAULT_FSYNC_POLICY,
+                        help='落盘策略（fsync 数据、重命名、fsync 目录）：每个文件 / 每批文件 / 每个目录 / 结束时')
+    parser.add_argument('--fsync-batch', type=int, default=DEFAULT_FSYNC_BATCH_SIZE,
+                        help='--fsync batch 时每多少个文件落盘一次')
+    parser.add_argument('--order', choices=ORDER_POLICIES, default=DEFAULT_ORDER,
+                        help='拷贝顺序：scan 扫描顺序（边扫描边拷贝）/ physical 卡上物理位置 / small-first 小文件优先 / '
+                             'by-folder 按目标目录分组')
+    parser.add_argument('--per-device', type=int, default=1,
+                        help='同一设备（同一 USB 集线器）上同时拷贝的卡数上限')
+    parser.add_argument('--progress', action='store_true', help='输出进度事件（最多每秒 20 次）')
+    parser.add_argument('--file-details', action='store_true', help='在结果中列出每个文件的校验信息')
+    parser.add_argument('--log-level', default='WARNING', help='日志级别（输出到标准错误）')
+    parser.add_argument('--log-file', help='同时把日志写入文件')
+    parser.add_argument('--event-log', help='把每个文件的处理过程和耗时写入 JSON Lines 事件日志')
+    parser.add_argument('--profile', help='结束后把各环节的累计计数和耗时写入 JSON 文件')
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    configure_logging(args.log_level, log_file=args.log_file)
+    if args.event_log or args.profile:
+        instrumentation.enable(event_log=args.event_log)
+    if not args.source and not args.watch:
+        print('错误：请通过 --source 指定 SD 卡目录，或使用 --watch 等待插卡', file=sys.stderr)
+        return 2
+    args.image_target = args.image_target or args.dest
+    args.video_target = args.video_target or args.dest
+    config = configparser.ConfigParser()
+    config.read(args.config, encoding='utf-8')
+    profiles = load_profiles(config)
+    try:
+        if args.ingest_profile and args.ingest_profile not in profiles:
+            raise ValueError(f'{args.config} 中没有拷卡配置 [Profile:{args.ingest_profile}]')
+        compile_template(args.rename_images)
+        compile_template(args.rename_videos)
+        args.routing = load_routing(args.rules)
+        card_args = [apply_profile(args, select_profile(profiles, sd_card, args.ingest_profile))
+                     for sd_card in args.source]
+    except (OSError, ValueError) as e:
+        print(f'错误：{e}', file=sys.stderr)
+        return 2
+
+    emitter = JsonEmitter()
+    per_device = max(1, args.per_device)
+    device_semaphores = {}
+    for sd_card in args.source:
+        device_semaphores.setdefault(device_group(sd_card), threading.Semaphore(per_device))
+
+    mover = None
+    if args.staging:
+        on_move_progress = None
+        if args.progress:
+            def on_move_progress(snapshot):
+                emitter.emit('move_progress', staging=args.staging, **snapshot.to_dict())
+        moves_ok = []
+
+        def on_moved(moved, failed):
+            moves_ok.append(not failed)
+            emitter.emit('moved', staging=args.staging, moved=moved, failed=failed)
+
+        mover = BackgroundMover(args.staging, on_progress=on_move_progress, on_finished=on_moved,
+                                fsync_policy=args.fsync, fsync_batch_size=args.fsync_batch)
+        mover.start()
+
+    if args.watch:
+        results = watch_cards(args, profiles, emitter, device_semaphores, per_device, mover)
+    else:
+        with ThreadPoolExecutor(max_workers=len(args.source)) as pool:
+            results = list(pool.map(lambda item: ingest_card(item[0], item[1], emitter, device_semaphores, mover),
+                                    zip(args.source, card_args)))
+    if mover is not None:
+        # 等待暂存目录中的文件全部搬运到目标目录
+        mover.close()
+        results.append(not moves_ok or moves_ok[-1])
+    if args.profile:
+        instrumentation.dump(args.profile)
+    return 0 if all(results) else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
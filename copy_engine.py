@@ -0,0 +1,383 @@
+import logging
+import os
+import queue
+import shutil
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import ExitStack
+
+from durability import (DEFAULT_FSYNC_BATCH_SIZE, DEFAULT_FSYNC_POLICY, FSYNC_FILE, SyncBatcher, commit_partials,
+                        partial_path, preallocate)
+from hashing import DEFAULT_ALGORITHM, new_hasher
+from instrumentation import instrumentation
+from progress import STAGE_VERIFY
+from verifier import VERIFY_WORKERS, VerificationPipeline
+
+# 每次读取的块大小：4MB，既能吃满 SD 卡读卡器带宽，又能保证内存占用固定
+CHUNK_SIZE = 4 * 1024 * 1024
+# 同时在排队或拷贝中的任务数上限：规划跑在拷贝前面，但不会把整张卡的任务都堆在内存里
+MAX_QUEUED_TASKS = 256
+_FEED_DONE = object()
+
+
+def _no_clock():
+    return 0.0
+
+
+def copy_with_hash(src_path, dst_paths, chunk_size=CHUNK_SIZE, resume_offset=0, on_progress=None,
+                   algorithm=DEFAULT_ALGORITHM, timings=None, preallocate_size=None, on_chunk=None):
+    """流式拷贝文件，拷贝的同时计算源文件哈希，返回源文件哈希（algorithm 见 hashing 模块）
+
+    dst_paths 可以是单个路径，也可以是多个路径（主目录 + 备份目录），
+    每个从卡上读出的块会依次写入所有目标，卡只读一遍、哈希只算一次。
+    resume_offset 大于 0 时为断点续传：已写入的前半段从本地主目标读取计算哈希，
+    卡上只读取剩余部分。on_progress(已完成字节数) 在每个块写入后回调。
+    timings 为字典时累计 open/read/hash/write 各环节的耗时（秒）。
+    preallocate_size 为文件总大小时，写入前先为剩余部分预分配磁盘空间。
+    on_chunk(块在文件中的偏移, 块数据) 让其他环节（如预览截取）复用流经内存的数据，回调返回后块数据即失效。
+    """
+    if isinstance(dst_paths, str):
+        dst_paths = [dst_paths]
+    # 复用同一块缓冲区，避免大文件（如 30GB 的 4K 视频）把内存吃满
+    buffer = bytearray(chunk_size)
+    view = memoryview(buffer)
+    source_hash = new_hasher(algorithm)
+    mode = 'wb'
+    if resume_offset:
+        if _hash_prefix(src_path, dst_paths, resume_offset, source_hash, buffer):
+            mode = 'r+b'
+        else:
+            # 临时文件已写入的部分与卡上不一致（如目标盘出错），不能续传，从头重新拷贝
+            logging.warning(f"Partial copy of {src_path} does not match the source, restarting from the beginning")
+            source_hash = new_hasher(algorithm)
+            resume_offset = 0
+    bytes_done = resume_offset
+    # 不需要计时时用返回 0 的假时钟，循环里不多一次分支
+    clock = time.perf_counter if timings is not None else _no_clock
+    read_time = hash_time = write_time = 0.0
+    start = clock()
+    with open(src_path, 'rb') as fsrc, ExitStack() as stack:
+        fdsts = [stack.enter_context(open(dst_path, mode)) for dst_path in dst_paths]
+        if resume_offset:
+            fsrc.seek(resume_offset)
+            for fdst in fdsts:
+                fdst.seek(resume_offset)
+                fdst.truncate()
+        if preallocate_size:
+            for fdst in fdsts:
+                preallocate(fdst.fileno(), bytes_done, preallocate_size - bytes_done)
+        open_time = clock() - start
+        while True:
+            t0 = clock()
+            read_size = fsrc.readinto(buffer)
+            t1 = clock()
+            if not read_size:
+                break
+            chunk = view[:read_size]
+            source_hash.update(chunk)
+            t2 = clock()
+            for fdst in fdsts:
+                fdst.write(chunk)
+            t3 = clock()
+            if on_chunk:
+                on_chunk(bytes_done, chunk)
+            read_time += t1 - t0
+            hash_time += t2 - t1
+            write_time += t3 - t2
+            bytes_done += read_size
+            if on_progress:
+                on_progress(bytes_done)
+        t0 = clock()
+    # 与 copy2 一致：保留修改时间等元数据（后续按日期分类依赖 mtime）
+    for dst_path in dst_paths:
+        shutil.copystat(src_path, dst_path)
+    if timings is not None:
+        # 关闭文件（把剩余数据交给内核）和 copystat 计入写入耗时
+        write_time += clock() - t0
+        timings.update(open=open_time, read=read_time, hash=hash_time, write=write_time)
+    return source_hash.hexdigest()
+
+
+def _hash_prefix(src_path, dst_paths, length, file_hash, buffer):
+    """断点续传：把源文件前 length 个字节累加到 file_hash 中，同时与各目标已写入的部分逐块比较
+
+    哈希只取自源文件，目标上损坏的部分不会混进作为校验基准的源文件哈希；
+    任一目标与源文件不一致或比断点短时返回 False，调用方应从头重新拷贝。
+    """
+    view = memoryview(buffer)
+    remaining = length
+    with open(src_path, 'rb') as fsrc, ExitStack() as stack:
+        fdsts = [stack.enter_context(open(dst_path, 'rb')) for dst_path in dst_paths]
+        while remaining:
+            read_size = fsrc.readinto(view[:min(len(buffer), remaining)])
+            if not read_size:
+                raise IOError(f'{src_path} 比记录的断点位置短，无法续传')
+            chunk = view[:read_size]
+            if any(fdst.read(read_size) != chunk for fdst in fdsts):
+                return False
+            file_hash.update(chunk)
+            remaining -= read_size
+    return True
+
+
+def hash_file(file_path, chunk_size=CHUNK_SIZE, algorithm=DEFAULT_ALGORITHM):
+    """分块计算文件哈希，内存占用与文件大小无关"""
+    buffer = bytearray(chunk_size)
+    view = memoryview(buffer)
+    file_hash = new_hasher(algorithm)
+    with open(file_path, 'rb') as f:
+        while True:
+            read_size = f.readinto(buffer)
+            if not read_size:
+                break
+            file_hash.update(view[:read_size])
+    return file_hash.hexdigest()
+
+
+def verify_copy(dst_path, source_hash, chunk_size=CHUNK_SIZE, algorithm=DEFAULT_ALGORITHM):
+    """校验目标文件：重新读取目标文件并与拷贝时得到的源文件哈希比对"""
+    return hash_file(dst_path, chunk_size, algorithm) == source_hash
+
+
+# 大于该阈值的文件（主要是视频）走顺序拷贝通道，避免多个大文件同时读卡互相抢带宽
+LARGE_FILE_THRESHOLD = 64 * 1024 * 1024
+
+
+class CopyTask:
+    """单个文件的拷贝任务，目标路径在调度前就已确定
+
+    dst_paths 第一个是主目标，其余为备份目标；拷贝和校验都在对应的临时文件（write_paths）上进行，
+    校验通过后才重命名为正式文件名。
+    """
+    def __init__(self, src_path, dst_paths, size, is_video, resume_offset=0, manifest=None, manifest_key=None,
+                 hash_algorithm=DEFAULT_ALGORITHM):
+        self.src_path = src_path
+        self.dst_paths = list(dst_paths)
+        self.size = size
+        self.is_video = is_video
+        self.hash_algorithm = hash_algorithm
+        # 断点续传位置，以及记录拷贝状态的清单（见 ingest_manifest）
+        self.resume_offset = resume_offset
+        self.manifest = manifest
+        self.manifest_key = manifest_key
+        self.source_hash = None
+        self.failed_paths = []
+        self.error = None
+        # 开启埋点时记录各环节耗时（秒），如 {'read': ..., 'hash': ..., 'verify': ...}
+        self.timings = None
+        # 预览图缓存路径（见 previews 模块），None 表示不生成预览
+        self.preview_path = None
+        # 校验清单（见 checksum_manifest 模块）需要的其他算法，在拷贝的数据流上顺带计算，结果为 {算法: 哈希}
+        self.extra_algorithms = ()
+        self.extra_digests = {}
+
+    @property
+    def dst_path(self):
+        return self.dst_paths[0]
+
+    @property
+    def write_paths(self):
+        return [partial_path(path) for path in self.dst_paths]
+
+    @property
+    def verified(self):
+        return self.source_hash is not None and self.error is None and not self.failed_paths
+
+    @property
+    def is_large(self):
+        return self.is_video or self.size >= LARGE_FILE_THRESHOLD
+
+
+def mirror_path(path, root, backup_root):
+    """把主目标下的路径映射到备份根目录下的相同相对位置"""
+    return os.path.join(backup_root, os.path.relpath(path, root))
+
+
+def copy_task(task, tracker=None, on_chunk=None):
+    """只执行拷贝：一次读卡写入所有目标，得到源文件哈希（校验另行进行）
+
+    tracker 为 progress.ProgressTracker，按写入的字节数累计进度；on_chunk 见 copy_with_hash。
+    task.extra_algorithms 中的算法同时在数据流上计算（续传的文件只读了后半段，不计算，由清单自行补算）。
+    """
+    last_done = task.resume_offset
+    extra_hashers = {}
+    if task.extra_algorithms and not task.resume_offset:
+        extra_hashers = {algorithm: new_hasher(algorithm) for algorithm in task.extra_algorithms}
+        forward = on_chunk
+
+        def on_chunk(offset, chunk):
+            for hasher in extra_hashers.values():
+                hasher.update(chunk)
+            if forward:
+                forward(offset, chunk)
+
+    def on_progress(bytes_done):
+        nonlocal last_done
+        if tracker is not None:
+            tracker.add_bytes(bytes_done - last_done)
+        last_done = bytes_done
+        if task.manifest is not None:
+            task.manifest.checkpoint(task.manifest_key, bytes_done)
+
+    if instrumentation.enabled:
+        task.timings = {}
+    try:
+        task.source_hash = copy_with_hash(task.src_path, task.write_paths, resume_offset=task.resume_offset,
+                                          on_progress=on_progress, algorithm=task.hash_algorithm,
+                                          timings=task.timings, preallocate_size=task.size, on_chunk=on_chunk)
+        task.extra_digests = {algorithm: hasher.hexdigest() for algorithm, hasher in extra_hashers.items()}
+        if task.timings is not None:
+            for name, seconds in task.timings.items():
+                instrumentation.add_time(f'copy.{name}', seconds)
+            instrumentation.count('copy.files')
+            instrumentation.count('copy.bytes', task.size - task.resume_offset)
+    except Exception as e:
+        instrumentation.count('copy.errors')
+        task.error = e
+        # 出错的文件不再计入剩余字节，避免进度条卡住
+        if tracker is not None:
+            tracker.add_bytes(task.size - last_done)
+    return task
+
+
+def commit_task(task):
+    """数据落盘后把临时文件重命名为正式文件名，返回实际路径（作为 SyncBatcher 的 commit 回调）
+
+    目标中已经出现同名文件时所有目标一起改用后缀名，task.dst_paths 随之更新为实际路径。
+    """
+    task.dst_paths[:] = commit_partials(task.dst_paths)
+    return task.dst_paths
+
+
+def sync_tasks(syncer, task=None):
+    """把校验通过的任务交给 syncer，返回已经落盘并重命名的任务（落盘失败的记录到 task.error）
+
+    task 为 None 时落盘剩下的全部任务。
+    """
+    done = syncer.close() if task is None else syncer.add(task, task.write_paths)
+    for synced, error in done:
+        if error is not None:
+            synced.error = error
+    return [synced for synced, _ in done]
+
+
+def finish_task(task, tracker=None):
+    """记录结果：写入清单并更新进度
+
+    校验通过的任务要先经 sync_tasks 落盘并重命名，清单里“已完成”的文件一定以正式文件名完整存在。
+    """
+    if task.manifest is not None:
+        task.manifest.finish(task.manifest_key, task.source_hash, task.verified, task.hash_algorithm,
+                             dst_paths=task.dst_paths)
+    if tracker is not None:
+        tracker.file_done(task.verified)
+    return task
+
+
+def execute_task(task, tracker=None):
+    """同步执行单个拷贝任务：拷贝后立即在当前线程中校验目标文件并落盘"""
+    copy_task(task, tracker)
+    if task.error is None:
+        try:
+            task.failed_paths = [dst_path for dst_path, write_path in zip(task.dst_paths, task.write_paths)
+                                 if not verify_copy(write_path, task.source_hash, algorithm=task.hash_algorithm)]
+        except Exception as e:
+            task.error = e
+    if task.verified:
+        sync_tasks(SyncBatcher(FSYNC_FILE, commit=commit_task), task)
+    return finish_task(task, tracker)
+
+
+def run_copy_tasks(tasks, image_workers=4, video_workers=1, on_task_done=None, tracker=None,
+                   verify_workers=VERIFY_WORKERS, fsync_policy=DEFAULT_FSYNC_POLICY,
+                   fsync_batch_size=DEFAULT_FSYNC_BATCH_SIZE, previews=None, max_queued=MAX_QUEUED_TASKS):
+    """用有界线程池执行拷贝任务，校验在独立的校验队列中与拷贝并行进行
+
+    tasks 可以是列表，也可以是边扫描边规划的生成器：由单独的线程逐个取出任务放入有界队列
+    （最多 max_queued 个任务在排队或拷贝中），第一个任务规划好就开始拷贝，内存占用不随卡上文件数增长。
+    大文件/视频放到少量顺序通道（video_workers），小图片分散到 image_workers 个线程；
+    拷贝完的文件交给 VerificationPipeline 绕过页缓存重新读取目标盘校验。
+    on_task_done 在调用方线程中按校验完成的顺序回调。
+    校验通过的文件按 fsync_policy（见 durability 模块）分批落盘并重命名为正式文件名，之后才记入清单、回调
+    on_task_done（策略为 end 时全部在最后回调）；落盘在调用方线程中进行。
+    previews 为 previews.PreviewPipeline 时，拷贝的同时从数据流中截取预览交给它处理。
+    返回实际执行的任务列表；生成器抛出的异常在已提交的任务全部结束后重新抛出。
+    """
+    done_queue = queue.Queue()
+    syncer = SyncBatcher(fsync_policy, fsync_batch_size, commit=commit_task)
+    slots = threading.BoundedSemaphore(max(1, max_queued))
+    state_lock = threading.Lock()
+    copies_in_flight = 0
+    feeding = True
+    executed = []
+    feed_errors = []
+
+    def task_done(task):
+        finish_task(task, tracker)
+        if on_task_done:
+            on_task_done(task)
+
+    verifier = VerificationPipeline(workers=verify_workers, on_verified=done_queue.put)
+
+    def enter_verify_stage_locked():
+        # 任务已经全部取出、卡也已经读完，剩下的只是校验
+        if copies_in_flight == 0 and not feeding and executed and tracker is not None:
+            tracker.set_stage(STAGE_VERIFY)
+
+    def copy_then_verify(task):
+        nonlocal copies_in_flight
+        capture = previews.capture_for(task) if previews is not None else None
+        try:
+            copy_task(task, tracker, on_chunk=capture.feed if capture else None)
+            if capture is not None:
+                previews.submit(task, capture)
+        finally:
+            if task.error is None:
+                verifier.submit(task)
+            else:
+                done_queue.put(task)
+            slots.release()
+            with state_lock:
+                copies_in_flight -= 1
+                enter_verify_stage_locked()
+
+    def feed(large_pool, small_pool):
+        nonlocal copies_in_flight, feeding
+        try:
+            for task in tasks:
+                slots.acquire()
+                with state_lock:
+                    copies_in_flight += 1
+                executed.append(task)
+                (large_pool if task.is_large else small_pool).submit(copy_then_verify, task)
+        except BaseException as e:
+            feed_errors.append(e)
+        finally:
+            with state_lock:
+                feeding = False
+                enter_verify_stage_locked()
+            done_queue.put(_FEED_DONE)
+
+    with ThreadPoolExecutor(max_workers=max(1, video_workers)) as large_pool, \
+            ThreadPoolExecutor(max_workers=max(1, image_workers)) as small_pool:
+        feeder = threading.Thread(target=feed, args=(large_pool, small_pool), name='copy-feeder')
+        feeder.start()
+        fed = False
+        finished = 0
+        # 取完任务之后 executed 不再变化，收齐对应数量的完成通知即可结束
+        while not fed or finished < len(executed):
+            task = done_queue.get()
+            if task is _FEED_DONE:
+                fed = True
+                continue
+            finished += 1
+            for synced in (sync_tasks(syncer, task) if task.verified else [task]):
+                task_done(synced)
+        feeder.join()
+    verifier.close()
+    for synced in sync_tasks(syncer):
+        task_done(synced)
+    if feed_errors:
+        raise feed_errors[0]
+    return executed
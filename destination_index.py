@@ -0,0 +1,128 @@
+import logging
+import os
+import re
+
+from copy_engine import hash_file
+from durability import partial_path
+
+# 解析 “原文件名_序号.扩展名” 形式的重名后缀
+_SUFFIX_PATTERN = re.compile(r'^(.*)_(\d+)$')
+
+
+class _FolderListing:
+    """单个目标子文件夹的内容：文件名 → 大小，以及同一原名的所有重名变体"""
+    def __init__(self, folder):
+        self.sizes = {}
+        self.variants = {}
+        try:
+            with os.scandir(folder) as it:
+                for entry in it:
+                    if entry.is_file(follow_symlinks=False):
+                        self.add(entry.name, entry.stat(follow_symlinks=False).st_size)
+        except FileNotFoundError:
+            pass
+
+    def add(self, name, size):
+        self.sizes[name] = size
+        stem, ext = os.path.splitext(name)
+        self.variants.setdefault((stem, ext), []).append(name)
+        # IMG_0001.JPG 既可能是原名，也可能是 IMG.JPG 的重名变体，两种原名下都要登记
+        match = _SUFFIX_PATTERN.match(stem)
+        if match:
+            self.variants.setdefault((match.group(1), ext), []).append(name)
+
+
+class DestinationIndex:
+    """目标目录文件名索引：每个子文件夹只列一次目录，之后的冲突判断都在内存中完成
+
+    - resolve() 为文件分配不冲突的名字（_1、_2 后缀），不再逐个 os.path.exists 探测；
+    - find_identical() 找出目标中与源文件内容完全相同的已有文件，避免重复拷贝出 _1 副本。
+    只在规划阶段（单线程、持规划锁）使用，不需要额外加锁。
+    checksums 为 checksum_manifest.ChecksumIndex 时，已有文件优先使用目标中校验清单记录的哈希，不再重新读取。
+    """
+    def __init__(self, hash_algorithm, checksums=None):
+        self.hash_algorithm = hash_algorithm
+        self.checksums = checksums
+        self._folders = {}
+        self._next_counter = {}
+        self._hashes = {}
+
+    def _listing(self, folder):
+        listing = self._folders.get(folder)
+        if listing is None:
+            listing = self._folders[folder] = _FolderListing(folder)
+        return listing
+
+    def _taken(self, path, reserved_paths):
+        if path in reserved_paths:
+            return True
+        folder, name = os.path.split(path)
+        return name in self._listing(folder).sizes
+
+    def _appeared(self, path):
+        """列目录之后才出现的文件（如另一个进程或已结束的引擎刚写入的），记入缓存的目录列表"""
+        if not (os.path.lexists(path) or os.path.lexists(partial_path(path))):
+            return False
+        folder, name = os.path.split(path)
+        try:
+            size = os.path.getsize(path)
+        except OSError:
+            size = -1
+        self._listing(folder).add(name, size)
+        return True
+
+    def resolve(self, target_subfolders, file_name, reserved_paths):
+        """生成所有目标中都不冲突的路径（主目标在前），并登记到 reserved_paths
+
+        目录列表只在第一次用到时读取，选中的名字再到文件系统上确认一次，列表过期也不会重名
+        （提交时 durability.commit_partial 同样不会覆盖已有文件）。
+        """
+        base_name, ext = os.path.splitext(file_name)
+        key = (tuple(target_subfolders), file_name)
+        new_file_name = file_name
+        counter = self._next_counter.get(key, 1)
+        while True:
+            new_file_paths = [os.path.join(folder, new_file_name) for folder in target_subfolders]
+            if (not any(self._taken(path, reserved_paths) for path in new_file_paths)
+                    and not any([self._appeared(path) for path in new_file_paths])):
+                break
+            new_file_name = f'{base_name}_{counter}{ext}'
+            counter += 1
+        # 记住下一次从哪个序号开始找，同名文件越多越能省下重复判断
+        self._next_counter[key] = counter
+        reserved_paths.update(new_file_paths)
+        return new_file_paths
+
+    def _hash(self, path):
+        file_hash = self._hashes.get(path)
+        if file_hash is None and self.checksums is not None:
+            file_hash = self.checksums.lookup(path, self.hash_algorithm)
+        if file_hash is None:
+            file_hash = hash_file(path, algorithm=self.hash_algorithm)
+        self._hashes[path] = file_hash
+        return file_hash
+
+    def find_identical(self, target_subfolders, file_name, src_path, size):
+        """在主目标中查找与源文件内容相同的已有文件（原名或 _N 变体）
+
+        只有大小相同的候选才会计算哈希（源文件只在有候选时读取一次）；
+        有备份目录时要求备份中的同名文件也相同。
+        找到时返回 (各目标中的已有路径列表, 源文件哈希)，否则返回 None。
+        """
+        primary = target_subfolders[0]
+        listing = self._listing(primary)
+        base_name, ext = os.path.splitext(file_name)
+        candidates = [name for name in listing.variants.get((base_name, ext), ())
+                      if listing.sizes.get(name) == size and size > 0]
+        if not candidates:
+            return None
+        try:
+            source_hash = hash_file(src_path, algorithm=self.hash_algorithm)
+            for name in candidates:
+                paths = [os.path.join(folder, name) for folder in target_subfolders]
+                if all(self._listing(os.path.dirname(path)).sizes.get(name) == size
+                       and self._hash(path) == source_hash for path in paths):
+                    return paths, source_hash
+        except OSError as e:
+            logging.error(f"Failed to compare {src_path} with existing files: {e}")
+        return None
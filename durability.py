@@ -0,0 +1,258 @@
+"""可靠写入：预分配空间、临时文件名 + 原子重命名、分批 fsync
+
+拷贝先写到同目录下的隐藏临时文件（.原文件名.sdcopy_part），校验通过后按批 fsync 文件数据，
+再原子重命名为正式文件名（不覆盖已有文件）并 fsync 目录。
+程序崩溃或断电时目标目录中只会留下临时文件，不会出现看起来完整、实际被截断的正式文件，
+重名检查也不会把它当成已有文件。
+"""
+import ctypes
+import ctypes.util
+import errno as _errno
+import logging
+import os
+import sys
+import threading
+import time
+
+from instrumentation import instrumentation
+
+PARTIAL_SUFFIX = '.sdcopy_part'
+
+# fsync 策略：校验通过的文件什么时候落盘（fsync 数据 → 重命名 → fsync 目录），落盘后才记为完成
+FSYNC_FILE = 'file'            # 每个文件单独落盘，最安全
+FSYNC_BATCH = 'batch'          # 每 N 个文件落盘一次
+FSYNC_DIRECTORY = 'directory'  # 换到另一个目标目录时落盘之前的文件
+FSYNC_END = 'end'              # 整次拷卡结束时统一落盘，吞吐量最高
+FSYNC_POLICIES = (FSYNC_FILE, FSYNC_BATCH, FSYNC_DIRECTORY, FSYNC_END)
+DEFAULT_FSYNC_POLICY = FSYNC_BATCH
+DEFAULT_FSYNC_BATCH_SIZE = 64
+
+# fallocate(2) 的 FALLOC_FL_KEEP_SIZE：只分配磁盘空间，不改变文件大小
+_FALLOC_FL_KEEP_SIZE = 1
+# renameat2(2)：相对当前目录解析路径，目标已存在时失败而不是覆盖
+_AT_FDCWD = -100
+_RENAME_NOREPLACE = 1
+# sync_file_range(2)：等待之前的回写、发起回写、等待回写完成
+_SYNC_FILE_RANGE_ALL = 1 | 2 | 4
+_libc = None
+
+
+def partial_path(path):
+    """正式文件名对应的临时文件名"""
+    folder, name = os.path.split(path)
+    return os.path.join(folder, f'.{name}{PARTIAL_SUFFIX}')
+
+
+def _load_libc():
+    global _libc
+    if _libc is None:
+        name = ctypes.util.find_library('c')
+        _libc = ctypes.CDLL(name, use_errno=True) if name else False
+    return _libc
+
+
+def preallocate(fd, offset, length):
+    """为即将写入的数据一次性分配连续空间，减少 USB 机械盘上的碎片，返回是否成功
+
+    只在 Linux 上直接调用 fallocate(2)：不支持的文件系统（如部分 exFAT 驱动）会直接报错返回，
+    不像 posix_fallocate 那样退化为逐块写零，把数据多写一遍。
+    """
+    if length <= 0 or not sys.platform.startswith('linux'):
+        return False
+    libc = _load_libc()
+    if not libc or not hasattr(libc, 'fallocate'):
+        return False
+    result = libc.fallocate(ctypes.c_int(fd), ctypes.c_int(_FALLOC_FL_KEEP_SIZE),
+                            ctypes.c_longlong(offset), ctypes.c_longlong(length))
+    return result == 0
+
+
+def write_back(fd):
+    """把文件的脏页写到磁盘上（之后才能从页缓存中丢弃），不保证元数据和磁盘缓存落盘
+
+    Linux 上用 sync_file_range(2)，比 fsync 省去了日志提交和刷磁盘缓存，真正的落盘交给 SyncBatcher；
+    其他系统退化为 fsync。
+    """
+    if sys.platform.startswith('linux'):
+        libc = _load_libc()
+        if libc and hasattr(libc, 'sync_file_range'):
+            if libc.sync_file_range(ctypes.c_int(fd), ctypes.c_longlong(0), ctypes.c_longlong(0),
+                                    ctypes.c_uint(_SYNC_FILE_RANGE_ALL)) == 0:
+                return
+    os.fsync(fd)
+
+
+def fsync_file(path):
+    """fsync 文件数据和元数据"""
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def fsync_directory(folder):
+    """fsync 目录本身，让其中的新建和重命名落盘（Windows 上不支持，直接跳过）"""
+    try:
+        fd = os.open(folder, os.O_RDONLY)
+    except OSError:
+        return False
+    try:
+        os.fsync(fd)
+        return True
+    except OSError as e:
+        logging.debug(f"Failed to fsync directory {folder}: {e}")
+        return False
+    finally:
+        os.close(fd)
+
+
+def _renameat2_noreplace(src, dst):
+    """Linux renameat2(RENAME_NOREPLACE)：原子地重命名，目标已存在时失败；不支持时返回 False"""
+    libc = _load_libc()
+    if not libc or not hasattr(libc, 'renameat2'):
+        return False
+    if libc.renameat2(_AT_FDCWD, os.fsencode(src), _AT_FDCWD, os.fsencode(dst), _RENAME_NOREPLACE) == 0:
+        return True
+    error = ctypes.get_errno()
+    if error in (_errno.EINVAL, _errno.ENOSYS, _errno.ENOTSUP):
+        return False
+    raise OSError(error, os.strerror(error), dst)
+
+
+def rename_noreplace(src, dst):
+    """重命名但绝不覆盖已有文件，目标已存在时抛出 FileExistsError
+
+    Linux 上用 renameat2(RENAME_NOREPLACE)，文件系统不支持时退化为硬链接再删除源文件；
+    Windows 上 os.rename 本身就不会覆盖。都不支持（如 macOS 上的 exFAT）时先检查再重命名。
+    """
+    if os.name == 'nt':
+        os.rename(src, dst)
+        return
+    if sys.platform.startswith('linux') and _renameat2_noreplace(src, dst):
+        return
+    try:
+        os.link(src, dst)
+    except FileExistsError:
+        raise
+    except OSError:
+        # 不支持硬链接的文件系统（FAT/exFAT）
+        if os.path.lexists(dst):
+            raise FileExistsError(_errno.EEXIST, os.strerror(_errno.EEXIST), dst)
+        os.rename(src, dst)
+        return
+    os.unlink(src)
+
+
+def suffixed_path(path, counter):
+    """重名时使用的 原文件名_序号.扩展名"""
+    base_name, ext = os.path.splitext(path)
+    return f'{base_name}_{counter}{ext}'
+
+
+def commit_partials(dst_paths):
+    """把一组目标（主目标和备份）的临时文件重命名为同一个正式文件名，返回实际使用的路径列表
+
+    不会覆盖已有文件：规划后任一目标中出现了同名文件（如另一张卡同时拷入）时，
+    已经重命名的目标改回临时文件名，所有目标一起改用 _1、_2 后缀，备份与主目标始终同名。
+    """
+    sources = [partial_path(path) for path in dst_paths]
+    paths = list(dst_paths)
+    counter = 1
+    while True:
+        committed = []
+        try:
+            for path in paths:
+                if os.path.lexists(path):
+                    raise FileExistsError(_errno.EEXIST, os.strerror(_errno.EEXIST), path)
+            for source, path in zip(sources, paths):
+                rename_noreplace(source, path)
+                committed.append((source, path))
+            return paths
+        except FileExistsError as e:
+            for source, path in committed:
+                rename_noreplace(path, source)
+            logging.warning(f"{e.filename or paths[0]} appeared after planning, trying another name")
+            paths = [suffixed_path(path, counter) for path in dst_paths]
+            counter += 1
+
+
+def commit_partial(dst_path):
+    """把单个临时文件重命名为正式文件名，返回实际使用的路径（见 commit_partials）"""
+    return commit_partials([dst_path])[0]
+
+
+def discard_partials(dst_paths):
+    """删除目标遗留的临时文件（崩溃或放弃的拷贝），返回删除的数量"""
+    removed = 0
+    for path in dst_paths:
+        try:
+            os.remove(partial_path(path))
+            removed += 1
+        except FileNotFoundError:
+            pass
+        except OSError as e:
+            logging.warning(f"Failed to remove {partial_path(path)}: {e}")
+    return removed
+
+
+class SyncBatcher:
+    """按策略分批落盘校验通过的文件：fsync 文件数据 → 重命名为正式文件名 → fsync 所在目录
+
+    add(item, write_paths) 登记一项（write_paths 为已校验的临时文件），commit(item) 在数据落盘后调用，
+    把临时文件重命名为正式文件名并返回正式路径。add / flush / close 返回本次落盘的 [(item, 错误)]，
+    错误为 None 的项此时才可以记为完成；策略越宽松，机械盘上来回寻道写日志的次数越少，
+    但断电时最近一批文件需要重新拷贝（临时文件保留，可续传）。
+    """
+    def __init__(self, policy=DEFAULT_FSYNC_POLICY, batch_size=DEFAULT_FSYNC_BATCH_SIZE, commit=None):
+        if policy not in FSYNC_POLICIES:
+            raise ValueError(f'未知的 fsync 策略：{policy}（可选 {", ".join(FSYNC_POLICIES)}）')
+        self.policy = policy
+        self.batch_size = max(1, batch_size or DEFAULT_FSYNC_BATCH_SIZE)
+        self.commit = commit
+        self._lock = threading.Lock()
+        self._pending = []
+        self._current = None
+
+    def add(self, item, write_paths):
+        folders = tuple(os.path.dirname(path) for path in write_paths)
+        done = []
+        with self._lock:
+            if self.policy == FSYNC_DIRECTORY and self._current is not None and folders != self._current:
+                done = self._flush_locked()
+            self._current = folders
+            self._pending.append((item, list(write_paths)))
+            if self.policy == FSYNC_FILE or (self.policy == FSYNC_BATCH and len(self._pending) >= self.batch_size):
+                done += self._flush_locked()
+        return done
+
+    def flush(self):
+        with self._lock:
+            return self._flush_locked()
+
+    def _flush_locked(self):
+        if not self._pending:
+            return []
+        start = time.perf_counter()
+        done = []
+        folders = {}
+        for item, write_paths in self._pending:
+            try:
+                for path in write_paths:
+                    fsync_file(path)
+                final_paths = self.commit(item) if self.commit is not None else write_paths
+            except OSError as e:
+                done.append((item, e))
+                continue
+            for path in final_paths:
+                folders[os.path.dirname(path)] = True
+            done.append((item, None))
+        for folder in folders:
+            fsync_directory(folder)
+        instrumentation.add_time('sync.files', time.perf_counter() - start)
+        instrumentation.count('sync.flushes')
+        self._pending = []
+        return done
+
+    def close(self):
+        return self.flush()
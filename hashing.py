@@ -0,0 +1,101 @@
+import hashlib
+import json
+import logging
+import os
+import time
+from pathlib import Path
+
+ALGORITHM_AUTO = 'auto'
+DEFAULT_ALGORITHM = 'sha256'
+
+# 基准测试结果缓存，首次运行时测一次，之后直接读取
+BENCHMARK_CACHE_PATH = os.path.join(str(Path.home()), '.sd_copy_hub', 'hash_benchmark.json')
+BENCHMARK_SAMPLE_SIZE = 32 * 1024 * 1024
+BENCHMARK_CHUNK_SIZE = 4 * 1024 * 1024
+
+_FACTORIES = {
+    'sha256': hashlib.sha256,  # 合规要求时使用
+    'blake2b': hashlib.blake2b,  # 标准库中最快的安全哈希
+    'md5': hashlib.md5,  # 兼容旧的 .md5 校验清单
+}
+_optional_loaded = False
+
+# 自动选择时的候选算法（md5 既不安全也不够快，不参与自动选择）
+_AUTO_CANDIDATES = ('xxh128', 'xxh3_64', 'blake2b', 'sha256')
+
+
+def _factories():
+    """xxHash 为可选依赖（pip install xxhash），第一次用到非标准库算法时才导入"""
+    global _optional_loaded
+    if not _optional_loaded:
+        try:
+            import xxhash
+        except ImportError:
+            xxhash = None
+        if xxhash is not None:
+            _FACTORIES['xxh3_64'] = xxhash.xxh3_64
+            _FACTORIES['xxh128'] = xxhash.xxh3_128
+        _optional_loaded = True
+    return _FACTORIES
+
+
+def available_algorithms():
+    return sorted(_factories())
+
+
+def new_hasher(algorithm):
+    """创建哈希对象（提供 update / hexdigest 接口）"""
+    factory = _FACTORIES.get(algorithm) or _factories().get(algorithm)
+    if factory is None:
+        raise ValueError(f'不支持的哈希算法: {algorithm}，可用算法: {", ".join(available_algorithms())}')
+    return factory()
+
+
+def benchmark_algorithms(algorithms=None, sample_size=BENCHMARK_SAMPLE_SIZE):
+    """对各算法做一次内存内微基准测试，返回 {算法: MB/s}"""
+    algorithms = algorithms or [name for name in _AUTO_CANDIDATES if name in _factories()]
+    data = memoryview(os.urandom(BENCHMARK_CHUNK_SIZE))
+    rounds = max(1, sample_size // BENCHMARK_CHUNK_SIZE)
+    results = {}
+    for algorithm in algorithms:
+        hasher = new_hasher(algorithm)
+        start = time.perf_counter()
+        for _ in range(rounds):
+            hasher.update(data)
+        hasher.hexdigest()
+        elapsed = max(time.perf_counter() - start, 1e-9)
+        results[algorithm] = round(rounds * BENCHMARK_CHUNK_SIZE / elapsed / (1024 * 1024), 1)
+    return results
+
+
+def fastest_algorithm(cache_path=BENCHMARK_CACHE_PATH):
+    """返回本机最快的算法；首次运行时做基准测试并缓存结果"""
+    candidates = [name for name in _AUTO_CANDIDATES if name in _factories()]
+    try:
+        with open(cache_path, 'r', encoding='utf-8') as f:
+            cached = json.load(f)
+        # 可用算法有变化（如新装了 xxhash）时重新测试
+        if sorted(cached.get('results', {})) == sorted(candidates):
+            return cached['fastest']
+    except (OSError, ValueError, KeyError):
+        pass
+    results = benchmark_algorithms(candidates)
+    fastest = max(results, key=results.get)
+    logging.info(f"Hash benchmark (MB/s): {results}, using {fastest}")
+    try:
+        os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+        with open(cache_path, 'w', encoding='utf-8') as f:
+            json.dump({'fastest': fastest, 'results': results}, f, ensure_ascii=False, indent=2)
+    except OSError as e:
+        logging.error(f"Failed to save hash benchmark to {cache_path}: {e}")
+    return fastest
+
+
+def resolve_algorithm(algorithm):
+    """把配置中的算法名解析为实际使用的算法（auto 表示自动选择最快的）"""
+    if not algorithm or algorithm == ALGORITHM_AUTO:
+        return fastest_algorithm()
+    if algorithm not in _factories():
+        logging.error(f"Hash algorithm {algorithm} is not available, falling back to {DEFAULT_ALGORITHM}")
+        return DEFAULT_ALGORITHM
+    return algorithm
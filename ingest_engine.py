@@ -0,0 +1,656 @@
+import logging
+import os
+import threading
+import time
+
+from card_scanner import iter_card
+from checksum_manifest import ChecksumIndex, ChecksumManifestWriter, locate_event_folder
+from copy_engine import CopyTask, mirror_path, run_copy_tasks
+from destination_index import DestinationIndex
+from durability import DEFAULT_FSYNC_BATCH_SIZE, DEFAULT_FSYNC_POLICY, discard_partials
+from hashing import ALGORITHM_AUTO, resolve_algorithm
+from ingest_manifest import STATUS_DONE, STATUS_FAILED, STATUS_PARTIAL, IngestManifest, source_fingerprint
+from instrumentation import instrumentation
+from library_index import DEDUP_SKIP, LIBRARY_DB_NAME, LIBRARY_HASH_ALGORITHM, LibraryIndex
+from previews import (DEFAULT_PREVIEW_SIZE, DEFAULT_PREVIEW_WORKERS, JPEG_EXTENSIONS, PreviewPipeline,
+                      preview_path_for)
+from progress import STAGE_COPY, STAGE_DONE, ProgressTracker
+from rename_template import DEFAULT_IMAGE_TEMPLATE, DEFAULT_VIDEO_TEMPLATE, compile_template, sidecar_name
+from routing import KIND_IMAGE, TARGET_SKIP, default_routing
+from scheduler import DEFAULT_ORDER, order_tasks
+from staging import StagingQueue, mount_point, staging_root_for
+
+# 默认并发配置（界面从 config.ini 读取，命令行通过参数覆盖）
+DEFAULT_IMAGE_WORKERS = 4
+DEFAULT_VIDEO_WORKERS = 1
+# 边规划边拷贝时，每规划这么多个文件提交一次清单
+MANIFEST_COMMIT_INTERVAL = 200
+
+
+class IngestOptions:
+    """一次拷卡的全部参数"""
+    def __init__(self, image_target, video_target, sd_card, event_name='', selected_dates=None,
+                 separate_raw=False, image_workers=DEFAULT_IMAGE_WORKERS, video_workers=DEFAULT_VIDEO_WORKERS,
+                 backup_roots=None, hash_algorithm=ALGORITHM_AUTO, library_dedup=None,
+                 fsync_policy=DEFAULT_FSYNC_POLICY, fsync_batch_size=DEFAULT_FSYNC_BATCH_SIZE,
+                 image_template=DEFAULT_IMAGE_TEMPLATE, video_template=DEFAULT_VIDEO_TEMPLATE,
+                 previews=False, preview_size=DEFAULT_PREVIEW_SIZE, preview_workers=DEFAULT_PREVIEW_WORKERS,
+                 routing=None, order=DEFAULT_ORDER, staging_dir=None, checksum_formats=None):
+        self.image_target = image_target
+        self.video_target = video_target
+        self.sd_card = sd_card
+        self.event_name = event_name
+        self.selected_dates = set(selected_dates or ())
+        self.separate_raw = separate_raw
+        # 并发拷贝线程数：小图片的线程数和大文件/视频的顺序通道数
+        self.image_workers = image_workers or DEFAULT_IMAGE_WORKERS
+        self.video_workers = video_workers or DEFAULT_VIDEO_WORKERS
+        # 备份根目录：每个块从卡上读出后同时写入主目标和所有备份目录
+        self.backup_roots = [root for root in (backup_roots or []) if root]
+        self.hash_algorithm = hash_algorithm or ALGORITHM_AUTO
+        # 图库去重：None 不检查，'skip' 跳过图库中已有的文件，'report' 只报告仍然拷贝
+        self.library_dedup = library_dedup
+        # 目录 fsync 策略：file / batch（每 fsync_batch_size 个文件）/ directory / end
+        self.fsync_policy = fsync_policy or DEFAULT_FSYNC_POLICY
+        self.fsync_batch_size = fsync_batch_size or DEFAULT_FSYNC_BATCH_SIZE
+        # 重命名模板（见 rename_template），空字符串表示保留原文件名
+        self.image_template = image_template
+        self.video_template = video_template
+        # 拷贝时顺带生成预览图缓存（活动文件夹下的 .previews 目录）
+        self.previews = previews
+        self.preview_size = preview_size or DEFAULT_PREVIEW_SIZE
+        self.preview_workers = preview_workers or DEFAULT_PREVIEW_WORKERS
+        # 路由表（见 routing）：哪些文件拷到哪个目标目录的哪个子文件夹
+        self.routing = routing or default_routing()
+        # 拷贝顺序（见 scheduler）：scan / physical / small-first / by-folder
+        self.order = order or DEFAULT_ORDER
+        # 暂存目录（见 staging）：先拷到本地高速盘，校验后由后台搬运到目标目录和备份目录
+        self.staging_dir = staging_dir or None
+        # 校验清单格式（见 checksum_manifest）：md5 / sha256 / xxh / mhl，每个活动文件夹一份，拷贝时逐个文件写入
+        self.checksum_formats = list(checksum_formats or ())
+
+
+class IngestResult:
+    """一次拷卡的结果，界面据此生成提示文字，命令行据此输出 JSON"""
+    def __init__(self, sd_card):
+        self.sd_card = sd_card
+        self.no_files = False
+        self.created_folders = []
+        self.skipped_files = 0
+        # 目标中已有内容完全相同的文件，未重复拷贝
+        self.identical_files = 0
+        # 图库中任意位置已归档过的文件：[{'source': 源文件, 'existing': 图库中的文件}]
+        self.archived_files = []
+        self.hash_algorithm = None
+        self.tasks = []
+        self.summary = None  # 最终的 ProgressSnapshot
+        # 开启埋点时本次拷卡各阶段和各环节的累计耗时（秒）
+        self.timings = None
+        self.previews_created = 0
+        self.previews_failed = 0
+        # 写入校验清单的文件数
+        self.checksum_files = 0
+
+    @property
+    def failed_tasks(self):
+        return [task for task in self.tasks if not task.verified]
+
+    def to_dict(self):
+        return {
+            'sd_card': self.sd_card,
+            'no_files': self.no_files,
+            'created_folders': self.created_folders,
+            'skipped_files': self.skipped_files,
+            'identical_files': self.identical_files,
+            'archived_files': self.archived_files,
+            'hash_algorithm': self.hash_algorithm,
+            'summary': self.summary.to_dict() if self.summary else None,
+            'timings': self.timings,
+            'previews_created': self.previews_created,
+            'previews_failed': self.previews_failed,
+            'checksum_files': self.checksum_files,
+            'files': [{
+                'source': task.src_path,
+                'destinations': task.dst_paths,
+                'size': task.size,
+                'hash': task.source_hash,
+                'verified': task.verified,
+                'failed_paths': task.failed_paths,
+                'error': str(task.error) if task.error else None,
+            } for task in self.tasks],
+        }
+
+
+class IngestEngine:
+    """与界面无关的拷卡核心：扫描 → 规划目标路径 → 并发拷贝和校验
+
+    PyQt 的 CopyThread 和命令行入口都只是它的外壳；
+    on_progress(ProgressSnapshot) 已限频，on_file_done(CopyTask) 在调用 run() 的线程中回调。
+    同一进程中可以同时运行多个引擎（多张卡），目标路径的分配在进程内共享登记，
+    两张卡上同名的文件不会被分配到同一个目标路径。
+    """
+    # 进程内所有引擎共享的已分配目标路径，规划阶段持锁进行
+    _planning_lock = threading.Lock()
+    _reserved_paths = set()
+
+    def __init__(self, options, card_index=None, on_progress=None, on_file_done=None):
+        self.options = options
+        self.card_index = card_index
+        self.on_progress = on_progress
+        self.on_file_done = on_file_done
+        self.tracker = ProgressTracker(on_update=on_progress)
+        self._manifests = {}
+        self._created_folders = set()
+        self._created_subfolders = set()
+        self._created_backup_folders = set()
+        self._own_reserved_paths = set()
+        self._libraries = []
+        # 暂存模式下 {暂存子目录: 最终目标根目录}、各最终根目录（含备份）拷卡时所在的挂载点，以及登记搬运的队列
+        self._staging_roots = {}
+        self._final_mounts = {}
+        self.staging_queue = None
+        # 拷卡过程中写校验清单（只在调用 run() 的线程中使用），以及记入清单的文件数
+        self.checksum_writer = None
+        self.checksum_files = 0
+        # 本次规划过的文件数（不含附属文件），为 0 表示卡上没有需要拷贝的文件
+        self.planned_entries = 0
+
+    def get_manifest(self, target_dir):
+        """获取目标根目录对应的拷贝清单（同一根目录只打开一次）"""
+        key = os.path.abspath(target_dir)
+        if key not in self._manifests:
+            try:
+                self._manifests[key] = IngestManifest.for_root(target_dir)
+            except Exception as e:
+                # 清单不可用（如目标目录只读）时退化为不记录清单的普通拷贝
+                logging.error(f"Failed to open manifest for {target_dir}: {e}")
+                self._manifests[key] = None
+        return self._manifests[key]
+
+    def write_root(self, target_dir):
+        """实际写入的根目录：暂存模式下为暂存目录中对应的子目录，否则就是目标根目录"""
+        if not self.options.staging_dir:
+            return target_dir
+        return staging_root_for(self.options.staging_dir, target_dir)
+
+    def final_roots(self):
+        """文件最终所在的根目录：图片、视频目标目录和所有备份目录（活动文件夹在它们的下一级）"""
+        options = self.options
+        return [options.image_target, options.video_target] + options.backup_roots
+
+    def open_libraries(self):
+        """打开图片/视频目标目录的图库索引（首次使用时完整遍历一次图库）"""
+        roots = []
+        for root in (self.options.image_target, self.options.video_target):
+            if os.path.abspath(root) not in roots:
+                roots.append(os.path.abspath(root))
+        for root in roots:
+            # 暂存模式下目标盘可能没有挂载，只使用已经建好的图库索引，不在挂载点目录里新建；
+            # 要求跳过已归档文件却没有索引时拒绝拷卡，不能悄悄把已归档的文件再拷一遍
+            if self.options.staging_dir and not os.path.exists(os.path.join(root, LIBRARY_DB_NAME)):
+                if self.options.library_dedup == DEDUP_SKIP:
+                    raise ValueError(f'暂存模式下跳过已归档文件需要 {root} 中已建好的图库索引，'
+                                     f'请挂载目标盘后运行 python library_index.py {root}，或先不用暂存拷一次卡')
+                logging.warning(f"No library index in {root}, archived files there are not checked")
+                continue
+            try:
+                library = LibraryIndex(root)
+                library.ensure_built()
+                self._libraries.append(library)
+            except Exception as e:
+                logging.error(f"Failed to open library index for {root}: {e}")
+
+    def find_in_library(self, entry):
+        # 源文件的哈希在多个图库间共享，卡上的文件最多读取一次
+        source = {}
+        for library in self._libraries:
+            try:
+                existing = library.find_duplicate(entry.path, entry.size, source)
+            except OSError as e:
+                logging.error(f"Failed to look up {entry.name} in library {library.root}: {e}")
+                continue
+            if existing:
+                return existing
+        return None
+
+    def register_in_libraries(self, tasks):
+        """把校验通过的新文件登记到图库索引，下次拷卡时无需重新遍历图库"""
+        for library in self._libraries:
+            prefix = library.root + os.sep
+            for task in tasks:
+                if task.verified and os.path.abspath(task.dst_path).startswith(prefix):
+                    full_hash = task.source_hash if task.hash_algorithm == LIBRARY_HASH_ALGORITHM else None
+                    library.register(os.path.abspath(task.dst_path), full_hash)
+            library.commit()
+
+    def scan(self):
+        """返回要拷贝的文件：已经建好索引时为列表，否则为边扫描边产出的生成器"""
+        # 优先复用已经建好的索引，同一张卡在一次会话中只扫描一次
+        index = self.card_index
+        if index is not None and index.complete and index.sd_card == self.options.sd_card:
+            return index.select(self.options.selected_dates)
+        return self._stream_card()
+
+    def _stream_card(self):
+        selected_dates = self.options.selected_dates
+        scanned = 0
+        for entry in iter_card(self.options.sd_card, self.options.routing):
+            scanned += 1
+            if not selected_dates or entry.date in selected_dates:
+                yield entry
+        instrumentation.count('scan.files', scanned)
+
+    def ensure_target_folder(self, folder_path, route):
+        """创建包含活动名称的文件夹及路由规则指定的子文件夹（如“原图”），返回目标子文件夹，失败返回 None"""
+        target_subfolder = os.path.join(folder_path, *route.subfolder_parts(self.options.separate_raw))
+        if target_subfolder in self._created_subfolders:
+            return target_subfolder
+        for folder in (folder_path, target_subfolder):
+            if os.path.exists(folder):
+                continue
+            try:
+                os.makedirs(folder)
+                logging.info(f"Created folder: {folder}")
+            except Exception as e:
+                logging.error(f"Failed to create folder {folder}: {e}")
+                return None
+        self._created_folders.add(folder_path)
+        self._created_subfolders.add(target_subfolder)
+        return target_subfolder
+
+    def backup_subfolders(self, target_subfolder, target_dir):
+        # 备份目录：与主目标保持相同的相对目录结构
+        subfolders = []
+        for backup_root in self.options.backup_roots:
+            backup_subfolder = mirror_path(target_subfolder, target_dir, backup_root)
+            if backup_subfolder not in self._created_backup_folders:
+                try:
+                    os.makedirs(backup_subfolder, exist_ok=True)
+                except Exception as e:
+                    logging.error(f"Failed to create folder {backup_subfolder}: {e}")
+                    continue
+                self._created_backup_folders.add(backup_subfolder)
+            subfolders.append(backup_subfolder)
+        return subfolders
+
+    def destination_subfolders(self, target_subfolder, write_dir, target_dir):
+        """返回 (实际写入的子文件夹列表, 判断重名和相同文件时要看的子文件夹列表)
+
+        暂存模式下只写入暂存目录，备份由搬运器写入；文件名要在最终目标和备份中都不冲突，
+        已经归档过的相同文件也在最终目标中查找。
+        """
+        if write_dir == target_dir:
+            subfolders = [target_subfolder] + self.backup_subfolders(target_subfolder, target_dir)
+            return subfolders, subfolders
+        final_subfolder = mirror_path(target_subfolder, write_dir, target_dir)
+        return [target_subfolder], [final_subfolder] + [mirror_path(final_subfolder, target_dir, backup_root)
+                                                        for backup_root in self.options.backup_roots]
+
+    def set_preview_path(self, task, entry, route, write_dir):
+        # 预览图放在目标文件所属的活动文件夹（写入根目录下的第一级目录）中，暂存模式下随文件一起由搬运器搬走
+        if not self.options.previews or not (route.raw or entry.ext in JPEG_EXTENSIONS):
+            return
+        event_folder = os.path.join(write_dir, os.path.relpath(task.dst_path, write_dir).split(os.sep)[0])
+        task.preview_path = preview_path_for(event_folder, os.path.basename(task.dst_path))
+
+    def discard_stale_partials(self, record):
+        """清单记录的目标不再续传（已完成、换了文件名或源文件不同）时删除遗留的临时文件
+
+        正在被本次拷卡使用的路径不动。
+        """
+        if self._reserved_paths.intersection(record.dst_paths):
+            return
+        removed = discard_partials(record.dst_paths)
+        if removed:
+            logging.info(f"Removed {removed} stale partial file(s) of {record.dst_paths[0]}")
+
+    def lookup_manifest(self, manifest, manifest_key, src_path):
+        """查询清单，返回 (记录或 None, 源文件指纹)
+
+        同名、同大小、同修改时间的记录还要内容指纹一致才算同一个文件：另一张卡上的同名文件不会被误跳过。
+        没有记录时（首次拷贝）不读取指纹，指纹为 None，不为此多读一次卡。
+        """
+        if manifest is None:
+            return None, None
+        record = manifest.lookup(*manifest_key)
+        if record is None:
+            return None, None
+        try:
+            fingerprint = source_fingerprint(src_path, manifest_key[1])
+        except OSError as e:
+            logging.error(f"Failed to read {src_path}: {e}")
+            return None, None
+        if not record.same_source(fingerprint):
+            logging.info(f"{src_path} differs from the previously ingested file with the same name, size and time")
+            # 拷到一半的记录会被这次的登记覆盖，它的临时文件不再有人续传
+            if record.status != STATUS_DONE:
+                self.discard_stale_partials(record)
+            record = None
+        return record, fingerprint
+
+    def final_folders(self, folders):
+        """写入的子文件夹对应的最终子文件夹（主目标和备份），判断重名和相同文件时要看这些目录
+
+        非暂存模式下就是写入的子文件夹本身。
+        """
+        for staging_root, final_root in self._staging_roots.items():
+            if folders[0].startswith(staging_root + os.sep):
+                final_folder = mirror_path(folders[0], staging_root, final_root)
+                return [final_folder] + [mirror_path(final_folder, final_root, backup_root)
+                                         for backup_root in self.options.backup_roots]
+        return folders
+
+    def resumable(self, record):
+        """拷到一半或失败的记录可以续传到原来的目标路径：路径没有被本次拷卡占用，目标目录也还在"""
+        return (record is not None and record.status in (STATUS_PARTIAL, STATUS_FAILED)
+                and not self._reserved_paths.intersection(record.dst_paths)
+                and all(os.path.isdir(os.path.dirname(path)) for path in record.dst_paths))
+
+    def resume_task(self, entry, is_video, record, manifest, manifest_key, hash_algorithm):
+        """沿用记录中的目标路径续传，返回拷贝任务"""
+        self._reserved_paths.update(record.dst_paths)
+        self._own_reserved_paths.update(record.dst_paths)
+        logging.info(f"Resuming {entry.name} at {record.resume_offset()} bytes")
+        return CopyTask(entry.path, record.dst_paths, entry.size, is_video, resume_offset=record.resume_offset(),
+                        manifest=manifest, manifest_key=manifest_key, hash_algorithm=hash_algorithm)
+
+    def plan_sidecars(self, entry, dst_paths, manifest, hash_algorithm, name_index, tasks, result):
+        """附属文件（如 C0001M01.XML）拷到媒体文件所在的目录，并跟随媒体文件的新名字改名
+
+        与媒体文件相同：已拷贝过的跳过，拷到一半的续传到原来的名字（与当时的媒体文件名配对），
+        目标中已有内容相同的文件时不再拷出 _1 副本。
+        """
+        folders = [os.path.dirname(path) for path in dst_paths]
+        check_folders = self.final_folders(folders)
+        resolve_folders = folders if check_folders is folders else folders + check_folders
+        media_name = os.path.basename(dst_paths[0])
+        for sidecar in entry.sidecars:
+            manifest_key = (sidecar.rel_path, sidecar.size, sidecar.mtime_ns)
+            record, fingerprint = self.lookup_manifest(manifest, manifest_key, sidecar.path)
+            if record is not None and record.destinations_complete():
+                result.skipped_files += 1
+                self.discard_stale_partials(record)
+                continue
+            if self.resumable(record):
+                tasks.append(self.resume_task(sidecar, False, record, manifest, manifest_key, hash_algorithm))
+                continue
+            if record is not None:
+                self.discard_stale_partials(record)
+            file = sidecar_name(sidecar, entry.name, media_name)
+            identical = name_index.find_identical(check_folders, file, sidecar.path, sidecar.size)
+            if identical is not None:
+                existing_paths, source_hash = identical
+                logging.info(f"Identical file already at {existing_paths[0]}, skipping: {file}")
+                result.identical_files += 1
+                if manifest:
+                    manifest.begin(manifest_key, existing_paths, fingerprint=fingerprint)
+                    manifest.finish(manifest_key, source_hash, True, hash_algorithm)
+                continue
+            paths = name_index.resolve(resolve_folders, file, self._reserved_paths)[:len(folders)]
+            self._own_reserved_paths.update(paths)
+            if manifest:
+                manifest.begin(manifest_key, paths, fingerprint=fingerprint)
+            tasks.append(CopyTask(sidecar.path, paths, sidecar.size, False,
+                                  manifest=manifest, manifest_key=manifest_key, hash_algorithm=hash_algorithm))
+
+    def plan_entry(self, entry, hash_algorithm, result, name_index, templates, tasks):
+        """为一个文件确定目标路径，生成的拷贝任务（含附属文件）追加到 tasks（需持有规划锁）"""
+        options = self.options
+        # 路由规则决定目标目录和子文件夹，没有匹配规则或规则为 skip 的文件不拷贝
+        route = options.routing.route(entry)
+        if route is None or route.target == TARGET_SKIP:
+            logging.debug("No route, skipping: %s", entry.rel_path)
+            return
+        template = templates[1] if entry.is_video else templates[0]
+        file = template.render(entry) if template else entry.name
+        target_dir = options.image_target if route.target == KIND_IMAGE else options.video_target
+        write_dir = self.write_root(target_dir)
+
+        # 查询清单：已完整拷贝过的文件直接跳过，拷到一半的文件续传到原来的目标路径
+        manifest = self.get_manifest(write_dir)
+        manifest_key = (entry.rel_path, entry.size, entry.mtime_ns)
+        record, fingerprint = self.lookup_manifest(manifest, manifest_key, entry.path)
+        if record is not None and record.destinations_complete():
+            logging.debug("Already ingested, skipping: %s", file)
+            result.skipped_files += 1
+            self.discard_stale_partials(record)
+            self.plan_sidecars(entry, record.dst_paths, manifest, hash_algorithm, name_index, tasks, result)
+            return
+        if self.resumable(record):
+            tasks.append(self.resume_task(entry, entry.is_video, record, manifest, manifest_key, hash_algorithm))
+            self.set_preview_path(tasks[-1], entry, route, write_dir)
+            self.plan_sidecars(entry, record.dst_paths, manifest, hash_algorithm, name_index, tasks, result)
+            return
+        if record is not None:
+            # 无法续传（目标目录已不存在或已被删除的文件）时重新规划，原来的临时文件不再使用
+            self.discard_stale_partials(record)
+
+        # 图库中其他活动文件夹里已经有这个文件（如重复插入未格式化的卡）
+        if self._libraries:
+            existing = self.find_in_library(entry)
+            if existing:
+                result.archived_files.append({'source': entry.path, 'existing': existing})
+                if options.library_dedup == DEDUP_SKIP:
+                    logging.info(f"Already archived at {existing}, skipping: {file}")
+                    return
+
+        folder_path = os.path.join(write_dir, f'{entry.date}_{options.event_name}')
+        target_subfolder = self.ensure_target_folder(folder_path, route)
+        if target_subfolder is None:
+            return
+        target_subfolders, check_subfolders = self.destination_subfolders(target_subfolder, write_dir, target_dir)
+        # 目标中已有内容相同的文件（如重复插入同一张卡）时直接跳过，不再拷出 _1 副本
+        identical = name_index.find_identical(check_subfolders, file, entry.path, entry.size)
+        if identical is not None:
+            existing_paths, source_hash = identical
+            logging.info(f"Identical file already at {existing_paths[0]}, skipping: {file}")
+            result.identical_files += 1
+            if manifest:
+                manifest.begin(manifest_key, existing_paths, fingerprint=fingerprint)
+                manifest.finish(manifest_key, source_hash, True, hash_algorithm)
+            self.plan_sidecars(entry, existing_paths, manifest, hash_algorithm, name_index, tasks, result)
+            return
+        # 处理文件名重复情况（按扫描顺序依次分配，保证并发拷贝时命名确定；目录只列一次，不逐个探测）
+        resolve_subfolders = target_subfolders if check_subfolders is target_subfolders else (
+            target_subfolders + check_subfolders)
+        new_file_paths = name_index.resolve(resolve_subfolders, file, self._reserved_paths)[:len(target_subfolders)]
+        self._own_reserved_paths.update(new_file_paths)
+        if manifest:
+            manifest.begin(manifest_key, new_file_paths, fingerprint=fingerprint)
+        tasks.append(CopyTask(entry.path, new_file_paths, entry.size, entry.is_video,
+                              manifest=manifest, manifest_key=manifest_key, hash_algorithm=hash_algorithm))
+        self.set_preview_path(tasks[-1], entry, route, write_dir)
+        self.plan_sidecars(entry, new_file_paths, manifest, hash_algorithm, name_index, tasks, result)
+
+    def iter_plan(self, entries, hash_algorithm, result, estimated=False):
+        """按扫描顺序逐个规划文件并产出拷贝任务，规划与拷贝同时进行（命名仍然确定）
+
+        每个文件单独持有规划锁，多张卡同时拷贝时不会互相等待整张卡规划完。
+        estimated 为 True 表示进度总量已按 entries 预先计入，规划后改为实际需要拷贝的量。
+        """
+        # 目标中已有的校验清单只在需要比较已有文件时按活动文件夹读入
+        name_index = DestinationIndex(hash_algorithm, checksums=ChecksumIndex(self.final_roots()))
+        extra_algorithms = self.checksum_writer.extra_algorithms if self.checksum_writer is not None else ()
+        # 重命名模板每次拷卡只编译一次
+        templates = (compile_template(self.options.image_template), compile_template(self.options.video_template))
+        planned = 0
+        for entry in entries:
+            tasks = []
+            with self._planning_lock:
+                self.plan_entry(entry, hash_algorithm, result, name_index, templates, tasks)
+            bytes_delta = sum(task.size - task.resume_offset for task in tasks)
+            files_delta = len(tasks)
+            if estimated:
+                bytes_delta -= entry.size + sum(sidecar.size for sidecar in entry.sidecars)
+                files_delta -= 1 + len(entry.sidecars)
+            for task in tasks:
+                task.extra_algorithms = extra_algorithms
+            if bytes_delta or files_delta:
+                self.tracker.add_totals(bytes_delta, files_delta)
+            planned += 1
+            # 清单定期提交，崩溃后已经开始拷贝的文件能找到记录
+            if planned % MANIFEST_COMMIT_INTERVAL == 0:
+                self.commit_manifests()
+            yield from tasks
+        self.planned_entries = planned
+        self.commit_manifests()
+
+    def commit_manifests(self):
+        for manifest in self._manifests.values():
+            if manifest:
+                manifest.commit()
+
+    def _log_file_done(self, task):
+        file = os.path.basename(task.src_path)
+        if task.error is not None:
+            logging.error(f'拷贝文件时出错: {file}, 错误信息: {task.error}')
+        elif not task.verified:
+            for failed_path in task.failed_paths:
+                logging.error(f'哈希校验失败: {file} -> {failed_path}')
+        else:
+            # 每个文件一条的日志延迟格式化，日志级别高于 INFO 时没有格式化开销
+            logging.info('成功拷贝: %s', file)
+        if task.timings is not None:
+            instrumentation.event('file', sd_card=self.options.sd_card, source=task.src_path,
+                                  destinations=task.dst_paths, size=task.size, verified=task.verified,
+                                  error=str(task.error) if task.error else None,
+                                  timings={name: round(seconds, 6) for name, seconds in task.timings.items()})
+        # 暂存模式下校验清单和图库索引由搬运器在文件到达最终位置后按实际文件名写入
+        if self.staging_queue is not None and task.verified:
+            self.enqueue_move(task)
+        elif self.checksum_writer is not None and task.verified:
+            self.record_checksums(task)
+        if self.on_file_done:
+            self.on_file_done(task)
+
+    def enqueue_move(self, task):
+        """暂存目录中校验通过的文件登记到搬运队列，最终路径与暂存路径的相对位置相同"""
+        for staging_root, final_root in self._staging_roots.items():
+            if task.dst_path.startswith(staging_root + os.sep):
+                final_path = mirror_path(task.dst_path, staging_root, final_root)
+                final_paths = [final_path] + [mirror_path(final_path, final_root, backup_root)
+                                              for backup_root in self.options.backup_roots]
+                final_mounts = [self._final_mounts[final_root]] + [
+                    self._final_mounts[os.path.abspath(backup_root)] for backup_root in self.options.backup_roots]
+                checksum_formats = self.checksum_writer.formats if self.checksum_writer is not None else None
+                try:
+                    self.staging_queue.add(task, staging_root, final_root, final_paths, final_mounts, checksum_formats)
+                except Exception as e:
+                    logging.error(f"Failed to queue {task.dst_path} for moving: {e}")
+                return
+
+    def record_checksums(self, task):
+        """把校验通过的文件记入所在活动文件夹（主目标和各备份）的校验清单，缺少的哈希从已写入的文件计算"""
+        digests = dict(task.extra_digests)
+        digests[task.hash_algorithm] = task.source_hash
+        roots = self.final_roots()
+        for dst_path in task.dst_paths:
+            event_folder, rel_path = locate_event_folder(dst_path, roots)
+            if event_folder is None:
+                continue
+            try:
+                self.checksum_writer.add(event_folder, rel_path, dst_path, digests)
+            except (OSError, ValueError) as e:
+                logging.error(f"Failed to record checksum of {dst_path}: {e}")
+        self.checksum_files += 1
+
+    def run(self):
+        options = self.options
+        result = IngestResult(options.sd_card)
+        tracker = self.tracker
+        stage_times = {}
+        started = time.perf_counter()
+        instrumentation.event('run_start', sd_card=options.sd_card, event_name=options.event_name)
+        # auto 时首次运行会做一次哈希测速
+        result.hash_algorithm = resolve_algorithm(options.hash_algorithm)
+        entries = self.scan()
+        # 已有完整索引时总量可以预先算出，规划时再扣除跳过的文件；边扫描边拷贝时总量随规划增长
+        estimated = isinstance(entries, list)
+        if estimated:
+            if not entries:
+                result.no_files = True
+                return result
+            tracker.set_totals(sum(entry.size + sum(sidecar.size for sidecar in entry.sidecars) for entry in entries),
+                               sum(1 + len(entry.sidecars) for entry in entries))
+        tasks = []
+
+        def timed_plan():
+            # 扫描和规划与拷贝同时进行，单独记录它们结束的时间
+            yield from self.iter_plan(entries, result.hash_algorithm, result, estimated)
+            stage_times['scan_and_plan'] = time.perf_counter() - started
+
+        try:
+            if options.library_dedup:
+                self.open_libraries()
+            if options.checksum_formats:
+                try:
+                    self.checksum_writer = ChecksumManifestWriter(options.checksum_formats, result.hash_algorithm)
+                except ValueError as e:
+                    logging.error(f"Checksum manifests disabled: {e}")
+            if options.staging_dir:
+                self.staging_queue = StagingQueue(options.staging_dir)
+                for target_dir in (options.image_target, options.video_target):
+                    self._staging_roots[self.write_root(target_dir)] = os.path.abspath(target_dir)
+                # 最终目标此时不创建任何目录；记下它们所在的挂载点，搬运时挂载点变了（目标盘拔出）就等待
+                for root in self.final_roots():
+                    self._final_mounts[os.path.abspath(root)] = mount_point(root)
+            # 拷贝文件（线程池并发执行：视频走顺序通道，小图片分散到多个线程）
+            stage_start = time.perf_counter()
+            tracker.set_stage(STAGE_COPY)
+            previews = None
+            if options.previews:
+                # 进程池在第一次提交时才启动工作进程，没有需要预览的文件时几乎没有开销
+                previews = PreviewPipeline(options.preview_workers, options.preview_size)
+            try:
+                # 除扫描顺序外的策略要先规划完整张卡再排序
+                scheduled = order_tasks(timed_plan(), options.order)
+                tasks = run_copy_tasks(scheduled, image_workers=options.image_workers,
+                                       video_workers=options.video_workers, on_task_done=self._log_file_done,
+                                       tracker=tracker, fsync_policy=options.fsync_policy,
+                                       fsync_batch_size=options.fsync_batch_size, previews=previews)
+            finally:
+                if previews is not None:
+                    result.previews_created, result.previews_failed = previews.close()
+            stage_times['copy_and_verify'] = time.perf_counter() - stage_start
+            self.register_in_libraries(tasks)
+        finally:
+            for library in self._libraries:
+                library.close()
+            if self.checksum_writer is not None:
+                self.checksum_writer.close()
+                result.checksum_files = self.checksum_files
+            if self.staging_queue is not None:
+                self.staging_queue.close()
+            for manifest in self._manifests.values():
+                if manifest:
+                    manifest.close()
+            # 文件已经写到磁盘上，其他引擎分配名字时会在文件系统上再确认一次，提交时也不会覆盖
+            with self._planning_lock:
+                self._reserved_paths.difference_update(self._own_reserved_paths)
+
+        if not self.planned_entries:
+            result.no_files = True
+        tracker.set_stage(STAGE_DONE)
+        result.tasks = tasks
+        result.created_folders = sorted(self._created_folders)
+        result.summary = tracker.snapshot()
+        if instrumentation.enabled:
+            result.timings = self._collect_timings(tasks, stage_times, time.perf_counter() - started)
+            for stage, seconds in stage_times.items():
+                instrumentation.add_time(f'run.{stage}', seconds)
+            instrumentation.event('run_end', sd_card=options.sd_card, summary=result.summary.to_dict(),
+                                  timings=result.timings)
+        return result
+
+    @staticmethod
+    def _collect_timings(tasks, stage_times, total):
+        """汇总本次拷卡的阶段耗时，以及所有文件 open/read/hash/write/verify 的累计耗时"""
+        files = {}
+        for task in tasks:
+            for name, seconds in (task.timings or {}).items():
+                files[name] = files.get(name, 0.0) + seconds
+        return {
+            'total': round(total, 6),
+            'stages': {name: round(seconds, 6) for name, seconds in stage_times.items()},
+            'files': {name: round(seconds, 6) for name, seconds in files.items()},
+        }
@@ -0,0 +1,241 @@
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+
+from durability import partial_path
+
+# 清单数据库放在每个目标根目录下，记录从卡上拷贝过哪些文件
+MANIFEST_FILE_NAME = '.sd_copy_hub_manifest.sqlite3'
+
+# 拷贝中每写入这么多字节记录一次断点，既能续传又不会频繁写库
+CHECKPOINT_BYTES = 64 * 1024 * 1024
+
+STATUS_PARTIAL = 'partial'
+STATUS_DONE = 'done'
+STATUS_FAILED = 'failed'
+
+# 源文件内容指纹读取开头和结尾各 16KB：不同卡上同名、同大小、同修改时间（FAT 只精确到 2 秒）的文件靠它区分
+FINGERPRINT_SIZE = 16 * 1024
+
+
+def source_fingerprint(file_path, size):
+    """文件首尾各 FINGERPRINT_SIZE 字节（连同大小）的哈希"""
+    file_hash = hashlib.blake2b(str(size).encode(), digest_size=16)
+    with open(file_path, 'rb') as f:
+        file_hash.update(f.read(FINGERPRINT_SIZE))
+        if size > FINGERPRINT_SIZE:
+            f.seek(max(FINGERPRINT_SIZE, size - FINGERPRINT_SIZE))
+            file_hash.update(f.read(FINGERPRINT_SIZE))
+    return file_hash.hexdigest()
+
+
+class ManifestRecord:
+    """清单中的一条记录：源文件身份 + 目标路径 + 拷贝状态"""
+    def __init__(self, rel_path, size, mtime_ns, dst_paths, source_hash, bytes_done, status, hash_algorithm=None,
+                 fingerprint=None):
+        self.rel_path = rel_path
+        self.size = size
+        self.mtime_ns = mtime_ns
+        self.dst_paths = dst_paths
+        self.source_hash = source_hash
+        self.bytes_done = bytes_done
+        self.status = status
+        self.hash_algorithm = hash_algorithm
+        self.fingerprint = fingerprint
+
+    @property
+    def key(self):
+        return self.rel_path, self.size, self.mtime_ns
+
+    def destinations_complete(self):
+        """记录为已完成，且所有目标文件仍然存在、大小一致"""
+        if self.status != STATUS_DONE:
+            return False
+        for path in self.dst_paths:
+            try:
+                if os.path.getsize(path) != self.size:
+                    return False
+            except OSError:
+                return False
+        return True
+
+    def same_source(self, fingerprint):
+        """记录是否属于指纹为 fingerprint 的源文件
+
+        没有指纹的记录（首次拷贝时不读取源文件指纹，以及旧版本的记录）：已完成的按主目标文件的指纹比较，
+        拷到一半的交给续传时的逐块比较。
+        """
+        if fingerprint is None:
+            return False
+        if self.fingerprint is not None:
+            return self.fingerprint == fingerprint
+        if self.status != STATUS_DONE:
+            return True
+        try:
+            return source_fingerprint(self.dst_paths[0], self.size) == fingerprint
+        except (OSError, IndexError):
+            return False
+
+    def resume_offset(self):
+        """计算断点续传的起始位置：取记录的断点和各目标临时文件实际大小中的最小值"""
+        offset = self.bytes_done
+        for path in self.dst_paths:
+            try:
+                offset = min(offset, os.path.getsize(partial_path(path)))
+            except OSError:
+                return 0
+        return offset
+
+
+class IngestManifest:
+    """每个目标根目录一个 SQLite 清单，用于增量拷贝和崩溃后续传
+
+    源文件由 (卡内相对路径, 大小, 修改时间) 查找，再用内容指纹（source_fingerprint）确认是同一个文件，
+    另一张卡上恰好同名同大小的文件不会被当成已拷贝；拷贝线程池中的多个线程
+    共享同一个连接，写操作用锁串行化。
+    """
+    def __init__(self, db_path):
+        self.db_path = db_path
+        self._lock = threading.Lock()
+        # 多张卡同时拷到同一目标目录时会有多个连接，等待对方释放写锁而不是立即报错
+        self._conn = sqlite3.connect(db_path, timeout=30, check_same_thread=False)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute('PRAGMA synchronous=NORMAL')
+        self._conn.execute('''
+            CREATE TABLE IF NOT EXISTS ingested (
+                rel_path TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                mtime_ns INTEGER NOT NULL,
+                dst_paths TEXT NOT NULL,
+                source_hash TEXT,
+                bytes_done INTEGER NOT NULL DEFAULT 0,
+                status TEXT NOT NULL,
+                updated_at REAL NOT NULL,
+                hash_algorithm TEXT,
+                fingerprint TEXT,
+                PRIMARY KEY (rel_path, size, mtime_ns)
+            )
+        ''')
+        # 巡检记录：每个目标文件上次巡检时的大小、修改时间和结果，增量巡检跳过未变化的文件
+        self._conn.execute('''
+            CREATE TABLE IF NOT EXISTS scrubbed (
+                path TEXT PRIMARY KEY,
+                size INTEGER NOT NULL,
+                mtime_ns INTEGER NOT NULL,
+                ok INTEGER NOT NULL,
+                checked_at REAL NOT NULL
+            )
+        ''')
+        # 旧版本创建的清单没有 hash_algorithm、fingerprint 列，补上
+        columns = {row[1] for row in self._conn.execute('PRAGMA table_info(ingested)')}
+        for column in ('hash_algorithm', 'fingerprint'):
+            if column not in columns:
+                self._conn.execute(f'ALTER TABLE ingested ADD COLUMN {column} TEXT')
+        self._conn.commit()
+        self._last_checkpoint = {}
+
+    @classmethod
+    def for_root(cls, target_root):
+        os.makedirs(target_root, exist_ok=True)
+        return cls(os.path.join(target_root, MANIFEST_FILE_NAME))
+
+    def lookup(self, rel_path, size, mtime_ns):
+        with self._lock:
+            row = self._conn.execute(
+                'SELECT dst_paths, source_hash, bytes_done, status, hash_algorithm, fingerprint FROM ingested '
+                'WHERE rel_path = ? AND size = ? AND mtime_ns = ?',
+                (rel_path, size, mtime_ns)).fetchone()
+        if row is None:
+            return None
+        dst_paths, source_hash, bytes_done, status, hash_algorithm, fingerprint = row
+        return ManifestRecord(rel_path, size, mtime_ns, json.loads(dst_paths), source_hash, bytes_done, status,
+                              hash_algorithm, fingerprint)
+
+    def begin(self, key, dst_paths, bytes_done=0, fingerprint=None):
+        """登记一个即将拷贝的文件（规划阶段调用，随后统一 commit），fingerprint 见 source_fingerprint"""
+        rel_path, size, mtime_ns = key
+        with self._lock:
+            self._conn.execute(
+                'INSERT OR REPLACE INTO ingested '
+                '(rel_path, size, mtime_ns, dst_paths, source_hash, bytes_done, status, updated_at, fingerprint) '
+                'VALUES (?, ?, ?, ?, NULL, ?, ?, ?, ?)',
+                (rel_path, size, mtime_ns, json.dumps(dst_paths, ensure_ascii=False),
+                 bytes_done, STATUS_PARTIAL, time.time(), fingerprint))
+
+    def checkpoint(self, key, bytes_done):
+        """记录拷贝断点，按 CHECKPOINT_BYTES 节流"""
+        if bytes_done - self._last_checkpoint.get(key, 0) < CHECKPOINT_BYTES:
+            return
+        self._last_checkpoint[key] = bytes_done
+        self._update(key, 'bytes_done = ?', (bytes_done,))
+
+    def finish(self, key, source_hash, ok, hash_algorithm=None, dst_paths=None):
+        """记录拷贝结果，连同计算 source_hash 所用的算法一起保存
+
+        dst_paths 为实际提交的路径（提交时遇到重名改用了后缀名），None 表示与登记时相同。
+        """
+        self._last_checkpoint.pop(key, None)
+        status = STATUS_DONE if ok else STATUS_FAILED
+        rel_path, size, mtime_ns = key
+        bytes_done = size if ok else 0
+        assignments = 'source_hash = ?, bytes_done = ?, status = ?, hash_algorithm = ?'
+        values = (source_hash, bytes_done, status, hash_algorithm)
+        if dst_paths is not None:
+            assignments += ', dst_paths = ?'
+            values += (json.dumps(list(dst_paths), ensure_ascii=False),)
+        self._update(key, assignments, values)
+
+    def _update(self, key, assignments, values):
+        with self._lock:
+            try:
+                self._conn.execute(
+                    f'UPDATE ingested SET {assignments}, updated_at = ? '
+                    'WHERE rel_path = ? AND size = ? AND mtime_ns = ?',
+                    (*values, time.time(), *key))
+                self._conn.commit()
+            except sqlite3.Error as e:
+                logging.error(f'Failed to update manifest {self.db_path}: {e}')
+
+    def verified_files(self):
+        """所有拷贝成功且有哈希的目标文件 {目标路径: ManifestRecord}
+
+        同一目标路径有多条记录时（如删除后又拷入了另一个同名文件）以最后更新的为准。
+        """
+        with self._lock:
+            rows = self._conn.execute(
+                'SELECT rel_path, size, mtime_ns, dst_paths, source_hash, hash_algorithm FROM ingested '
+                'WHERE status = ? AND source_hash IS NOT NULL ORDER BY updated_at',
+                (STATUS_DONE,)).fetchall()
+        files = {}
+        for rel_path, size, mtime_ns, dst_paths, source_hash, hash_algorithm in rows:
+            record = ManifestRecord(rel_path, size, mtime_ns, json.loads(dst_paths), source_hash, size,
+                                    STATUS_DONE, hash_algorithm)
+            for path in record.dst_paths:
+                files[path] = record
+        return files
+
+    def scrub_states(self):
+        """上次巡检的结果 {目标路径: (大小, 修改时间, 是否通过, 巡检时间)}"""
+        with self._lock:
+            rows = self._conn.execute('SELECT path, size, mtime_ns, ok, checked_at FROM scrubbed').fetchall()
+        return {path: (size, mtime_ns, bool(ok), checked_at) for path, size, mtime_ns, ok, checked_at in rows}
+
+    def record_scrub(self, path, size, mtime_ns, ok):
+        """登记一个文件的巡检结果（随后统一 commit）"""
+        with self._lock:
+            self._conn.execute(
+                'INSERT OR REPLACE INTO scrubbed (path, size, mtime_ns, ok, checked_at) VALUES (?, ?, ?, ?, ?)',
+                (path, size, mtime_ns, int(ok), time.time()))
+
+    def commit(self):
+        with self._lock:
+            self._conn.commit()
+
+    def close(self):
+        with self._lock:
+            self._conn.commit()
+            self._conn.close()
@@ -0,0 +1,177 @@
+"""运行时埋点：计数器、计时器、异步日志和 JSON 事件日志
+
+埋点默认关闭，关闭时每个埋点只是一次属性判断，几乎没有开销；
+开启后按名称累计次数和耗时（如 copy.read、copy.hash、verify），可以导出为 JSON 性能剖析文件，
+并可把每个文件的处理过程写入 JSON Lines 事件日志。
+日志记录通过队列交给后台线程写出，拷贝线程不会被磁盘或终端 I/O 阻塞。
+"""
+import atexit
+import json
+import logging
+import logging.handlers
+import queue
+import sys
+import threading
+import time
+
+LOG_FORMAT = '%(asctime)s - %(levelname)s - %(message)s'
+# 默认只记录警告和错误：没人看日志时不为每个文件格式化和写出日志
+DEFAULT_LOG_LEVEL = logging.WARNING
+EVENT_LOGGER_NAME = 'sd_copy_hub.events'
+
+_log_listener = None
+
+
+def configure_logging(level=DEFAULT_LOG_LEVEL, log_file=None, stream=None):
+    """配置根日志：记录先放入队列，由后台线程写到终端（和日志文件）
+
+    可以重复调用，之前的配置会被替换。
+    """
+    global _log_listener
+    if isinstance(level, str):
+        level = logging.getLevelName(level.upper())
+    formatter = logging.Formatter(LOG_FORMAT)
+    handlers = [logging.StreamHandler(stream or sys.stderr)]
+    if log_file:
+        handlers.append(logging.FileHandler(log_file, encoding='utf-8'))
+    for handler in handlers:
+        handler.setFormatter(formatter)
+
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    if _log_listener is not None:
+        _log_listener.stop()
+    log_queue = queue.SimpleQueue()
+    root.addHandler(logging.handlers.QueueHandler(log_queue))
+    root.setLevel(level)
+    _log_listener = logging.handlers.QueueListener(log_queue, *handlers, respect_handler_level=True)
+    _log_listener.start()
+    return _log_listener
+
+
+def _stop_logging():
+    # 退出前把队列中剩余的日志全部写出
+    if _log_listener is not None:
+        _log_listener.stop()
+
+
+atexit.register(_stop_logging)
+
+
+class _NullTimer:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+_NULL_TIMER = _NullTimer()
+
+
+class _Timer:
+    __slots__ = ('_owner', '_name', '_start')
+
+    def __init__(self, owner, name):
+        self._owner = owner
+        self._name = name
+
+    def __enter__(self):
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self._owner.add_time(self._name, time.perf_counter() - self._start)
+        return False
+
+
+class Instrumentation:
+    """进程内共享的计数器和计时器（线程安全）"""
+    def __init__(self):
+        self.enabled = False
+        self._lock = threading.Lock()
+        self._counters = {}
+        self._timers = {}  # 名称 → [次数, 总耗时, 最长耗时]
+        self._started = time.time()
+        self._event_logger = None
+        self._event_listener = None
+
+    def enable(self, event_log=None):
+        """开启埋点；event_log 为 JSON Lines 事件日志的路径（可选）"""
+        self.enabled = True
+        if event_log and self._event_listener is None:
+            handler = logging.FileHandler(event_log, encoding='utf-8')
+            handler.setFormatter(logging.Formatter('%(message)s'))
+            event_queue = queue.SimpleQueue()
+            self._event_listener = logging.handlers.QueueListener(event_queue, handler)
+            self._event_listener.start()
+            self._event_logger = logging.getLogger(EVENT_LOGGER_NAME)
+            self._event_logger.propagate = False
+            self._event_logger.setLevel(logging.INFO)
+            self._event_logger.addHandler(logging.handlers.QueueHandler(event_queue))
+            atexit.register(self.close)
+
+    def close(self):
+        """停止事件日志，等待队列中的事件写完"""
+        if self._event_listener is not None:
+            self._event_listener.stop()
+            self._event_listener = None
+            for handler in list(self._event_logger.handlers):
+                self._event_logger.removeHandler(handler)
+            self._event_logger = None
+
+    def reset(self):
+        with self._lock:
+            self._counters = {}
+            self._timers = {}
+            self._started = time.time()
+
+    def count(self, name, value=1):
+        if not self.enabled:
+            return
+        with self._lock:
+            self._counters[name] = self._counters.get(name, 0) + value
+
+    def add_time(self, name, seconds):
+        if not self.enabled:
+            return
+        with self._lock:
+            timer = self._timers.get(name)
+            if timer is None:
+                self._timers[name] = [1, seconds, seconds]
+            else:
+                timer[0] += 1
+                timer[1] += seconds
+                if seconds > timer[2]:
+                    timer[2] = seconds
+
+    def timer(self, name):
+        """with instrumentation.timer('scan'): ... 累计代码块的耗时"""
+        return _Timer(self, name) if self.enabled else _NULL_TIMER
+
+    def event(self, kind, **fields):
+        """写一条 JSON 事件（未配置事件日志时忽略）"""
+        if self._event_logger is None:
+            return
+        record = {'time': round(time.time(), 6), 'event': kind, **fields}
+        self._event_logger.info(json.dumps(record, ensure_ascii=False, default=str))
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                'started_at': self._started,
+                'counters': dict(self._counters),
+                'timers': {name: {'count': count, 'total_seconds': round(total, 6), 'max_seconds': round(peak, 6)}
+                           for name, (count, total, peak) in self._timers.items()},
+            }
+
+    def dump(self, path):
+        """把当前的计数器和计时器写成 JSON 性能剖析文件"""
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(self.snapshot(), f, ensure_ascii=False, indent=2)
+            f.write('\n')
+
+
+# 全局共享的埋点（扫描、拷贝、校验线程共用）
+instrumentation = Instrumentation()
@@ -0,0 +1,235 @@
+"""图库内容索引：记录图片/视频目标目录中所有已归档文件的大小和哈希
+
+重复插入未格式化的卡时，拷贝前先算出源文件的首尾部分哈希，按 (大小, 部分哈希) 在索引中查找，
+再用完整哈希确认，图库中任意位置已有的文件可以直接跳过（或只报告）。部分哈希在文件登记时就算好，
+查找时不读取图库中大小相同的其他文件。索引只在首次使用时完整遍历一次图库，
+之后由每次拷卡自动登记新文件；手动整理过图库后可运行：
+
+    python library_index.py ~/Pictures ~/Movies
+"""
+import argparse
+import logging
+import os
+import sqlite3
+import sys
+import time
+
+from checksum_manifest import is_checksum_name
+from copy_engine import hash_file
+from hashing import new_hasher
+from instrumentation import configure_logging
+
+LIBRARY_DB_NAME = '.sd_copy_hub_library.sqlite3'
+# 部分哈希读取文件开头和结尾各 64KB：同尺寸的不同照片几乎不可能在这里完全相同
+PARTIAL_HASH_SIZE = 64 * 1024
+# 图库索引固定使用的哈希算法，与拷卡时选择的算法无关，保证历史记录可比
+LIBRARY_HASH_ALGORITHM = 'blake2b'
+
+DEDUP_SKIP = 'skip'
+DEDUP_REPORT = 'report'
+
+
+def partial_hash(file_path, size):
+    """计算文件首尾各 PARTIAL_HASH_SIZE 字节的哈希（连同文件大小）"""
+    file_hash = new_hasher(LIBRARY_HASH_ALGORITHM)
+    file_hash.update(str(size).encode())
+    with open(file_path, 'rb') as f:
+        file_hash.update(f.read(PARTIAL_HASH_SIZE))
+        if size > 2 * PARTIAL_HASH_SIZE:
+            f.seek(size - PARTIAL_HASH_SIZE)
+            file_hash.update(f.read(PARTIAL_HASH_SIZE))
+        elif size > PARTIAL_HASH_SIZE:
+            file_hash.update(f.read())
+    return file_hash.hexdigest()
+
+
+def _is_indexed_name(name):
+    # 跳过隐藏文件（包括本程序的拷卡记录和索引数据库）以及校验清单
+    return not name.startswith('.') and not is_checksum_name(name)
+
+
+class LibraryIndex:
+    """单个图库根目录的内容索引（SQLite，放在图库根目录下）
+
+    按目录分组存储，(size, partial_hash) 上建索引：百万级文件的图库中，一次查找只需一次索引查找；
+    部分哈希在登记时计算，完整哈希在部分哈希相同、需要确认时才计算并写回。
+    """
+    def __init__(self, root):
+        self.root = os.path.abspath(root)
+        self.db_path = os.path.join(self.root, LIBRARY_DB_NAME)
+        os.makedirs(self.root, exist_ok=True)
+        # 边扫描边规划时查找在拷贝的取任务线程中进行，登记在调用方线程中进行（先后进行，不会同时访问）
+        self._conn = sqlite3.connect(self.db_path, timeout=30, check_same_thread=False)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute('PRAGMA synchronous=NORMAL')
+        self._conn.executescript('''
+            CREATE TABLE IF NOT EXISTS files (
+                dir TEXT NOT NULL,
+                name TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                mtime_ns INTEGER NOT NULL,
+                partial_hash TEXT,
+                full_hash TEXT,
+                PRIMARY KEY (dir, name)
+            );
+            DROP INDEX IF EXISTS files_size;
+            CREATE INDEX IF NOT EXISTS files_size_partial ON files (size, partial_hash);
+            CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT);
+        ''')
+        self._conn.commit()
+
+    def close(self):
+        self._conn.commit()
+        self._conn.close()
+
+    @property
+    def built(self):
+        return self._conn.execute("SELECT 1 FROM meta WHERE key = 'built_at'").fetchone() is not None
+
+    def ensure_built(self):
+        """首次使用时完整遍历一次图库；旧版本建的索引缺少部分哈希时补算"""
+        if not self.built:
+            self.refresh()
+        else:
+            self.fill_partial_hashes()
+
+    def fill_partial_hashes(self):
+        """为还没有部分哈希的记录计算部分哈希，读不到的文件移除记录，返回补算的数量"""
+        rows = self._conn.execute('SELECT dir, name, size FROM files WHERE partial_hash IS NULL').fetchall()
+        if not rows:
+            return 0
+        start = time.monotonic()
+        for rel_dir, name, size in rows:
+            try:
+                value = partial_hash(os.path.join(self.root, rel_dir, name), size)
+            except OSError:
+                self._conn.execute('DELETE FROM files WHERE dir = ? AND name = ?', (rel_dir, name))
+                continue
+            self._conn.execute('UPDATE files SET partial_hash = ? WHERE dir = ? AND name = ?', (value, rel_dir, name))
+        self._conn.commit()
+        logging.info(f"Library index {self.root}: partial hashes of {len(rows)} files computed "
+                     f"in {time.monotonic() - start:.1f}s")
+        return len(rows)
+
+    def refresh(self):
+        """增量同步图库：只对新增或大小/修改时间变化的文件更新记录，已删除的文件移除记录
+
+        逐个目录比对，内存占用与图库大小无关。
+        """
+        start = time.monotonic()
+        seen_dirs = set()
+        added = removed = 0
+        stack = [self.root]
+        while stack:
+            folder = stack.pop()
+            rel_dir = os.path.relpath(folder, self.root)
+            seen_dirs.add(rel_dir)
+            current = {}
+            try:
+                with os.scandir(folder) as it:
+                    for entry in it:
+                        if not _is_indexed_name(entry.name):
+                            continue
+                        if entry.is_dir(follow_symlinks=False):
+                            stack.append(entry.path)
+                        elif entry.is_file(follow_symlinks=False):
+                            st = entry.stat(follow_symlinks=False)
+                            current[entry.name] = (st.st_size, st.st_mtime_ns)
+            except OSError as e:
+                logging.error(f"Failed to list {folder}: {e}")
+                continue
+            known = {name: (size, mtime_ns) for name, size, mtime_ns in self._conn.execute(
+                'SELECT name, size, mtime_ns FROM files WHERE dir = ?', (rel_dir,))}
+            stale = [(rel_dir, name) for name in known if name not in current]
+            changed = [(rel_dir, name, size, mtime_ns) for name, (size, mtime_ns) in current.items()
+                       if known.get(name) != (size, mtime_ns)]
+            if stale:
+                self._conn.executemany('DELETE FROM files WHERE dir = ? AND name = ?', stale)
+            if changed:
+                self._conn.executemany(
+                    'INSERT OR REPLACE INTO files (dir, name, size, mtime_ns) VALUES (?, ?, ?, ?)', changed)
+            added += len(changed)
+            removed += len(stale)
+        # 整个目录被删除时，删除该目录下的所有记录
+        known_dirs = [row[0] for row in self._conn.execute('SELECT DISTINCT dir FROM files')]
+        for rel_dir in known_dirs:
+            if rel_dir not in seen_dirs:
+                removed += self._conn.execute('DELETE FROM files WHERE dir = ?', (rel_dir,)).rowcount
+        self._conn.commit()
+        # 新增和变化的文件在这里统一计算部分哈希，查找时不再读取图库中的文件
+        self.fill_partial_hashes()
+        self._conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('built_at', ?)", (str(time.time()),))
+        self._conn.commit()
+        logging.info(f"Library index {self.root} refreshed in {time.monotonic() - start:.1f}s: "
+                     f"{added} added/updated, {removed} removed")
+        return added, removed
+
+    def register(self, file_path, full_hash=None):
+        """登记拷卡新写入的文件（同时计算部分哈希），full_hash 必须是 LIBRARY_HASH_ALGORITHM 算出的哈希"""
+        try:
+            st = os.stat(file_path)
+            value = partial_hash(file_path, st.st_size)
+        except OSError:
+            return
+        rel_dir, name = os.path.split(os.path.relpath(file_path, self.root))
+        self._conn.execute(
+            'INSERT OR REPLACE INTO files (dir, name, size, mtime_ns, partial_hash, full_hash) '
+            'VALUES (?, ?, ?, ?, ?, ?)', (rel_dir or '.', name, st.st_size, st.st_mtime_ns, value, full_hash))
+
+    def commit(self):
+        self._conn.commit()
+
+    def _candidate_valid(self, path, size, mtime_ns):
+        try:
+            st = os.stat(path)
+        except OSError:
+            return False
+        return st.st_size == size and st.st_mtime_ns == mtime_ns
+
+    def find_duplicate(self, src_path, size, source=None):
+        """查找图库中与源文件内容相同的文件，返回已有文件的路径或 None
+
+        source 是同一源文件在多个图库间共享的哈希缓存（{'partial': ..., 'full': ...}），
+        源文件的部分哈希和完整哈希都只读取一次；只有部分哈希相同的候选文件才会被访问。
+        """
+        if size <= 0:
+            return None
+        source = {} if source is None else source
+        if 'partial' not in source:
+            source['partial'] = partial_hash(src_path, size)
+        rows = self._conn.execute(
+            'SELECT dir, name, mtime_ns, full_hash FROM files WHERE size = ? AND partial_hash = ?',
+            (size, source['partial'])).fetchall()
+        for rel_dir, name, mtime_ns, stored_full in rows:
+            path = os.path.join(self.root, rel_dir, name)
+            if not self._candidate_valid(path, size, mtime_ns):
+                # 图库文件已被删除或修改，移除过期记录
+                self._conn.execute('DELETE FROM files WHERE dir = ? AND name = ?', (rel_dir, name))
+                continue
+            if 'full' not in source:
+                source['full'] = hash_file(src_path, algorithm=LIBRARY_HASH_ALGORITHM)
+            if stored_full is None:
+                stored_full = hash_file(path, algorithm=LIBRARY_HASH_ALGORITHM)
+                self._conn.execute('UPDATE files SET full_hash = ? WHERE dir = ? AND name = ?',
+                                   (stored_full, rel_dir, name))
+            if stored_full == source['full']:
+                return path
+        return None
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='重建/同步图库内容索引')
+    parser.add_argument('roots', nargs='+', help='图片/视频目标目录')
+    args = parser.parse_args(argv)
+    configure_logging(logging.INFO)
+    for root in args.roots:
+        index = LibraryIndex(root)
+        try:
+            index.refresh()
+        finally:
+            index.close()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,10 +1,8 @@
 import os
-import datetime
-import shutil
-import hashlib
+import bisect
 import logging
-from PIL import Image
-from PIL.ExifTags import TAGS
+import sys
+import threading
 import configparser
 from pathlib import Path
 from PyQt5.QtWidgets import (
@@ -13,12 +11,13 @@ from PyQt5.QtWidgets import (
     QCheckBox, QDialog
 )
 from PyQt5.QtGui import QFont, QPalette, QColor, QFontDatabase
-from PyQt5.QtCore import QThread, pyqtSignal, Qt
-logging.basicConfig(level=logging.DEBUG, format='%(asctime)s - %(levelname)s - %(message)s')
-
-# 读取配置文件
-config = configparser.ConfigParser()
-config.read('config.ini')
+from PyQt5.QtCore import QThread, QTimer, pyqtSignal, Qt
+# 启动时只导入界面和配置需要的轻量模块；拷卡引擎（哈希、SQLite、元数据解析、预览等）
+# 在第一次扫描或拷贝时才在后台线程中导入，窗口可以尽快显示出来
+from card_watcher import CardWatcher, default_card_directory, load_profiles, select_profile
+from instrumentation import configure_logging, instrumentation
+from progress import format_snapshot
+from rename_template import DEFAULT_IMAGE_TEMPLATE, DEFAULT_VIDEO_TEMPLATE
 
 # 获取用户图片和视频文件夹路径
 def get_user_pictures_folder():
@@ -35,16 +34,108 @@ def get_user_videos_folder():
         return os.path.join(str(Path.home()), 'Movies')
     return None
 
-# 获取默认路径
-image_target_directory = config.get('Paths', 'image_target_directory', fallback=get_user_pictures_folder())
-video_target_directory = config.get('Paths', 'video_target_directory', fallback=get_user_videos_folder())
-sd_card_directory = config.get('Paths', 'sd_card_directory', fallback='/Volumes/Untitled')
+# config.ini 放在程序所在目录（打包后为可执行文件所在目录），不受启动时当前目录的影响
+APP_DIRECTORY = os.path.dirname(os.path.abspath(sys.executable if getattr(sys, 'frozen', False) else __file__))
+CONFIG_PATH = os.path.join(APP_DIRECTORY, 'config.ini')
+config = configparser.ConfigParser()
+_routing_table = None
+_routing_lock = threading.Lock()
+
+
+def apply_config(config):
+    """把配置读入模块级设置，缺少的项使用默认值"""
+    global event_log_path, profile_path, image_target_directory, video_target_directory, sd_card_directory
+    global backup_directories, copy_image_workers, copy_video_workers, copy_hash_algorithm, copy_fsync_policy
+    global copy_fsync_batch_size, copy_order, rename_image_template, rename_video_template, library_dedup_enabled
+    global preview_enabled, preview_size, preview_workers, routing_rules_file, staging_directory
+    global checksum_manifest_formats, watcher_enabled, watcher_roots, watcher_profile, ingest_profiles
+    # 可选的 JSON 事件日志（每个文件一条）和性能剖析文件（每次拷卡后写出累计计数和耗时）
+    event_log_path = config.get('Logging', 'event_log', fallback='')
+    profile_path = config.get('Logging', 'profile', fallback='')
+    # 获取默认路径
+    image_target_directory = config.get('Paths', 'image_target_directory', fallback=get_user_pictures_folder())
+    video_target_directory = config.get('Paths', 'video_target_directory', fallback=get_user_videos_folder())
+    # 未配置时由 MainWindow 在后台线程中查找当前已插入的卡（见 card_watcher.default_card_directory）
+    sd_card_directory = config.get('Paths', 'sd_card_directory', fallback='')
+    # 备份目录，可配置多个，用 ; 分隔
+    backup_directories = config.get('Paths', 'backup_directories', fallback='')
+
+    # 并发拷贝配置（可在 config.ini 的 [Copy] 段中调整）
+    copy_image_workers = config.getint('Copy', 'image_workers', fallback=4)
+    copy_video_workers = config.getint('Copy', 'video_workers', fallback=1)
+    # 校验算法：auto（首次运行时测速选择最快的）、blake2b、xxh128（需安装 xxhash）或 sha256
+    copy_hash_algorithm = config.get('Copy', 'hash_algorithm', fallback='auto')
+    # 落盘策略（fsync 数据、重命名、fsync 目录）：file（最安全）、batch（每 fsync_batch_size 个文件）、directory、end（最快）
+    copy_fsync_policy = config.get('Copy', 'fsync', fallback='batch')
+    copy_fsync_batch_size = config.getint('Copy', 'fsync_batch_size', fallback=64)
+    # 拷贝顺序：scan（扫描顺序）、physical（卡上物理位置）、small-first（小文件优先）、by-folder（按目标目录分组）
+    copy_order = config.get('Copy', 'order', fallback='scan')
+    # 重命名模板（[Rename] 段），如 {date}_{time}_{camera}_{orig}，留空保留原文件名
+    rename_image_template = config.get('Rename', 'image_template', fallback=DEFAULT_IMAGE_TEMPLATE)
+    rename_video_template = config.get('Rename', 'video_template', fallback=DEFAULT_VIDEO_TEMPLATE)
+    # 是否跳过图库（图片/视频目标目录）中任意位置已经归档过的文件
+    library_dedup_enabled = config.getboolean('Library', 'skip_archived', fallback=False)
+    # 拷贝时生成预览图缓存（[Preview] 段）：RAW 提取内嵌预览，JPG 缩小，存到活动文件夹的 .previews 目录
+    preview_enabled = config.getboolean('Preview', 'enabled', fallback=False)
+    # 未配置时为 0，使用 previews 模块中的默认值
+    preview_size = config.getint('Preview', 'max_size', fallback=0)
+    preview_workers = config.getint('Preview', 'workers', fallback=0)
+    # 路由规则文件（[Routing] 段）：哪些扩展名拷到哪里，留空使用内置规则（python routing.py 可打印）
+    routing_rules_file = config.get('Routing', 'rules_file', fallback='')
+    # 暂存目录（[Staging] 段）：卡先拷到本地高速盘，校验后即可拔卡，再在后台搬运到（较慢的）目标目录和备份目录
+    staging_directory = config.get('Staging', 'directory', fallback='')
+    # 校验清单（[Checksums] 段）：formats 为空格分隔的 md5 / sha256 / xxh / mhl，每个活动文件夹一份，拷贝时逐个文件写入
+    checksum_manifest_formats = config.get('Checksums', 'formats', fallback='').split()
+    # 插卡自动识别（[Watcher] 段）：监视挂载目录（多个用 ; 分隔，留空为平台默认），插卡后自动填入路径并扫描
+    watcher_enabled = config.getboolean('Watcher', 'enabled', fallback=True)
+    watcher_roots = [path.strip() for path in config.get('Watcher', 'roots', fallback='').split(';') if path.strip()]
+    # 默认拷卡配置名；卷名匹配某个 [Profile:名称] 段的 volumes 时优先使用该配置
+    watcher_profile = config.get('Watcher', 'profile', fallback='')
+    ingest_profiles = load_profiles(config)
+
+
+def load_config():
+    """读取 config.ini 并配置日志（窗口显示后才调用，不推迟第一次绘制）"""
+    config.read(CONFIG_PATH, encoding='utf-8')
+    apply_config(config)
+    # 日志配置（[Logging] 段）：默认只记录警告和错误，日志由后台线程写出，不阻塞拷贝
+    configure_logging(config.get('Logging', 'level', fallback='WARNING'),
+                      log_file=config.get('Logging', 'file', fallback='') or None)
+    if event_log_path or profile_path:
+        instrumentation.enable(event_log=event_log_path or None)
+
+
+# 导入时只填入默认值，config.ini 在窗口显示后由 MainWindow.load_settings 读取
+apply_config(config)
+
+
+def get_routing_table():
+    """第一次扫描或拷贝时才读取并编译路由规则（扫描线程和拷贝线程共用）"""
+    global _routing_table
+    from routing import default_routing, load_routing
+    with _routing_lock:
+        if _routing_table is None:
+            try:
+                _routing_table = load_routing(routing_rules_file)
+            except (OSError, ValueError) as e:
+                logging.error(f"Failed to load routing rules {routing_rules_file}: {e}")
+                _routing_table = default_routing()
+        return _routing_table
+
+
+NO_FILES_MESSAGE = "SD 卡目录中没有可用的图片或视频文件，请检查路径。"
+COPY_ERROR_PREFIX = "拷贝出错："
+
 
 class CopyThread(QThread):
     progress_signal = pyqtSignal(int)
+    # 字节级进度快照（progress.ProgressSnapshot），最多每秒 20 次
+    stats_signal = pyqtSignal(object)
     result_signal = pyqtSignal(str)
 
-    def __init__(self, image_target, video_target, sd_card, event_name, selected_dates, separate_raw):
+    def __init__(self, image_target, video_target, sd_card, event_name, selected_dates, separate_raw,
+                 image_workers=None, video_workers=None, backup_roots=None, card_index=None,
+                 hash_algorithm=None, skip_archived=False, previews=False, checksum_formats=None):
         super().__init__()
         self.image_target = image_target
         self.video_target = video_target
@@ -53,148 +144,100 @@ class CopyThread(QThread):
         self.selected_dates = selected_dates
         # 新增：接收是否分开存放的参数
         self.separate_raw = separate_raw
+        # 并发拷贝线程数：小图片的线程数和大文件/视频的顺序通道数
+        self.image_workers = image_workers or copy_image_workers
+        self.video_workers = video_workers or copy_video_workers
+        # 备份根目录：每个块从卡上读出后同时写入主目标和所有备份目录
+        self.backup_roots = [root for root in (backup_roots or []) if root]
+        # 扫描线程已经建好的卡索引（没有则在拷贝线程中扫描一次）
+        self.card_index = card_index
+        self.hash_algorithm = hash_algorithm or copy_hash_algorithm
+        self.skip_archived = skip_archived
+        self.previews = previews
+        self.checksum_formats = checksum_formats or checksum_manifest_formats
+
+    def report_progress(self, snapshot):
+        # 已由 ProgressTracker 限频，这里直接转发给界面
+        self.progress_signal.emit(snapshot.percent)
+        self.stats_signal.emit(snapshot)
 
     def run(self):
-        # 定义图片文件的扩展名，包含更多 RAW 格式
-        image_extensions = (
-            '.jpg', '.jpeg', '.png', '.raw', '.nef', '.cr2', '.CR3',
-            '.arw',  # 索尼 RAW 格式
-            '.dng',  # 通用 RAW 格式
-            '.raf',  # 富士 RAW 格式
-            '.orf',  # 奥林巴斯 RAW 格式
-            '.pef',  # 宾得 RAW 格式
-            '.srw',  # 三星 RAW 格式
-            '.x3f'   # 适马 RAW 格式
-        )
-        # 单独定义RAW格式扩展名（需要和image_extensions保持一致）
-        raw_extensions = ('.raw', '.nef', '.cr2', '.CR3', '.arw', '.dng', '.raf', '.orf', '.pef', '.srw', '.x3f')
-        video_extensions = ('.mp4', '.avi', '.mov')
-
-        all_files = []
-        for root, dirs, files in os.walk(self.sd_card):
-            logging.debug(f"Processing directory: {root}")
-            for file in files:
-                file_path = os.path.join(root, file)
-                all_files.append(file_path)
-                # 增加调试信息，输出每个文件的扩展名
-                file_ext = os.path.splitext(file)[1].lower()
-                logging.debug(f"Found file: {file}, extension: {file_ext}")
-
-        total_files = len(all_files)
-        copied_files = 0
-        created_folders = set()
-
-        if total_files == 0:
-            self.result_signal.emit("SD 卡目录中没有可用的图片或视频文件，请检查路径。")
-            return
-
-        for file_path in all_files:
-            file = os.path.basename(file_path)
-            lower_file = file.lower()
-            is_image = False
-            is_video = False
-            for ext in image_extensions:
-                if lower_file.endswith(ext.lower()):
-                    is_image = True
-                    break
-            for ext in video_extensions:
-                if lower_file.endswith(ext.lower()):
-                    is_video = True
-                    break
-
-            if is_image or is_video:
-                try:
-                    date_taken = datetime.datetime.fromtimestamp(os.path.getmtime(file_path)).strftime('%Y%m%d')
-                    if self.selected_dates and date_taken not in self.selected_dates:
-                        continue
-                except Exception as e:
-                    logging.error(f"Failed to get modification time for {file}: {e}")
-                    continue
-
-                if is_image:
-                    target_dir = self.image_target
-                    logging.debug(f"File {file} identified as an image.")
-                elif is_video:
-                    target_dir = self.video_target
-                    logging.debug(f"File {file} identified as a video.")
-
-                logging.debug(f"Processing file: {file}")
-
-                # 创建包含活动名称的文件夹
-                folder_name = f'{date_taken}_{self.event_name}'
-                folder_path = os.path.join(target_dir, folder_name)
-                if folder_path not in created_folders:
-                    if not os.path.exists(folder_path):
-                        try:
-                            os.makedirs(folder_path)
-                            logging.info(f"Created folder: {folder_path}")
-                            if is_image:
-                                # 仅创建"原图"子目录（移除"选择"目录创建）
-                                original_folder = os.path.join(folder_path, '原图')
-                                if not os.path.exists(original_folder):
-                                    os.makedirs(original_folder)
-                                    logging.info(f"Created subfolder: {original_folder}")
-                                # 仅勾选时创建RAW/JPG子目录
-                                if self.separate_raw:
-                                    raw_folder = os.path.join(original_folder, 'RAW')
-                                    jpg_folder = os.path.join(original_folder, 'JPG')
-                                    if not os.path.exists(raw_folder):
-                                        os.makedirs(raw_folder)
-                                        logging.info(f"Created subfolder: {raw_folder}")
-                                    if not os.path.exists(jpg_folder):
-                                        os.makedirs(jpg_folder)
-                                        logging.info(f"Created subfolder: {jpg_folder}")
-                        except Exception as e:
-                            logging.error(f"Failed to create folder {folder_path}: {e}")
-                            continue
-                    created_folders.add(folder_path)
-
-                # 处理文件名重复情况
-                new_file_name = file
-                file_ext = os.path.splitext(file)[1].lower()
-                # 区分RAW和JPG存储路径
-                if is_image:
-                    # 新增：根据复选框状态选择目标子文件夹
-                    if self.separate_raw:
-                        if file_ext in raw_extensions:
-                            target_subfolder = os.path.join(folder_path, '原图', 'RAW')
-                        else:
-                            target_subfolder = os.path.join(folder_path, '原图', 'JPG')
-                    else:
-                        target_subfolder = os.path.join(folder_path, '原图')  # 不分类时直接存到“原图”
-                else:
-                    target_subfolder = folder_path
-                new_file_path = os.path.join(target_subfolder, new_file_name)
-                counter = 1
-                while os.path.exists(new_file_path):
-                    base_name, ext = os.path.splitext(file)
-                    new_file_name = f'{base_name}_{counter}{ext}'
-                    new_file_path = os.path.join(target_subfolder, new_file_name)
-                    counter += 1
-
-                # 拷贝文件并进行哈希校验
-                try:
-                    logging.info(f"Copying {file} to {new_file_path}")
-                    shutil.copy2(file_path, new_file_path)
-                    with open(file_path, 'rb') as f1, open(new_file_path, 'rb') as f2:
-                        hash1 = hashlib.sha256(f1.read()).hexdigest()
-                        hash2 = hashlib.sha256(f2.read()).hexdigest()
-                        if hash1 != hash2:
-                            logging.error(f'哈希校验失败: {file}')
-                        else:
-                            logging.info(f'成功拷贝: {file}')
-                except Exception as e:
-                    logging.error(f'拷贝文件时出错: {file}, 错误信息: {e}')
-
-            copied_files += 1
-            progress = int((copied_files / total_files) * 100)
-            self.progress_signal.emit(progress)
+        # 配置错误（如未知的 fsync 策略）或磁盘错误不能让界面一直停在拷贝中，出错时同样发出结果
+        try:
+            self.result_signal.emit(self.ingest())
+        except Exception as e:
+            logging.exception(f"Ingest of {self.sd_card} failed")
+            self.result_signal.emit(f"{COPY_ERROR_PREFIX}{e}")
+
+    def ingest(self):
+        """执行拷卡，返回要显示的结果"""
+        from ingest_engine import IngestEngine, IngestOptions
+        from library_index import DEDUP_SKIP
+
+        options = IngestOptions(
+            self.image_target, self.video_target, self.sd_card, self.event_name, self.selected_dates,
+            self.separate_raw, image_workers=self.image_workers, video_workers=self.video_workers,
+            backup_roots=self.backup_roots, hash_algorithm=self.hash_algorithm,
+            library_dedup=DEDUP_SKIP if self.skip_archived else None,
+            fsync_policy=copy_fsync_policy, fsync_batch_size=copy_fsync_batch_size,
+            image_template=rename_image_template, video_template=rename_video_template,
+            previews=self.previews, preview_size=preview_size, preview_workers=preview_workers,
+            routing=get_routing_table(), order=copy_order, staging_dir=staging_directory,
+            checksum_formats=self.checksum_formats)
+        engine = IngestEngine(options, card_index=self.card_index, on_progress=self.report_progress)
+        result = engine.run()
+        if profile_path:
+            try:
+                instrumentation.dump(profile_path)
+            except OSError as e:
+                logging.error(f"Failed to write profile {profile_path}: {e}")
+
+        if result.no_files:
+            return NO_FILES_MESSAGE
 
         # 确保进度条达到 100%
         self.progress_signal.emit(100)
 
-        result_msg = f"拷贝完成，生成的文件夹有：{', '.join(created_folders)}"
-        self.result_signal.emit(result_msg)
+        result_msg = f"拷贝完成，生成的文件夹有：{', '.join(result.created_folders)}"
+        if staging_directory:
+            result_msg = (f"已拷到暂存目录并校验完毕，可以拔卡，正在后台归档到目标目录"
+                          f"\n暂存的文件夹有：{', '.join(result.created_folders)}")
+        result_msg += (f"\n校验算法：{result.hash_algorithm}，校验通过 {result.summary.files_verified} 个"
+                       f"，失败 {result.summary.files_failed} 个")
+        if result.skipped_files:
+            result_msg += f"\n已跳过之前拷贝过的文件 {result.skipped_files} 个"
+        if result.identical_files:
+            result_msg += f"\n目标中已有相同文件，未重复拷贝 {result.identical_files} 个"
+        if result.archived_files:
+            result_msg += f"\n图库中已归档过，未重复拷贝 {len(result.archived_files)} 个"
+        if result.previews_created or result.previews_failed:
+            result_msg += f"\n已生成预览图 {result.previews_created} 张"
+            if result.previews_failed:
+                result_msg += f"，失败 {result.previews_failed} 张"
+        if result.checksum_files:
+            result_msg += f"\n已写入校验清单（{'/'.join(self.checksum_formats)}）{result.checksum_files} 个文件"
+        return result_msg
+
+
+class ScanThread(QThread):
+    """后台扫描 SD 卡，分批上报新发现的日期，扫描结束后交出完整索引"""
+    dates_signal = pyqtSignal(list)
+    finished_signal = pyqtSignal(object)
+
+    def __init__(self, sd_card):
+        super().__init__()
+        self.sd_card = sd_card
+
+    def run(self):
+        from card_scanner import scan_card
+
+        def on_batch(new_dates, scanned_count):
+            if new_dates:
+                self.dates_signal.emit(sorted(new_dates))
+
+        index = scan_card(self.sd_card, on_batch=on_batch, should_stop=self.isInterruptionRequested,
+                          routing=get_routing_table())
+        self.finished_signal.emit(index)
 
 
 class InstructionDialog(QDialog):
@@ -209,7 +252,7 @@ class InstructionDialog(QDialog):
 1. 选择目标目录：分别设置图片和视频的存储路径（默认使用系统图片/视频文件夹）
 2. 选择SD卡目录：指定需要拷贝的SD卡根目录
 3. 输入活动名称：用于生成带日期的目标文件夹（如20240520_公司活动）
-4. 选择日期：点击「获取日期」自动识别SD卡中文件的修改日期，可单选指定日期或选择「全部日期」
+4. 选择日期：点击「获取日期」自动识别SD卡中文件的拍摄日期（读取失败时使用修改日期），可单选指定日期或选择「全部日期」
 5. 高级选项：勾选「RAW和JPG文件分开保存」会在「原图」目录下自动创建RAW/JPG子文件夹
 6. 开始拷贝：确认设置后点击按钮开始拷贝，进度条会显示当前拷贝进度
 """
@@ -234,9 +277,59 @@ class InstructionDialog(QDialog):
 
 
 class MainWindow(QWidget):
+    # 插卡监视线程发现新卡时发出（跨线程信号，在界面线程中处理）
+    card_inserted = pyqtSignal(str)
+    # 后台线程找到的默认 SD 卡目录（未配置 sd_card_directory 时）
+    default_card_found = pyqtSignal(str)
+    # 后台搬运线程的进度快照和结果（成功数, 失败数）
+    staging_progress = pyqtSignal(object)
+    staging_finished = pyqtSignal(int, int)
+
     def __init__(self):
         super().__init__()
+        # 当前卡的扫描索引，拷贝线程直接复用，避免重复扫描
+        self.card_index = None
+        self.scan_thread = None
+        self.copy_thread = None
+        # 拷卡配置指定的校验算法和校验清单格式（None 时使用 config.ini 中的设置）
+        self.profile_hash_algorithm = None
+        self.profile_checksum_formats = None
+        # 扫描完成后是否自动开始拷贝（配置了 auto_ingest 的卡）
+        self.auto_ingest_card = None
+        # 拷贝过程中插入的卡，当前拷贝结束后再处理
+        self.waiting_card = None
+        self.staging_mover = None
         self.initUI()
+        self.card_inserted.connect(self.on_card_inserted)
+        self.default_card_found.connect(self.on_default_card_found)
+        self.staging_progress.connect(self.update_staging_stats)
+        self.staging_finished.connect(self.on_staging_finished)
+        # 事件循环开始后再读取配置，不推迟窗口显示
+        QTimer.singleShot(0, self.load_settings)
+
+    def load_settings(self):
+        """读取 config.ini，把其中的设置填入界面，再启动后台搬运和插卡监视"""
+        try:
+            load_config()
+        except (configparser.Error, ValueError) as e:
+            logging.error(f"Failed to read {CONFIG_PATH}: {e}")
+            QMessageBox.warning(self, "错误", f"配置文件 {CONFIG_PATH} 有误，使用默认设置：{e}")
+            apply_config(configparser.ConfigParser())
+        self.image_input.setText(image_target_directory)
+        self.video_input.setText(video_target_directory)
+        self.sd_input.setText(sd_card_directory)
+        if not sd_card_directory:
+            # 查找已插入的卡要列出挂载目录，网络盘或休眠的硬盘可能很慢，放到后台线程中
+            threading.Thread(target=lambda: self.default_card_found.emit(default_card_directory()),
+                             name='card-discovery', daemon=True).start()
+        self.backup_input.setText(backup_directories)
+        self.skip_archived_checkbox.setChecked(library_dedup_enabled)
+        self.previews_checkbox.setChecked(preview_enabled)
+        if staging_directory:
+            # 继续搬运上次没有搬完的文件
+            self.start_staging_mover()
+        if watcher_enabled:
+            self.start_card_watcher()
 
     def initUI(self):
         # 设置窗口标题和大小
@@ -336,6 +429,20 @@ class MainWindow(QWidget):
         sd_layout.addWidget(self.sd_input, 1)
         sd_layout.addWidget(sd_button)
 
+        # 备份目录（可选，多个目录用 ; 分隔，拷卡时一次读卡同时写入）
+        backup_layout = QHBoxLayout()
+        backup_label = QLabel('备份目录:')
+        backup_label.setFixedWidth(100)
+        self.backup_input = QLineEdit(backup_directories)
+        self.backup_input.setPlaceholderText('可选，多个目录用 ; 分隔')
+        self.backup_input.setStyleSheet(input_style)
+        backup_button = QPushButton('添加目录')
+        backup_button.setStyleSheet(button_style)
+        backup_button.clicked.connect(self.select_backup_directory)
+        backup_layout.addWidget(backup_label)
+        backup_layout.addWidget(self.backup_input, 1)
+        backup_layout.addWidget(backup_button)
+
         # 活动名称输入（优化：标签对齐+输入框扩展）
         event_layout = QHBoxLayout()
         event_label = QLabel('活动名称:')
@@ -356,9 +463,18 @@ class MainWindow(QWidget):
         # 复选框直接跟随标题，不额外添加边距
         self.separate_raw_checkbox = QCheckBox('RAW和JPG文件分开保存')
         self.separate_raw_checkbox.setFont(main_font)
+        # 图库去重：图片/视频目标目录中任意活动文件夹里已有的文件不再拷贝
+        self.skip_archived_checkbox = QCheckBox('跳过图库中已有的文件')
+        self.skip_archived_checkbox.setFont(main_font)
+        self.skip_archived_checkbox.setChecked(library_dedup_enabled)
+        self.previews_checkbox = QCheckBox('生成预览图')
+        self.previews_checkbox.setFont(main_font)
+        self.previews_checkbox.setChecked(preview_enabled)
         # 添加顺序：标题+复选框
         separate_layout.addWidget(separate_title)
         separate_layout.addWidget(self.separate_raw_checkbox)
+        separate_layout.addWidget(self.skip_archived_checkbox)
+        separate_layout.addWidget(self.previews_checkbox)
 
         # 日期选择布局（调整下拉框高度）
         date_layout = QHBoxLayout()  # 新增：初始化日期选择布局
@@ -411,6 +527,16 @@ class MainWindow(QWidget):
             }
         """)
 
+        # 进度详情（已拷贝字节、速度、剩余时间），与进度条一起显示
+        self.stats_label = QLabel()
+        self.stats_label.setVisible(False)
+        self.stats_label.setStyleSheet("padding: 0 10px; color: palette(window-text);")
+
+        # 暂存模式下后台归档到目标目录的进度
+        self.staging_label = QLabel()
+        self.staging_label.setVisible(False)
+        self.staging_label.setStyleSheet("padding: 0 10px; color: palette(window-text);")
+
         # 结果标签（优化：增加内边距+文字颜色）
         self.result_label = QLabel()
         self.result_label.setFont(QFont('SF Pro', 12))
@@ -440,7 +566,7 @@ class MainWindow(QWidget):
 1. 选择目标目录：分别设置图片和视频的存储路径（默认使用系统图片/视频文件夹）
 2. 选择SD卡目录：指定需要拷贝的SD卡根目录
 3. 输入活动名称：用于生成带日期的目标文件夹（如20240520_公司活动）
-4. 选择日期：点击「获取日期」自动识别SD卡中文件的修改日期，可单选指定日期或选择「全部日期」
+4. 选择日期：点击「获取日期」自动识别SD卡中文件的拍摄日期（读取失败时使用修改日期），可单选指定日期或选择「全部日期」
 5. 高级选项：勾选「RAW和JPG文件分开保存」会在「原图」目录下自动创建RAW/JPG子文件夹
 6. 开始拷贝：确认设置后点击按钮开始拷贝，进度条会显示当前拷贝进度
 """
@@ -465,10 +591,13 @@ class MainWindow(QWidget):
         main_layout.addLayout(image_layout)
         main_layout.addLayout(video_layout)
         main_layout.addLayout(sd_layout)
+        main_layout.addLayout(backup_layout)
         main_layout.addLayout(event_layout)
         main_layout.addLayout(separate_layout)
         main_layout.addLayout(date_layout)
         main_layout.addWidget(self.progress_bar)
+        main_layout.addWidget(self.stats_label)
+        main_layout.addWidget(self.staging_label)
         main_layout.addWidget(self.result_label)
         main_layout.addWidget(start_button, 0, Qt.AlignCenter)  # 按钮居中
 
@@ -495,40 +624,107 @@ class MainWindow(QWidget):
         if directory:
             self.sd_input.setText(directory)
 
+    def select_backup_directory(self):
+        directory = QFileDialog.getExistingDirectory(self, '选择备份目录')
+        if directory:
+            # 追加到已有的备份目录列表中
+            backups = [path for path in self.backup_input.text().split(';') if path.strip()]
+            if directory not in backups:
+                backups.append(directory)
+            self.backup_input.setText(';'.join(backups))
+
     def get_dates(self):
+        """在后台线程扫描 SD 卡，扫描过程中逐步填充日期下拉框"""
         sd_card = self.sd_input.text()
-        image_extensions = (
-            '.jpg', '.jpeg', '.png', '.raw', '.nef', '.cr2', '.CR3',
-            '.arw',  # 索尼 RAW 格式
-            '.dng',  # 通用 RAW 格式
-            '.raf',  # 富士 RAW 格式
-            '.orf',  # 奥林巴斯 RAW 格式
-            '.pef',  # 宾得 RAW 格式
-            '.srw',  # 三星 RAW 格式
-            '.x3f'   # 适马 RAW 格式
-        )
-        video_extensions = ('.mp4', '.avi', '.mov')
-        dates = set()
-        for root, dirs, files in os.walk(sd_card):
-            for file in files:
-                lower_file = file.lower()
-                is_image = any(lower_file.endswith(ext.lower()) for ext in image_extensions)
-                is_video = any(lower_file.endswith(ext.lower()) for ext in video_extensions)
-                if is_image or is_video:
-                    file_path = os.path.join(root, file)
-                    try:
-                        date_taken = datetime.datetime.fromtimestamp(os.path.getmtime(file_path)).strftime('%Y%m%d')
-                        dates.add(date_taken)
-                    except Exception as e:
-                        logging.error(f"Failed to get modification time for {file}: {e}")
+        if self.scan_thread is not None and self.scan_thread.isRunning():
+            self.scan_thread.requestInterruption()
+            self.scan_thread.wait()
+        self.card_index = None
         self.date_combo.clear()
         self.date_combo.addItem("全部日期")
-        for date in sorted(dates):
-            self.date_combo.addItem(date)
+        self.scan_thread = ScanThread(sd_card)
+        self.scan_thread.dates_signal.connect(self.add_dates)
+        self.scan_thread.finished_signal.connect(self.on_scan_finished)
+        self.scan_thread.start()
+
+    def add_dates(self, dates):
+        # 按日期顺序插入新扫描到的日期（第 0 项固定为“全部日期”）
+        existing = [self.date_combo.itemText(i) for i in range(1, self.date_combo.count())]
+        for date in dates:
+            position = 1 + bisect.bisect_left(existing, date)
+            existing.insert(position - 1, date)
+            self.date_combo.insertItem(position, date)
+
+    def on_scan_finished(self, index):
+        self.card_index = index
+        if index.complete:
+            self.result_label.setText(f"扫描完成，共 {len(index.entries)} 个图片/视频文件")
+            if self.auto_ingest_card and self.auto_ingest_card == index.sd_card == self.sd_input.text():
+                self.auto_ingest_card = None
+                self.start_copying()
+
+    def start_staging_mover(self):
+        from staging import BackgroundMover
+        if self.staging_mover is None:
+            self.staging_mover = BackgroundMover(staging_directory, on_progress=self.staging_progress.emit,
+                                                 on_finished=self.staging_finished.emit,
+                                                 fsync_policy=copy_fsync_policy,
+                                                 fsync_batch_size=copy_fsync_batch_size)
+            self.staging_mover.start()
+        else:
+            self.staging_mover.wake()
+
+    def update_staging_stats(self, snapshot):
+        self.staging_label.setVisible(True)
+        self.staging_label.setText(f"归档到目标目录：{format_snapshot(snapshot)}")
+
+    def on_staging_finished(self, moved, failed):
+        text = f"归档完成：已搬运到目标目录 {moved} 个文件"
+        if failed:
+            text += f"，失败 {failed} 个（暂存文件已保留，下次启动或拷卡后自动重试）"
+        self.staging_label.setText(text)
+
+    def on_default_card_found(self, card_path):
+        # 这期间用户已经选择了目录或插卡监视已经填入了新卡时不覆盖
+        if not self.sd_input.text():
+            self.sd_input.setText(card_path)
+
+    def start_card_watcher(self):
+        """在后台守护线程中监视挂载目录，程序退出时无需等待"""
+        watcher = CardWatcher(watcher_roots or None, on_card=self.card_inserted.emit)
+        threading.Thread(target=watcher.run, name='card-watcher', daemon=True).start()
+
+    def on_card_inserted(self, card_path):
+        if self.copy_thread is not None and self.copy_thread.isRunning():
+            self.waiting_card = card_path
+            self.result_label.setText(f"检测到存储卡 {card_path}，当前拷贝完成后再处理")
+            return
+        profile = select_profile(ingest_profiles, card_path, watcher_profile)
+        if profile is not None:
+            self.apply_profile(profile)
+        self.auto_ingest_card = card_path if profile is not None and profile.auto_ingest else None
+        self.sd_input.setText(card_path)
+        self.result_label.setText(f"检测到存储卡 {card_path}，正在扫描…")
+        self.get_dates()
+
+    def apply_profile(self, profile):
+        """把拷卡配置填入界面，未设置的项保持不变"""
+        if profile.image_target:
+            self.image_input.setText(profile.image_target)
+        if profile.video_target:
+            self.video_input.setText(profile.video_target)
+        if profile.event_name:
+            self.event_input.setText(profile.event_name)
+        if profile.backup_roots:
+            self.backup_input.setText(';'.join(profile.backup_roots))
+        self.separate_raw_checkbox.setChecked(profile.separate_raw)
+        self.profile_hash_algorithm = profile.hash_algorithm or None
+        self.profile_checksum_formats = profile.checksum_formats or None
 
     def start_copying(self):
         # 显示进度条
         self.progress_bar.setVisible(True)
+        self.stats_label.setVisible(True)
         # 清空上次结果
         self.result_label.setText("")
         
@@ -537,8 +733,9 @@ class MainWindow(QWidget):
         video_target = self.video_input.text()
         sd_card = self.sd_input.text()
         event_name = self.event_input.text()
-        selected_dates = [self.date_combo.currentText()] if self.date_combo.currentText() != "全部日期" else []
+        selected_dates = {self.date_combo.currentText()} if self.date_combo.currentText() != "全部日期" else set()
         separate_raw = self.separate_raw_checkbox.isChecked()
+        backup_roots = [path.strip() for path in self.backup_input.text().split(';') if path.strip()]
     
         # 校验输入（补充基础校验逻辑）
         if not image_target or not video_target or not sd_card:
@@ -546,19 +743,36 @@ class MainWindow(QWidget):
             return
     
         # 启动拷贝线程
-        self.copy_thread = CopyThread(image_target, video_target, sd_card, event_name, selected_dates, separate_raw)
+        self.copy_thread = CopyThread(image_target, video_target, sd_card, event_name, selected_dates, separate_raw,
+                                      backup_roots=backup_roots, card_index=self.card_index,
+                                      hash_algorithm=self.profile_hash_algorithm,
+                                      skip_archived=self.skip_archived_checkbox.isChecked(),
+                                      previews=self.previews_checkbox.isChecked(),
+                                      checksum_formats=self.profile_checksum_formats)
         self.copy_thread.progress_signal.connect(self.update_progress)
+        self.copy_thread.stats_signal.connect(self.update_stats)
         self.copy_thread.result_signal.connect(self.show_result)
         self.copy_thread.start()
 
     def update_progress(self, progress):
         self.progress_bar.setValue(progress)
 
+    def update_stats(self, snapshot):
+        self.stats_label.setText(format_snapshot(snapshot))
+
     def show_result(self, result):
-        if "SD 卡目录中没有可用的图片或视频文件" in result:
+        if staging_directory:
+            self.start_staging_mover()
+        if result == NO_FILES_MESSAGE:
             QMessageBox.warning(self, "警告", result)
+        elif result.startswith(COPY_ERROR_PREFIX):
+            self.result_label.setText(result)
+            QMessageBox.critical(self, "错误", result)
         else:
             self.result_label.setText(result)
+        if self.waiting_card:
+            card_path, self.waiting_card = self.waiting_card, None
+            self.on_card_inserted(card_path)
 
     def show_instruction_dialog(self):
         """显示使用说明对话框"""
@@ -566,7 +780,6 @@ class MainWindow(QWidget):
         dialog.exec_()  # 模态显示对话框（阻塞主窗口）
 
 if __name__ == '__main__':
-    import sys
     app = QApplication(sys.argv)  # 必须先创建 QApplication 实例
     window = MainWindow()
     window.show()
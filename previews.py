@@ -0,0 +1,273 @@
+"""拷卡时顺带生成预览图缓存，选片软件不必再逐个解码 RAW
+
+RAW 文件（ARW/NEF/CR2/DNG/RAF/CR3 等）中都嵌有相机生成的 JPEG 预览：拷贝线程在数据流经内存时，
+根据第一个块中的文件头找到预览所在的字节范围，只把这一段复制出来；JPG 则整个收下。
+收齐后交给进程池缩小并写入活动文件夹下的 .previews 目录，卡不会被再读一遍，
+解码和缩放也不占用拷贝线程（和 GIL）。
+
+进程池忙不过来（积压超过上限）或断点续传的文件不在拷贝时截取，
+拷卡结束后再从目标盘上的文件补做。
+"""
+import io
+import logging
+import os
+import struct
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+PREVIEW_DIR_NAME = '.previews'
+# 预览图长边的默认像素数，够选片软件全屏浏览
+DEFAULT_PREVIEW_SIZE = 1600
+DEFAULT_PREVIEW_WORKERS = 2
+# 同时在内存中等待缩放的预览数上限，超过后改为拷卡结束后补做，内存占用有上限
+MAX_PENDING_PREVIEWS = 8
+# 超过这个大小的预览（或 JPG）不在拷贝时截取
+MAX_CAPTURE_BYTES = 64 * 1024 * 1024
+JPEG_QUALITY = 85
+
+JPEG_EXTENSIONS = ('.jpg', '.jpeg')
+
+_JPEG_SOI = b'\xff\xd8'
+_RAF_MAGIC = b'FUJIFILMCCD-RAW '
+# CR3 中存放 PRVW 预览的 uuid 盒子
+_CR3_PREVIEW_UUID = bytes.fromhex('eaf42b5e1c984b88b9fbb7dc406e4d16')
+
+TAG_COMPRESSION = 0x0103
+TAG_STRIP_OFFSETS = 0x0111
+TAG_STRIP_BYTE_COUNTS = 0x0117
+TAG_SUB_IFDS = 0x014A
+TAG_JPEG_OFFSET = 0x0201
+TAG_JPEG_LENGTH = 0x0202
+_COMPRESSION_JPEG = 6
+_MAX_IFDS = 16
+
+
+def _tiff_preview_ranges(data):
+    """遍历 TIFF 的 IFD 链和 SubIFD，找出所有嵌入 JPEG 的 (偏移, 长度)"""
+    if len(data) < 8:
+        return []
+    order = bytes(data[:2])
+    if order == b'II':
+        endian = '<'
+    elif order == b'MM':
+        endian = '>'
+    else:
+        return []
+    ranges = []
+    pending = [struct.unpack_from(endian + 'I', data, 4)[0]]
+    visited = set()
+    while pending and len(visited) < _MAX_IFDS:
+        offset = pending.pop()
+        if not offset or offset in visited or offset + 2 > len(data):
+            continue
+        visited.add(offset)
+        count = struct.unpack_from(endian + 'H', data, offset)[0]
+        if offset + 2 + count * 12 + 4 > len(data):
+            continue
+        tags = {}
+        for i in range(count):
+            entry = offset + 2 + i * 12
+            tag, value_type, value_count, value = struct.unpack_from(endian + 'HHII', data, entry)
+            if value_type == 3 and value_count == 1:
+                value = struct.unpack_from(endian + 'H', data, entry + 8)[0]
+            tags[tag] = (value_count, value)
+        if TAG_JPEG_OFFSET in tags and TAG_JPEG_LENGTH in tags:
+            ranges.append((tags[TAG_JPEG_OFFSET][1], tags[TAG_JPEG_LENGTH][1]))
+        # CR2 等格式：Compression 为 JPEG 时 StripOffsets 指向的就是预览
+        if (tags.get(TAG_COMPRESSION, (0, 0))[1] == _COMPRESSION_JPEG
+                and tags.get(TAG_STRIP_OFFSETS, (0, 0))[0] == 1 and tags.get(TAG_STRIP_BYTE_COUNTS, (0, 0))[0] == 1):
+            ranges.append((tags[TAG_STRIP_OFFSETS][1], tags[TAG_STRIP_BYTE_COUNTS][1]))
+        if TAG_SUB_IFDS in tags:
+            sub_count, sub_value = tags[TAG_SUB_IFDS]
+            if sub_count == 1:
+                pending.append(sub_value)
+            elif sub_value + sub_count * 4 <= len(data):
+                pending.extend(struct.unpack_from(endian + 'I' * sub_count, data, sub_value))
+        pending.append(struct.unpack_from(endian + 'I', data, offset + 2 + count * 12)[0])
+    return ranges
+
+
+def _cr3_preview_range(data):
+    position = 0
+    while position + 8 <= len(data):
+        size, kind = struct.unpack_from('>I4s', data, position)
+        if size == 1 and position + 16 <= len(data):
+            size = struct.unpack_from('>Q', data, position + 8)[0]
+        if size < 8:
+            return None
+        if kind == b'uuid' and bytes(data[position + 8:position + 24]) == _CR3_PREVIEW_UUID:
+            index = bytes(data[position + 24:min(position + size, position + 1024)]).find(b'PRVW')
+            if index < 0:
+                return None
+            box = position + 24 + index - 4
+            # PRVW：8 字节盒子头 + 12 字节宽高等信息 + 4 字节 JPEG 长度，随后是 JPEG 数据
+            if box + 24 > len(data):
+                return None
+            return box + 24, struct.unpack_from('>I', data, box + 20)[0]
+        position += size
+    return None
+
+
+def locate_preview(head, ext, size):
+    """根据文件开头的数据找到预览 JPEG 的 (偏移, 长度)，找不到时返回 None
+
+    head 为文件开头的一段数据（拷贝的第一个块），JPG 直接返回整个文件。
+    """
+    if ext in JPEG_EXTENSIONS:
+        return 0, size
+    if bytes(head[:16]) == _RAF_MAGIC and len(head) >= 92:
+        return struct.unpack_from('>II', head, 84)
+    if ext == '.cr3':
+        return _cr3_preview_range(head)
+    ranges = [(offset, length) for offset, length in _tiff_preview_ranges(head)
+              if length > 0 and offset + length <= size]
+    # 多个预览（缩略图、中等预览、全尺寸预览）中取最大的
+    return max(ranges, key=lambda item: item[1]) if ranges else None
+
+
+class PreviewCapture:
+    """在拷贝数据流中截取预览所在的字节范围（在拷贝线程中调用 feed）"""
+    def __init__(self, ext, size):
+        self.ext = ext
+        self.size = size
+        self.start = None
+        self.end = None
+        self.data = bytearray()
+        self.failed = False
+
+    def feed(self, offset, chunk):
+        if self.failed:
+            return
+        if self.start is None:
+            located = locate_preview(chunk, self.ext, self.size) if offset == 0 else None
+            if located is None or located[1] > MAX_CAPTURE_BYTES:
+                self.failed = True
+                return
+            self.start, self.end = located[0], located[0] + located[1]
+        low = max(self.start, offset) - offset
+        high = min(self.end, offset + len(chunk)) - offset
+        if high > low:
+            self.data += chunk[low:high]
+
+    @property
+    def complete(self):
+        return (not self.failed and self.start is not None and len(self.data) == self.end - self.start
+                and self.data[:2] == _JPEG_SOI)
+
+
+def render_preview(data, out_path, max_size=DEFAULT_PREVIEW_SIZE):
+    """把 JPEG 数据缩小到长边不超过 max_size 并写入 out_path（在进程池中运行）
+
+    没有安装 Pillow 时直接保存原始的预览 JPEG。
+    """
+    os.makedirs(os.path.dirname(out_path), exist_ok=True)
+    temp_path = out_path + '.tmp'
+    try:
+        from PIL import Image
+    except ImportError:
+        Image = None
+    if Image is None:
+        with open(temp_path, 'wb') as f:
+            f.write(data)
+    else:
+        with Image.open(io.BytesIO(data)) as image:
+            if max(image.size) <= max_size:
+                with open(temp_path, 'wb') as f:
+                    f.write(data)
+            else:
+                # draft 让 JPEG 解码器直接按 1/2、1/4、1/8 缩小解码，比完整解码快得多
+                image.draft('RGB', (max_size, max_size))
+                image.thumbnail((max_size, max_size))
+                # 保留 EXIF（含方向信息），选片软件才能正确旋转
+                image.convert('RGB').save(temp_path, 'JPEG', quality=JPEG_QUALITY, exif=image.info.get('exif', b''))
+    os.replace(temp_path, out_path)
+    return out_path
+
+
+def render_preview_from_file(file_path, ext, out_path, max_size=DEFAULT_PREVIEW_SIZE, head_size=4 * 1024 * 1024):
+    """从已经拷到目标盘上的文件生成预览（拷贝时没能截取的文件，在进程池中运行）"""
+    size = os.path.getsize(file_path)
+    with open(file_path, 'rb') as f:
+        head = f.read(head_size)
+        located = locate_preview(head, ext, size)
+        if located is None:
+            return None
+        f.seek(located[0])
+        data = f.read(located[1])
+    if data[:2] != _JPEG_SOI:
+        return None
+    return render_preview(data, out_path, max_size)
+
+
+def preview_path_for(event_folder, file_name):
+    """活动文件夹下的预览图路径：原文件名加 .jpg（RAW 和同名 JPG 的预览互不覆盖）"""
+    return os.path.join(event_folder, PREVIEW_DIR_NAME, file_name + '.jpg')
+
+
+class PreviewPipeline:
+    """预览生成队列：拷贝线程截取数据，进程池缩放写盘
+
+    用法：capture_for(task) 取得截取器，把 feed 交给拷贝循环；拷贝成功后 submit(task, capture)；
+    全部拷完后 close() 补做未截取的文件并等待完成，返回 (成功数, 失败数)。
+    """
+    def __init__(self, workers=DEFAULT_PREVIEW_WORKERS, max_size=DEFAULT_PREVIEW_SIZE,
+                 max_pending=MAX_PENDING_PREVIEWS):
+        self.max_size = max_size
+        self._pool = ProcessPoolExecutor(max_workers=max(1, workers))
+        self._slots = threading.BoundedSemaphore(max(1, max_pending))
+        self._lock = threading.Lock()
+        self._futures = []
+        self._deferred = []
+
+    @staticmethod
+    def wants(task):
+        # 规划时只为 RAW（由路由规则标记）和 JPG 设置预览路径
+        return task.preview_path is not None
+
+    def capture_for(self, task):
+        """为任务创建截取器；不需要预览、断点续传或积压已满时返回 None（之后补做）"""
+        if not self.wants(task):
+            return None
+        if task.resume_offset or not self._slots.acquire(blocking=False):
+            with self._lock:
+                self._deferred.append(task)
+            return None
+        return PreviewCapture(os.path.splitext(task.src_path)[1].lower(), task.size)
+
+    def submit(self, task, capture):
+        """拷贝结束后提交截取到的数据；拷贝失败时放弃，截取不完整时改为补做"""
+        if task.error is not None:
+            self._slots.release()
+            return
+        if not capture.complete:
+            self._slots.release()
+            with self._lock:
+                self._deferred.append(task)
+            return
+        future = self._pool.submit(render_preview, capture.data, task.preview_path, self.max_size)
+        future.add_done_callback(lambda _: self._slots.release())
+        with self._lock:
+            self._futures.append((task, future))
+
+    def close(self):
+        """从目标盘补做未截取的预览，等待进程池完成，返回 (成功数, 失败数)"""
+        with self._lock:
+            deferred, self._deferred = self._deferred, []
+        for task in deferred:
+            if task.verified:
+                future = self._pool.submit(render_preview_from_file, task.dst_path,
+                                           os.path.splitext(task.src_path)[1].lower(), task.preview_path,
+                                           self.max_size)
+                self._futures.append((task, future))
+        created = failed = 0
+        for task, future in self._futures:
+            try:
+                if future.result():
+                    created += 1
+                else:
+                    failed += 1
+            except Exception as e:
+                logging.error(f"Failed to create preview for {os.path.basename(task.src_path)}: {e}")
+                failed += 1
+        self._pool.shutdown(wait=True)
+        return created, failed
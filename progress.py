@@ -0,0 +1,175 @@
+import threading
+import time
+
+STAGE_SCAN = 'scan'
+STAGE_COPY = 'copy'
+STAGE_VERIFY = 'verify'
+STAGE_DONE = 'done'
+
+STAGE_LABELS = {
+    STAGE_SCAN: '扫描中',
+    STAGE_COPY: '拷贝中',
+    STAGE_VERIFY: '校验中',
+    STAGE_DONE: '已完成',
+}
+
+# 界面刷新频率上限（次/秒），与文件数量无关，避免大量小文件刷爆 Qt 事件循环
+MAX_UPDATE_HZ = 20
+# 速度的指数平滑系数，越大越跟手，越小越平稳
+SPEED_SMOOTHING = 0.3
+
+
+class ProgressSnapshot:
+    """某一时刻的进度快照，通过信号交给界面显示"""
+    def __init__(self, stage, bytes_done, bytes_total, files_done, files_total, speed, eta,
+                 files_verified=0, files_failed=0):
+        self.stage = stage
+        self.bytes_done = bytes_done
+        self.bytes_total = bytes_total
+        self.files_done = files_done
+        self.files_total = files_total
+        self.speed = speed  # 字节/秒
+        self.eta = eta  # 秒，无法估计时为 None
+        self.files_verified = files_verified
+        self.files_failed = files_failed
+
+    @property
+    def percent(self):
+        if not self.bytes_total:
+            return 100 if self.stage == STAGE_DONE else 0
+        return min(100, int(self.bytes_done * 100 / self.bytes_total))
+
+    def to_dict(self):
+        return {
+            'stage': self.stage,
+            'bytes_done': self.bytes_done,
+            'bytes_total': self.bytes_total,
+            'files_done': self.files_done,
+            'files_total': self.files_total,
+            'files_verified': self.files_verified,
+            'files_failed': self.files_failed,
+            'speed_mb_s': round(self.speed / (1024 * 1024), 2),
+            'eta_seconds': None if self.eta is None else round(self.eta, 1),
+            'percent': self.percent,
+        }
+
+
+def format_bytes(size):
+    for unit in ('B', 'KB', 'MB', 'GB'):
+        if size < 1024:
+            return f'{size:.1f} {unit}' if unit != 'B' else f'{size} B'
+        size /= 1024
+    return f'{size:.2f} TB'
+
+
+def format_eta(seconds):
+    if seconds is None:
+        return '--'
+    seconds = int(seconds)
+    if seconds >= 3600:
+        return f'{seconds // 3600}小时{seconds % 3600 // 60}分'
+    if seconds >= 60:
+        return f'{seconds // 60}分{seconds % 60}秒'
+    return f'{seconds}秒'
+
+
+def format_snapshot(snapshot):
+    """生成进度条下方显示的文字，如：拷贝中 1.2 GB / 30.0 GB · 85.3 MB/s · 剩余 5分12秒"""
+    text = (f"{STAGE_LABELS.get(snapshot.stage, snapshot.stage)} "
+            f"{format_bytes(snapshot.bytes_done)} / {format_bytes(snapshot.bytes_total)}"
+            f" · {snapshot.files_done}/{snapshot.files_total} 个文件")
+    if snapshot.stage in (STAGE_COPY, STAGE_VERIFY):
+        text += f" · {snapshot.speed / (1024 * 1024):.1f} MB/s · 剩余 {format_eta(snapshot.eta)}"
+    if snapshot.files_verified or snapshot.files_failed:
+        text += f" · 已校验 {snapshot.files_verified}"
+        if snapshot.files_failed:
+            text += f"，失败 {snapshot.files_failed}"
+    return text
+
+
+class ProgressTracker:
+    """按字节统计拷贝进度，计算速度和剩余时间，并限制上报频率
+
+    add_bytes / file_done 可以在拷贝线程池的任意线程中调用；
+    on_update(ProgressSnapshot) 最多每秒回调 max_update_hz 次。
+    """
+    def __init__(self, bytes_total=0, files_total=0, on_update=None, max_update_hz=MAX_UPDATE_HZ):
+        self._lock = threading.Lock()
+        self.on_update = on_update
+        self.min_interval = 1.0 / max_update_hz if max_update_hz else 0
+        self.stage = STAGE_SCAN
+        self.bytes_total = bytes_total
+        self.files_total = files_total
+        self.bytes_done = 0
+        self.files_done = 0
+        self.files_verified = 0
+        self.files_failed = 0
+        self.speed = 0.0
+        self._last_emit = 0.0
+        self._speed_time = time.monotonic()
+        self._speed_bytes = 0
+
+    def set_totals(self, bytes_total, files_total):
+        with self._lock:
+            self.bytes_total = bytes_total
+            self.files_total = files_total
+        self._emit(force=True)
+
+    def add_totals(self, bytes_delta, files_delta):
+        """规划与拷贝同时进行时，随规划进度增减总量（负数表示预估的文件被跳过）"""
+        with self._lock:
+            self.bytes_total += bytes_delta
+            self.files_total += files_delta
+        self._emit()
+
+    def set_stage(self, stage):
+        with self._lock:
+            self.stage = stage
+            if stage == STAGE_COPY:
+                self._speed_time = time.monotonic()
+                self._speed_bytes = self.bytes_done
+        self._emit(force=True)
+
+    def add_bytes(self, count):
+        with self._lock:
+            self.bytes_done += count
+        self._emit()
+
+    def file_done(self, verified=True):
+        """一个文件处理完毕（拷贝并校验），verified 为 False 表示拷贝或校验失败"""
+        with self._lock:
+            self.files_done += 1
+            if verified:
+                self.files_verified += 1
+            else:
+                self.files_failed += 1
+        self._emit(force=self.files_done == self.files_total)
+
+    def snapshot(self):
+        with self._lock:
+            return self._snapshot_locked()
+
+    def _snapshot_locked(self):
+        remaining = max(0, self.bytes_total - self.bytes_done)
+        eta = remaining / self.speed if self.speed > 0 else None
+        return ProgressSnapshot(self.stage, self.bytes_done, self.bytes_total,
+                                self.files_done, self.files_total, self.speed, eta,
+                                self.files_verified, self.files_failed)
+
+    def _emit(self, force=False):
+        if self.on_update is None:
+            return
+        now = time.monotonic()
+        with self._lock:
+            if not force and now - self._last_emit < self.min_interval:
+                return
+            self._last_emit = now
+            elapsed = now - self._speed_time
+            if elapsed > 0 and self.stage in (STAGE_COPY, STAGE_VERIFY):
+                current = (self.bytes_done - self._speed_bytes) / elapsed
+                self.speed = current if not self.speed else (
+                    SPEED_SMOOTHING * current + (1 - SPEED_SMOOTHING) * self.speed)
+                self._speed_time = now
+                self._speed_bytes = self.bytes_done
+            snapshot = self._snapshot_locked()
+        self.on_update(snapshot)
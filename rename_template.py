@@ -0,0 +1,88 @@
+"""按拍摄信息重命名文件的模板，如 {date}_{time}_{camera}_{orig}
+
+模板在每次拷卡开始时编译一次，之后每个文件只需按顺序拼接几个字段，不再解析模板。
+可用字段：
+    {date}      拍摄日期 20250530        {time}    拍摄时间 101112
+    {year} {month} {day}                 {camera}  相机型号（读不到时为空）
+    {orig}      原文件名（不含扩展名）
+扩展名保持原样。某个字段为空时，连同它前面的分隔符一起省略，
+如相机型号未知时 {date}_{camera}_{orig} 生成 20250530_C0001。
+"""
+import datetime
+import os
+import re
+import string
+
+# 默认只重命名视频：索尼 C0001.MP4 这类按卡重新计数的文件名在不同的卡之间经常重复
+DEFAULT_IMAGE_TEMPLATE = ''
+DEFAULT_VIDEO_TEMPLATE = '{date}_{time}_{orig}'
+
+# 文件名中不允许或容易出问题的字符统一替换为 -
+_UNSAFE_CHARACTERS = re.compile(r'[\\/:*?"<>|\s]+')
+
+
+def _captured(entry):
+    # 读不到拍摄时间时退回修改时间，与按日期分文件夹的规则一致
+    return entry.captured_at or datetime.datetime.fromtimestamp(entry.mtime)
+
+
+FIELDS = {
+    'date': lambda entry: _captured(entry).strftime('%Y%m%d'),
+    'time': lambda entry: _captured(entry).strftime('%H%M%S'),
+    'year': lambda entry: _captured(entry).strftime('%Y'),
+    'month': lambda entry: _captured(entry).strftime('%m'),
+    'day': lambda entry: _captured(entry).strftime('%d'),
+    'camera': lambda entry: entry.camera or '',
+    'orig': lambda entry: os.path.splitext(entry.name)[0],
+}
+
+
+def sanitize(value):
+    return _UNSAFE_CHARACTERS.sub('-', value).strip('-.')
+
+
+class RenameTemplate:
+    """编译后的重命名模板"""
+    def __init__(self, template):
+        self.template = template
+        self._parts = []
+        try:
+            parsed = list(string.Formatter().parse(template))
+        except ValueError as e:
+            raise ValueError(f'重命名模板格式错误：{template}（{e}）') from e
+        for literal, field, format_spec, conversion in parsed:
+            if field is not None and field not in FIELDS:
+                raise ValueError(f'重命名模板中有未知字段 {{{field}}}，可用字段：{", ".join(sorted(FIELDS))}')
+            self._parts.append((literal, FIELDS[field] if field is not None else None))
+
+    def render(self, entry):
+        """生成新的文件名（保留原扩展名），结果为空时使用原文件名"""
+        pieces = []
+        for literal, getter in self._parts:
+            if getter is None:
+                pieces.append(literal)
+                continue
+            value = sanitize(getter(entry))
+            if value:
+                # 第一个字段前的文字总是保留；字段为空时省略它前面的分隔符
+                pieces.append(literal)
+                pieces.append(value)
+            elif not pieces:
+                pieces.append(literal)
+        stem = ''.join(pieces).strip()
+        if not stem:
+            return entry.name
+        return stem + os.path.splitext(entry.name)[1]
+
+
+def compile_template(template):
+    """编译模板；空模板返回 None，表示保留原文件名"""
+    template = (template or '').strip()
+    return RenameTemplate(template) if template else None
+
+
+def sidecar_name(sidecar, media_name, new_media_name):
+    """附属文件跟随媒体文件改名：C0001M01.XML 随 C0001.MP4 → 20250530_C0001.MP4 变为 20250530_C0001M01.XML"""
+    old_stem = os.path.splitext(media_name)[0]
+    new_stem = os.path.splitext(new_media_name)[0]
+    return new_stem + sidecar.name[len(old_stem):]
@@ -0,0 +1,219 @@
+"""文件路由规则：决定卡上的每个文件是否拷贝、拷到哪个目标目录的哪个子文件夹
+
+规则文件为 INI 格式，每一段是一条规则，按书写顺序匹配，第一条匹配的规则生效。
+规则在启动时编译成 扩展名 → 规则列表 的字典，扫描时判断文件类型只需一次字典查找；
+没有附加条件的规则（绝大多数）在规划时也是一次查找即可确定目标。
+
+运行 python routing.py 可以打印内置的默认规则，保存后修改，再在 config.ini 的
+[Routing] rules_file（或命令行 --rules）中指定。
+"""
+import configparser
+import sys
+
+KIND_IMAGE = 'image'
+KIND_VIDEO = 'video'
+KIND_SIDECAR = 'sidecar'
+TARGET_SKIP = 'skip'
+
+DEFAULT_RULES = '''\
+# 路由规则：按顺序匹配，第一条匹配的规则生效
+#
+# extensions          扩展名（不区分大小写，空格分隔）
+# kind                image / video：决定按图片还是视频处理（重命名模板、大文件通道等）
+# target              image / video / skip：拷到图片目标目录、视频目标目录，或不拷贝（默认与 kind 相同）
+# raw                 yes 表示 RAW 文件（勾选“RAW和JPG分开保存”时分开存放，并可提取内嵌预览）
+# subfolder           相对于“日期_活动名称”文件夹的子文件夹，用 / 分隔，留空表示直接放在活动文件夹中
+# separate_subfolder  勾选“RAW和JPG分开保存”时使用的子文件夹（默认同 subfolder）
+#
+# 可选的附加条件（都满足时规则才匹配，不满足时继续匹配后面的规则）：
+# camera              相机型号，多个用逗号分隔，如 ILCE-7SM3, ILCE-1
+# min_size / max_size 文件大小，可带 K/M/G 单位，如 500M
+# date_from / date_to 拍摄日期范围（含两端），如 20250101
+#
+# kind = sidecar 的规则定义随媒体文件一起拷贝的附属文件：
+# suffixes            附属文件名为 “媒体文件名（不含扩展名）+ 后缀”，如 C0001.MP4 的 C0001M01.XML
+
+[raw]
+extensions = .arw .nef .nrw .cr2 .cr3 .crw .dng .raf .orf .pef .srw .x3f .rw2 .raw .3fr .iiq
+kind = image
+raw = yes
+subfolder = 原图
+separate_subfolder = 原图/RAW
+
+[image]
+extensions = .jpg .jpeg .png .heic .heif .hif .tif .tiff
+kind = image
+subfolder = 原图
+separate_subfolder = 原图/JPG
+
+[video]
+extensions = .mp4 .mov .avi .mxf .crm .mts .m2ts .m4v
+kind = video
+subfolder =
+
+[sidecar]
+kind = sidecar
+suffixes = M01.XML .XMP .THM
+'''
+
+_SIZE_UNITS = {'K': 1024, 'M': 1024 ** 2, 'G': 1024 ** 3, 'T': 1024 ** 4}
+
+
+def _parse_size(text, rule_name):
+    text = text.strip().upper().rstrip('B')
+    if not text:
+        return None
+    multiplier = _SIZE_UNITS.get(text[-1], 1)
+    number = text[:-1] if text[-1] in _SIZE_UNITS else text
+    try:
+        return int(float(number) * multiplier)
+    except ValueError:
+        raise ValueError(f'路由规则 [{rule_name}] 中的文件大小无效：{text}')
+
+
+def _parse_date(text, rule_name):
+    text = text.strip().replace('-', '')
+    if not text:
+        return None
+    if len(text) != 8 or not text.isdigit():
+        raise ValueError(f'路由规则 [{rule_name}] 中的日期无效：{text}（格式为 YYYYMMDD）')
+    return text
+
+
+class Route:
+    """编译后的一条路由规则"""
+    __slots__ = ('name', 'kind', 'target', 'raw', 'subfolder', 'separate_subfolder',
+                 'cameras', 'min_size', 'max_size', 'date_from', 'date_to')
+
+    def __init__(self, name, kind, target, raw=False, subfolder='', separate_subfolder=None,
+                 cameras=None, min_size=None, max_size=None, date_from=None, date_to=None):
+        self.name = name
+        self.kind = kind
+        self.target = target
+        self.raw = raw
+        self.subfolder = subfolder
+        self.separate_subfolder = subfolder if separate_subfolder is None else separate_subfolder
+        self.cameras = cameras
+        self.min_size = min_size
+        self.max_size = max_size
+        self.date_from = date_from
+        self.date_to = date_to
+
+    @property
+    def unconditional(self):
+        return (self.cameras is None and self.min_size is None and self.max_size is None
+                and self.date_from is None and self.date_to is None)
+
+    def matches(self, entry):
+        if self.cameras is not None and (entry.camera or '').lower() not in self.cameras:
+            return False
+        if self.min_size is not None and entry.size < self.min_size:
+            return False
+        if self.max_size is not None and entry.size > self.max_size:
+            return False
+        if self.date_from is not None and entry.date < self.date_from:
+            return False
+        if self.date_to is not None and entry.date > self.date_to:
+            return False
+        return True
+
+    def subfolder_parts(self, separate_raw):
+        subfolder = self.separate_subfolder if separate_raw else self.subfolder
+        return [part for part in subfolder.replace('\\', '/').split('/') if part]
+
+
+class RoutingTable:
+    """编译后的路由表：扩展名 → 文件类型 / 候选规则"""
+    def __init__(self, routes, sidecar_suffixes=()):
+        self.routes = routes
+        self.sidecar_suffixes = tuple(sidecar_suffixes)
+        self._by_ext = {}
+        self.kinds = {}
+        self.raw_extensions = set()
+        for ext, route in routes:
+            existing = self.kinds.get(ext)
+            if existing is not None and existing != route.kind:
+                raise ValueError(f'路由规则冲突：{ext} 同时被定义为 {existing} 和 {route.kind}（规则 [{route.name}]）')
+            self.kinds[ext] = route.kind
+            candidates = self._by_ext.setdefault(ext, [])
+            # 无条件规则之后的规则永远不会被匹配到，不必放进候选列表
+            if not candidates or not candidates[-1].unconditional:
+                candidates.append(route)
+            if route.raw:
+                self.raw_extensions.add(ext)
+        self._by_ext = {ext: tuple(candidates) for ext, candidates in self._by_ext.items()}
+
+    def kind_for(self, ext):
+        """扫描时判断文件类型（image / video），不需要拷贝的文件返回 None"""
+        return self.kinds.get(ext)
+
+    def is_raw(self, ext):
+        return ext in self.raw_extensions
+
+    def route(self, entry):
+        """规划时为文件选择规则，没有匹配的规则时返回 None"""
+        for route in self._by_ext.get(entry.ext, ()):
+            if route.unconditional or route.matches(entry):
+                return route
+        return None
+
+
+def compile_rules(text, source='<rules>'):
+    """把规则文本编译成 RoutingTable，规则有误时抛出 ValueError"""
+    parser = configparser.ConfigParser(interpolation=None, inline_comment_prefixes=('#', ';'))
+    try:
+        parser.read_string(text, source=source)
+    except configparser.Error as e:
+        raise ValueError(f'路由规则文件格式错误：{e}') from e
+    routes = []
+    sidecar_suffixes = []
+    for name in parser.sections():
+        section = parser[name]
+        kind = section.get('kind', '').strip().lower()
+        if kind == KIND_SIDECAR:
+            sidecar_suffixes.extend(suffix.upper() for suffix in section.get('suffixes', '').split())
+            continue
+        if kind not in (KIND_IMAGE, KIND_VIDEO):
+            raise ValueError(f'路由规则 [{name}] 的 kind 必须是 image、video 或 sidecar')
+        target = section.get('target', kind).strip().lower() or kind
+        if target not in (KIND_IMAGE, KIND_VIDEO, TARGET_SKIP):
+            raise ValueError(f'路由规则 [{name}] 的 target 必须是 image、video 或 skip')
+        cameras = section.get('camera', '').strip()
+        route = Route(
+            name, kind, target,
+            raw=section.getboolean('raw', fallback=False),
+            subfolder=section.get('subfolder', '').strip(),
+            separate_subfolder=section.get('separate_subfolder', None),
+            cameras={camera.strip().lower() for camera in cameras.split(',') if camera.strip()} if cameras else None,
+            min_size=_parse_size(section.get('min_size', ''), name),
+            max_size=_parse_size(section.get('max_size', ''), name),
+            date_from=_parse_date(section.get('date_from', ''), name),
+            date_to=_parse_date(section.get('date_to', ''), name))
+        if route.separate_subfolder is not None:
+            route.separate_subfolder = route.separate_subfolder.strip()
+        for ext in section.get('extensions', '').split():
+            ext = ext.lower()
+            routes.append((ext if ext.startswith('.') else f'.{ext}', route))
+    return RoutingTable(routes, sidecar_suffixes)
+
+
+def load_routing(path=None):
+    """读取并编译规则文件，path 为空时使用内置默认规则"""
+    if not path:
+        return default_routing()
+    with open(path, encoding='utf-8') as f:
+        return compile_rules(f.read(), source=path)
+
+
+_default_table = None
+
+
+def default_routing():
+    global _default_table
+    if _default_table is None:
+        _default_table = compile_rules(DEFAULT_RULES, source='<default>')
+    return _default_table
+
+
+if __name__ == '__main__':
+    sys.stdout.write(DEFAULT_RULES)
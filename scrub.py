@@ -0,0 +1,207 @@
+"""归档巡检：按拷贝清单中记录的哈希重新校验图库中的文件，发现静默损坏（位衰减）
+
+拷卡时每个目标根目录下的清单（.sd_copy_hub_manifest.sqlite3）记录了每个文件拷贝成功时的哈希，
+巡检多线程并行地重新读取这些文件并比对：
+    ok            哈希一致
+    corrupt       哈希不一致，或修改时间没变而大小变了（存储介质损坏）
+    error         读取出错（如磁盘 I/O 错误）
+    modified      修改时间变了（在修图软件中编辑过），不算损坏
+    missing       文件已不存在（被删除或移动），不算损坏
+    unverifiable  清单中的哈希算法在本机不可用（如没有安装 xxhash）
+默认增量巡检：大小和修改时间自上次巡检通过以来都没变的文件直接跳过，--full 全部重新校验，
+--max-age 让超过指定天数没有校验过的文件也重新校验（可以每天巡检一部分）。
+--rate-limit 限制读取速度，上班时间在后台运行也不影响修图。读取时绕过页缓存，不挤掉其他程序的缓存。
+
+    python scrub.py ~/Pictures ~/Movies --rate-limit 50 --output scrub.json
+
+有文件损坏或读取出错时退出码为 1。
+"""
+import argparse
+import json
+import logging
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from hashing import DEFAULT_ALGORITHM
+from ingest_manifest import MANIFEST_FILE_NAME, IngestManifest
+from instrumentation import configure_logging
+from verifier import hash_file_uncached
+
+SCRUB_OK = 'ok'
+SCRUB_SKIPPED = 'skipped'
+SCRUB_CORRUPT = 'corrupt'
+SCRUB_ERROR = 'error'
+SCRUB_MODIFIED = 'modified'
+SCRUB_MISSING = 'missing'
+SCRUB_UNVERIFIABLE = 'unverifiable'
+# 结果中逐个列出路径的状态
+REPORTED_STATUSES = (SCRUB_CORRUPT, SCRUB_ERROR, SCRUB_MODIFIED, SCRUB_MISSING, SCRUB_UNVERIFIABLE)
+
+SCRUB_WORKERS = 4
+# exFAT/FAT 目标盘上修改时间只精确到 2 秒，拷贝时保留的 mtime 可能被取整
+MTIME_TOLERANCE_NS = 2 * 10 ** 9
+# 每批提交给线程池的文件数（每个线程），避免百万级图库一次性创建所有任务
+BATCH_PER_WORKER = 64
+# 每巡检这么多个文件写一次日志、提交一次巡检记录
+PROGRESS_INTERVAL = 1000
+
+
+class RateLimiter:
+    """多个线程共享的读取速率上限（令牌桶，字节/秒），最多允许一秒的突发"""
+    def __init__(self, bytes_per_second):
+        self.rate = bytes_per_second
+        self._lock = threading.Lock()
+        self._allowance = bytes_per_second
+        self._last = time.monotonic()
+
+    def consume(self, count):
+        with self._lock:
+            now = time.monotonic()
+            self._allowance = min(self.rate, self._allowance + (now - self._last) * self.rate)
+            self._last = now
+            self._allowance -= count
+            wait = -self._allowance / self.rate if self._allowance < 0 else 0
+        # 在锁外等待：额度已经预扣，其他线程会排在后面
+        if wait:
+            time.sleep(wait)
+
+
+class ScrubResult:
+    """一次巡检的统计结果"""
+    def __init__(self):
+        self.counts = {status: 0 for status in (SCRUB_OK, SCRUB_SKIPPED) + REPORTED_STATUSES}
+        self.files = {status: [] for status in REPORTED_STATUSES}
+        self.bytes_read = 0
+        self.seconds = 0.0
+        self.roots = []
+
+    def add(self, status, path, bytes_read):
+        self.counts[status] += 1
+        self.bytes_read += bytes_read
+        if status in self.files:
+            self.files[status].append(path)
+
+    @property
+    def damaged(self):
+        return self.counts[SCRUB_CORRUPT] + self.counts[SCRUB_ERROR]
+
+    def to_dict(self):
+        return {
+            'roots': self.roots,
+            'counts': self.counts,
+            'bytes_read': self.bytes_read,
+            'seconds': round(self.seconds, 3),
+            'speed_mb_s': round(self.bytes_read / (1024 * 1024) / self.seconds, 2) if self.seconds else 0.0,
+            'files': self.files,
+        }
+
+
+def scrub_file(path, record, state, full=False, max_age=0, limiter=None):
+    """校验单个目标文件，返回 (状态, 大小, 修改时间, 读取字节数)"""
+    try:
+        st = os.stat(path)
+    except FileNotFoundError:
+        return SCRUB_MISSING, 0, 0, 0
+    except OSError as e:
+        logging.error(f"Failed to stat {path}: {e}")
+        return SCRUB_ERROR, 0, 0, 0
+    size, mtime_ns = st.st_size, st.st_mtime_ns
+    if (not full and state is not None and state[2] and state[0] == size and state[1] == mtime_ns
+            and not (max_age and time.time() - state[3] > max_age)):
+        return SCRUB_SKIPPED, size, mtime_ns, 0
+    if abs(mtime_ns - record.mtime_ns) > MTIME_TOLERANCE_NS:
+        return SCRUB_MODIFIED, size, mtime_ns, 0
+    if size != record.size:
+        return SCRUB_CORRUPT, size, mtime_ns, 0
+    try:
+        file_hash = hash_file_uncached(path, record.hash_algorithm or DEFAULT_ALGORITHM,
+                                       on_chunk=limiter.consume if limiter else None)
+    except ValueError:
+        return SCRUB_UNVERIFIABLE, size, mtime_ns, 0
+    except OSError as e:
+        logging.error(f"Failed to read {path}: {e}")
+        return SCRUB_ERROR, size, mtime_ns, 0
+    return (SCRUB_OK if file_hash == record.source_hash else SCRUB_CORRUPT), size, mtime_ns, size
+
+
+def _batches(items, batch_size):
+    batch = []
+    for item in items:
+        batch.append(item)
+        if len(batch) >= batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def scrub(roots, full=False, max_age=0, workers=SCRUB_WORKERS, rate_limit=0):
+    """巡检各目标根目录清单中记录的文件（同一文件出现在多个清单中时只校验一次）
+
+    max_age 为秒数，rate_limit 为字节/秒，0 表示不限制。
+    """
+    result = ScrubResult()
+    start = time.monotonic()
+    limiter = RateLimiter(rate_limit) if rate_limit else None
+    seen = set()
+    workers = max(1, workers)
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        for root in roots:
+            db_path = os.path.join(os.path.abspath(root), MANIFEST_FILE_NAME)
+            if not os.path.exists(db_path):
+                logging.warning(f"No ingest manifest in {root}, nothing to scrub")
+                continue
+            result.roots.append(os.path.abspath(root))
+            manifest = IngestManifest(db_path)
+            try:
+                files = [(path, record) for path, record in manifest.verified_files().items() if path not in seen]
+                seen.update(path for path, _ in files)
+                states = manifest.scrub_states()
+                logging.info(f"Scrubbing {len(files)} files recorded in {db_path}")
+                done = 0
+                for batch in _batches(files, workers * BATCH_PER_WORKER):
+                    outcomes = pool.map(lambda item: scrub_file(item[0], item[1], states.get(item[0]), full, max_age,
+                                                                limiter), batch)
+                    for (path, _), (status, size, mtime_ns, bytes_read) in zip(batch, outcomes):
+                        result.add(status, path, bytes_read)
+                        if status in (SCRUB_OK, SCRUB_CORRUPT, SCRUB_MODIFIED):
+                            manifest.record_scrub(path, size, mtime_ns, status == SCRUB_OK)
+                        if status in (SCRUB_CORRUPT, SCRUB_ERROR):
+                            logging.error(f"Scrub failed ({status}): {path}")
+                    done += len(batch)
+                    if done % PROGRESS_INTERVAL < len(batch) or done == len(files):
+                        manifest.commit()
+                        logging.info(f"Scrubbed {done}/{len(files)} files in {root}")
+            finally:
+                manifest.close()
+    result.seconds = time.monotonic() - start
+    return result
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='归档巡检：按拷贝清单中的哈希重新校验图库文件')
+    parser.add_argument('roots', nargs='+', help='图片/视频目标目录或备份目录（含拷贝清单的根目录）')
+    parser.add_argument('--full', action='store_true', help='全部重新校验，不跳过上次巡检后未变化的文件')
+    parser.add_argument('--max-age', type=float, default=0,
+                        help='超过多少天没有校验过的文件即使未变化也重新校验，0 表示不限')
+    parser.add_argument('--workers', type=int, default=SCRUB_WORKERS, help='并行校验的线程数')
+    parser.add_argument('--rate-limit', type=float, default=0, help='读取速度上限（MB/s），0 表示不限制')
+    parser.add_argument('--output', help='把结果写入 JSON 文件')
+    parser.add_argument('--log-level', default='INFO', help='日志级别（输出到标准错误）')
+    args = parser.parse_args(argv)
+    configure_logging(args.log_level)
+    result = scrub(args.roots, full=args.full, max_age=args.max_age * 86400, workers=args.workers,
+                   rate_limit=int(args.rate_limit * 1024 * 1024))
+    text = json.dumps(result.to_dict(), ensure_ascii=False, indent=2)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(text + '\n')
+    print(text)
+    return 1 if result.damaged else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,495 @@
+"""两级暂存：先把卡拷到本地高速暂存目录，再由后台搬运到（较慢的）最终目标目录
+
+拷卡时文件按最终的目录结构写入暂存目录（每个目标根目录对应暂存目录下的一个子目录），
+拷贝并校验完就可以拔卡；校验通过的文件登记到暂存目录下的搬运队列（SQLite），
+搬运器按自己的节奏逐个拷到最终目标和备份目录，绕过页缓存重新校验后再删除暂存文件。
+队列保存在磁盘上，程序退出或断电后重新运行即从断点继续（拷到一半的临时文件续传）。
+拷卡时记下每个最终路径所在的挂载点，目标盘拔出后挂载点目录还在，但不再是同一个挂载，搬运器据此等待而不是写到系统盘上：
+
+    python staging.py ~/.sd_copy_hub/staging
+"""
+import argparse
+import hashlib
+import json
+import logging
+import os
+import shutil
+import sqlite3
+import sys
+import threading
+import time
+
+from checksum_manifest import ChecksumManifestWriter, locate_event_folder
+from copy_engine import copy_with_hash, hash_file
+from durability import (DEFAULT_FSYNC_BATCH_SIZE, DEFAULT_FSYNC_POLICY, SyncBatcher, commit_partials, discard_partials,
+                        partial_path, suffixed_path)
+from ingest_manifest import IngestManifest, source_fingerprint
+from instrumentation import configure_logging
+from library_index import LIBRARY_DB_NAME, LIBRARY_HASH_ALGORITHM, LibraryIndex
+from previews import preview_path_for
+from progress import STAGE_COPY, STAGE_DONE, ProgressTracker, format_snapshot
+from verifier import hash_file_uncached
+
+STAGING_QUEUE_NAME = '.sd_copy_hub_staging.sqlite3'
+MOVE_PENDING = 'pending'
+MOVE_FAILED = 'failed'
+
+
+def mount_point(path):
+    """路径所在的挂载点（路径还不存在时按最近的已有上级目录判断）"""
+    path = os.path.abspath(path)
+    while not os.path.exists(path) and os.path.dirname(path) != path:
+        path = os.path.dirname(path)
+    while not os.path.ismount(path) and os.path.dirname(path) != path:
+        path = os.path.dirname(path)
+    return path
+
+
+def mount_available(path, expected_mount):
+    """path 所在的挂载点是否仍是拷卡时记录的 expected_mount（或其下新挂上的更深一级的盘）
+
+    目标盘拔出后路径会落到上一级挂载（通常是系统盘）上，此时返回 False。
+    """
+    current = mount_point(path)
+    return current == expected_mount or current.startswith(expected_mount.rstrip(os.sep) + os.sep)
+
+
+def staging_root_for(staging_dir, target_root):
+    """目标根目录在暂存目录下对应的子目录：目录名加路径哈希，不同磁盘上的同名目录互不混淆"""
+    target_root = os.path.abspath(target_root)
+    digest = hashlib.sha1(target_root.encode('utf-8')).hexdigest()[:8]
+    return os.path.join(os.path.abspath(staging_dir), f'{os.path.basename(target_root) or "root"}-{digest}')
+
+
+class MoveItem:
+    """搬运队列中的一项：一个暂存文件及其最终目标路径（主目标在前，其余为备份）和拷卡时各自所在的挂载点"""
+    def __init__(self, staging_path, staging_root, final_root, final_paths, size, source_hash, hash_algorithm,
+                 rel_path, mtime_ns, status=MOVE_PENDING, error=None, final_mounts=None, checksums=None):
+        self.staging_path = staging_path
+        self.staging_root = staging_root
+        self.final_root = final_root
+        self.final_paths = final_paths
+        self.size = size
+        self.source_hash = source_hash
+        self.hash_algorithm = hash_algorithm
+        self.rel_path = rel_path
+        self.mtime_ns = mtime_ns
+        self.status = status
+        self.error = error
+        self.final_mounts = final_mounts or [None] * len(final_paths)
+        # 要写的校验清单：{'formats': [...], 'digests': {算法: 哈希}}（拷卡时顺带算出的其他算法），None 表示不写
+        self.checksums = checksums
+
+    @property
+    def manifest_key(self):
+        return self.rel_path, self.size, self.mtime_ns
+
+
+class StagingQueue:
+    """暂存目录下的搬运队列，拷卡线程登记、搬运线程取出，各自使用自己的连接"""
+    _COLUMNS = ('staging_path, staging_root, final_root, final_paths, size, source_hash, hash_algorithm, '
+                'rel_path, mtime_ns, status, error, final_mounts, checksums')
+
+    def __init__(self, staging_dir):
+        self.staging_dir = os.path.abspath(staging_dir)
+        os.makedirs(self.staging_dir, exist_ok=True)
+        self.db_path = os.path.join(self.staging_dir, STAGING_QUEUE_NAME)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(self.db_path, timeout=30, check_same_thread=False)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute('PRAGMA synchronous=NORMAL')
+        self._conn.execute('''
+            CREATE TABLE IF NOT EXISTS moves (
+                staging_path TEXT PRIMARY KEY,
+                staging_root TEXT NOT NULL,
+                final_root TEXT NOT NULL,
+                final_paths TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                source_hash TEXT NOT NULL,
+                hash_algorithm TEXT NOT NULL,
+                rel_path TEXT NOT NULL,
+                mtime_ns INTEGER NOT NULL,
+                status TEXT NOT NULL,
+                error TEXT,
+                added_at REAL NOT NULL,
+                final_mounts TEXT,
+                checksums TEXT
+            )
+        ''')
+        # 旧版本创建的队列没有 final_mounts、checksums 列，补上（没有挂载点记录的项按目标根目录是否存在判断）
+        columns = {row[1] for row in self._conn.execute('PRAGMA table_info(moves)')}
+        for column in ('final_mounts', 'checksums'):
+            if column not in columns:
+                self._conn.execute(f'ALTER TABLE moves ADD COLUMN {column} TEXT')
+        self._conn.commit()
+
+    def add(self, task, staging_root, final_root, final_paths, final_mounts=None, checksum_formats=None):
+        """登记一个已经拷到暂存目录并校验通过的文件（拷贝任务见 copy_engine.CopyTask）
+
+        final_mounts 为各最终路径所在的挂载点（见 mount_point），与 final_paths 一一对应；
+        checksum_formats 为搬运后要写的校验清单格式（见 checksum_manifest）。
+        """
+        rel_path, _, mtime_ns = task.manifest_key
+        mounts = json.dumps(final_mounts, ensure_ascii=False) if final_mounts else None
+        checksums = json.dumps({'formats': list(checksum_formats), 'digests': task.extra_digests}) if (
+            checksum_formats) else None
+        with self._lock:
+            self._conn.execute(
+                f'INSERT OR REPLACE INTO moves ({self._COLUMNS}, added_at) '
+                'VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                (task.dst_path, staging_root, final_root, json.dumps(final_paths, ensure_ascii=False), task.size,
+                 task.source_hash, task.hash_algorithm, rel_path, mtime_ns, MOVE_PENDING, None, mounts, checksums,
+                 time.time()))
+            self._conn.commit()
+
+    def items(self):
+        """所有待搬运的项（含上次失败的），按登记顺序"""
+        with self._lock:
+            rows = self._conn.execute(f'SELECT {self._COLUMNS} FROM moves ORDER BY added_at').fetchall()
+        return [MoveItem(row[0], row[1], row[2], json.loads(row[3]), *row[4:11],
+                         final_mounts=json.loads(row[11]) if row[11] else None,
+                         checksums=json.loads(row[12]) if row[12] else None) for row in rows]
+
+    def pending_totals(self):
+        """待搬运的 (文件数, 字节数)"""
+        with self._lock:
+            count, size = self._conn.execute('SELECT COUNT(*), COALESCE(SUM(size), 0) FROM moves').fetchone()
+        return count, size
+
+    def done(self, item):
+        with self._lock:
+            self._conn.execute('DELETE FROM moves WHERE staging_path = ?', (item.staging_path,))
+            self._conn.commit()
+
+    def failed(self, item, error):
+        with self._lock:
+            self._conn.execute('UPDATE moves SET status = ?, error = ? WHERE staging_path = ?',
+                               (MOVE_FAILED, str(error), item.staging_path))
+            self._conn.commit()
+
+    def close(self):
+        with self._lock:
+            self._conn.commit()
+            self._conn.close()
+
+
+def _free_paths(paths):
+    """目标已有内容不同的同名文件时，按拷卡时的规则找一个在所有目标中都空闲的 _1、_2 后缀名"""
+    free_paths = list(paths)
+    counter = 1
+    while any(os.path.exists(path) or os.path.exists(partial_path(path)) for path in free_paths):
+        free_paths = [suffixed_path(path, counter) for path in paths]
+        counter += 1
+    return free_paths
+
+
+class StagingMover:
+    """把搬运队列中的文件拷到最终目标：一次读取暂存文件同时写入主目标和备份，校验后删除暂存文件
+
+    run() 在当前线程中按登记顺序处理队列，队列处理完（或 should_stop() 返回 True）时返回 (成功数, 失败数)；
+    on_progress(ProgressSnapshot) 与拷卡进度一样限频回调。
+    """
+    def __init__(self, staging_dir, on_progress=None, fsync_policy=DEFAULT_FSYNC_POLICY,
+                 fsync_batch_size=DEFAULT_FSYNC_BATCH_SIZE):
+        self.queue = StagingQueue(staging_dir)
+        self.tracker = ProgressTracker(on_update=on_progress)
+        # 按策略分批落盘，落盘后才删除暂存文件、登记完成
+        self.syncer = SyncBatcher(fsync_policy, fsync_batch_size, commit=self._commit)
+        self._manifests = {}
+        # 搬运后写校验清单、登记图库索引（按最终实际使用的文件名）
+        self._checksum_writers = {}
+        self._libraries = {}
+
+    def get_manifest(self, root):
+        if root not in self._manifests:
+            try:
+                self._manifests[root] = IngestManifest.for_root(root)
+            except Exception as e:
+                logging.error(f"Failed to open manifest for {root}: {e}")
+                self._manifests[root] = None
+        return self._manifests[root]
+
+    def _record(self, item, final_paths):
+        """在最终目标和暂存目录的清单中把文件记为已完成（指向最终路径），再次插卡时直接跳过"""
+        # 最终文件已校验与卡上的原文件相同，指纹从它计算
+        try:
+            fingerprint = source_fingerprint(final_paths[0], item.size)
+        except OSError:
+            fingerprint = None
+        for root in (item.final_root, item.staging_root):
+            manifest = self.get_manifest(root)
+            if manifest is not None:
+                manifest.begin(item.manifest_key, final_paths, fingerprint=fingerprint)
+                manifest.finish(item.manifest_key, item.source_hash, True, item.hash_algorithm)
+
+    def _record_checksums(self, item, final_paths):
+        """把搬运完的文件记入最终活动文件夹（主目标和各备份）的校验清单"""
+        formats = tuple(item.checksums['formats'])
+        key = (formats, item.hash_algorithm)
+        if key not in self._checksum_writers:
+            self._checksum_writers[key] = ChecksumManifestWriter(formats, item.hash_algorithm)
+        writer = self._checksum_writers[key]
+        digests = dict(item.checksums['digests'])
+        digests[item.hash_algorithm] = item.source_hash
+        # 各最终根目录由登记时的路径推出（实际路径可能因重名改用了后缀名，但相对位置所在的目录不变）
+        rel_path = os.path.relpath(item.final_paths[0], item.final_root)
+        roots = [planned[:len(planned) - len(rel_path)] for planned in item.final_paths]
+        for final_path in final_paths:
+            event_folder, event_rel_path = locate_event_folder(final_path, roots)
+            if event_folder is None:
+                continue
+            try:
+                writer.add(event_folder, event_rel_path, final_path, digests)
+            except (OSError, ValueError) as e:
+                logging.error(f"Failed to record checksum of {final_path}: {e}")
+
+    def _register_in_library(self, item, final_path):
+        """最终目标根目录已有图库索引（用过图库去重）时登记搬运完的文件"""
+        root = item.final_root
+        if root not in self._libraries:
+            self._libraries[root] = None
+            if os.path.exists(os.path.join(root, LIBRARY_DB_NAME)):
+                try:
+                    self._libraries[root] = LibraryIndex(root)
+                except Exception as e:
+                    logging.error(f"Failed to open library index for {root}: {e}")
+        library = self._libraries[root]
+        if library is not None:
+            full_hash = item.source_hash if item.hash_algorithm == LIBRARY_HASH_ALGORITHM else None
+            library.register(final_path, full_hash)
+
+    @staticmethod
+    def _event_folder(path, root):
+        return os.path.join(root, os.path.relpath(path, root).split(os.sep)[0])
+
+    def _move_preview(self, item, final_path):
+        """拷卡时生成在暂存活动文件夹中的预览图，随文件搬到最终活动文件夹（按最终文件名）"""
+        staged = preview_path_for(self._event_folder(item.staging_path, item.staging_root),
+                                  os.path.basename(item.staging_path))
+        if not os.path.exists(staged):
+            return
+        target = preview_path_for(self._event_folder(final_path, item.final_root), os.path.basename(final_path))
+        try:
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            shutil.move(staged, target)
+        except OSError as e:
+            logging.error(f"Failed to move preview {staged}: {e}")
+
+    def _existing_copy(self, path, item):
+        try:
+            return (os.path.getsize(path) == item.size
+                    and hash_file(path, algorithm=item.hash_algorithm) == item.source_hash)
+        except OSError:
+            return False
+
+    def move(self, item):
+        """拷贝并校验一个文件，交给 syncer 落盘，返回本次落盘的 [((MoveItem, 最终路径), 错误)]
+
+        拷贝或校验失败时抛出异常（暂存文件保留，下次重试）。
+        """
+        # 目标盘没有挂载时不能创建目录，否则文件会写到挂载点所在的系统盘上
+        for path, expected_mount in zip(item.final_paths, item.final_mounts):
+            # 旧版本登记的项没有挂载点记录，只能要求目标根目录存在
+            if not (mount_available(path, expected_mount) if expected_mount else os.path.isdir(item.final_root)):
+                raise FileNotFoundError(f'目标盘未挂载：{expected_mount or item.final_root}')
+        final_paths = list(item.final_paths)
+        # 上次已经搬运完（如重命名后、登记前断电）的目标直接沿用
+        write_paths = [path for path in final_paths if not (os.path.exists(path) and self._existing_copy(path, item))]
+        if any(os.path.exists(path) for path in write_paths):
+            # 目标中已有内容不同的同名文件：要写的目标一起改用同一个后缀名，备份与主目标同名
+            renamed = dict(zip(write_paths, _free_paths(write_paths)))
+            discard_partials(write_paths)
+            final_paths = [renamed.get(path, path) for path in final_paths]
+            write_paths = list(renamed.values())
+        if write_paths:
+            if not os.path.exists(item.staging_path):
+                raise FileNotFoundError(f'暂存文件不存在：{item.staging_path}')
+            for path in write_paths:
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+            # 拷到一半的临时文件从断点续传
+            resume_offset = min((os.path.getsize(partial_path(path)) if os.path.exists(partial_path(path)) else 0)
+                                for path in write_paths)
+            resume_offset = min(resume_offset, item.size)
+            last_done = resume_offset
+            self.tracker.add_bytes(resume_offset)
+
+            def on_progress(bytes_done):
+                nonlocal last_done
+                self.tracker.add_bytes(bytes_done - last_done)
+                last_done = bytes_done
+
+            try:
+                staged_hash = copy_with_hash(item.staging_path, [partial_path(path) for path in write_paths],
+                                             resume_offset=resume_offset, on_progress=on_progress,
+                                             algorithm=item.hash_algorithm, preallocate_size=item.size)
+                if staged_hash != item.source_hash:
+                    raise IOError(f'暂存文件与卡上的原文件不一致：{item.staging_path}')
+                for path in write_paths:
+                    if hash_file_uncached(partial_path(path), item.hash_algorithm) != item.source_hash:
+                        raise IOError(f'哈希校验失败：{path}')
+            except Exception:
+                # 校验失败的临时文件不能用于续传，删除后下次重新拷贝
+                for path in write_paths:
+                    try:
+                        os.remove(partial_path(path))
+                    except OSError:
+                        pass
+                self.tracker.add_bytes(item.size - last_done)
+                raise
+        else:
+            self.tracker.add_bytes(item.size)
+        return self.syncer.add((item, final_paths, write_paths), [partial_path(path) for path in write_paths])
+
+    @staticmethod
+    def _commit(pending):
+        """数据落盘后把临时文件重命名为正式文件名，返回实际路径（提交时不覆盖这期间出现的同名文件，改用后缀名）"""
+        _, final_paths, write_paths = pending
+        committed = dict(zip(write_paths, commit_partials(write_paths)))
+        final_paths[:] = [committed.get(path, path) for path in final_paths]
+        return final_paths
+
+    def finish(self, item, final_paths):
+        """文件落盘后登记清单、校验清单和图库索引，搬运预览图并删除暂存文件"""
+        self._record(item, final_paths)
+        if item.checksums:
+            self._record_checksums(item, final_paths)
+        self._register_in_library(item, final_paths[0])
+        self._move_preview(item, final_paths[0])
+        try:
+            os.remove(item.staging_path)
+        except FileNotFoundError:
+            pass
+
+    def _failed(self, item, error):
+        logging.error(f"Failed to move {item.staging_path} to {item.final_paths[0]}: {error}")
+        self.queue.failed(item, error)
+        self.tracker.file_done(False)
+
+    def _finish_synced(self, synced):
+        """处理落盘完成的项，返回 (成功数, 失败数)"""
+        moved = failed = 0
+        for (item, final_paths, _), error in synced:
+            try:
+                if error is not None:
+                    raise error
+                self.finish(item, final_paths)
+            except Exception as e:
+                self._failed(item, e)
+                failed += 1
+                continue
+            logging.info('已归档: %s', final_paths[0])
+            self.queue.done(item)
+            self.tracker.file_done(True)
+            moved += 1
+        return moved, failed
+
+    def run(self, should_stop=None):
+        items = self.queue.items()
+        self.tracker.set_totals(sum(item.size for item in items), len(items))
+        self.tracker.set_stage(STAGE_COPY)
+        moved = failed = 0
+        try:
+            for item in items:
+                if should_stop and should_stop():
+                    break
+                try:
+                    synced = self.move(item)
+                except Exception as e:
+                    self._failed(item, e)
+                    failed += 1
+                    continue
+                done = self._finish_synced(synced)
+                moved += done[0]
+                failed += done[1]
+            done = self._finish_synced(self.syncer.flush())
+            moved += done[0]
+            failed += done[1]
+        finally:
+            self.syncer.close()
+            for manifest in self._manifests.values():
+                if manifest is not None:
+                    manifest.close()
+            self._manifests = {}
+            for writer in self._checksum_writers.values():
+                writer.close()
+            self._checksum_writers = {}
+            for library in self._libraries.values():
+                if library is not None:
+                    library.close()
+            self._libraries = {}
+            self.tracker.set_stage(STAGE_DONE)
+        return moved, failed
+
+    def close(self):
+        self.queue.close()
+
+
+class BackgroundMover:
+    """在后台守护线程中搬运：启动时先处理上次没搬完的队列，之后每次 wake()（如一张卡拷完）再处理一遍
+
+    on_progress(ProgressSnapshot) 和 on_finished(成功数, 失败数) 在搬运线程中回调。
+    程序中途退出不影响数据：队列和拷到一半的临时文件都留在磁盘上，下次启动时继续。
+    """
+    def __init__(self, staging_dir, on_progress=None, on_finished=None, fsync_policy=DEFAULT_FSYNC_POLICY,
+                 fsync_batch_size=DEFAULT_FSYNC_BATCH_SIZE):
+        self.staging_dir = staging_dir
+        self.on_progress = on_progress
+        self.on_finished = on_finished
+        self.fsync_policy = fsync_policy
+        self.fsync_batch_size = fsync_batch_size
+        self._wakeup = threading.Event()
+        self._stopping = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='staging-mover', daemon=True)
+
+    def start(self):
+        self._wakeup.set()
+        self._thread.start()
+
+    def wake(self):
+        self._wakeup.set()
+
+    def _run(self):
+        while True:
+            self._wakeup.wait()
+            self._wakeup.clear()
+            try:
+                mover = StagingMover(self.staging_dir, self.on_progress, self.fsync_policy, self.fsync_batch_size)
+                try:
+                    moved, failed = mover.run()
+                finally:
+                    mover.close()
+                if self.on_finished and (moved or failed):
+                    self.on_finished(moved, failed)
+            except Exception as e:
+                logging.exception(f"Staging mover failed: {e}")
+            if self._stopping.is_set() and not self._wakeup.is_set():
+                return
+
+    def close(self):
+        """处理完队列中剩余的文件后结束"""
+        self._stopping.set()
+        self._wakeup.set()
+        self._thread.join()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='把暂存目录中已拷好的文件搬运到最终目标目录（可断点续传）')
+    parser.add_argument('staging_dir', help='拷卡时使用的暂存目录')
+    parser.add_argument('--log-level', default='INFO', help='日志级别（输出到标准错误）')
+    args = parser.parse_args(argv)
+    configure_logging(args.log_level)
+    if not os.path.exists(os.path.join(args.staging_dir, STAGING_QUEUE_NAME)):
+        print(f'错误：{args.staging_dir} 中没有搬运队列', file=sys.stderr)
+        return 2
+    mover = StagingMover(args.staging_dir,
+                         on_progress=lambda snapshot: print(format_snapshot(snapshot), file=sys.stderr))
+    try:
+        moved, failed = mover.run()
+    finally:
+        mover.close()
+    print(json.dumps({'moved': moved, 'failed': failed}))
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,186 @@
+"""启动性能基准：测量图形界面从启动进程到窗口第一次绘制出来的耗时，超出预算时返回非零退出码
+
+每次测量都启动一个全新的 Python 进程，在子进程中依次记录：
+    import_seconds        导入 main（含 PyQt5；config.ini 在窗口显示后才读取）
+    window_seconds        创建 QApplication 和主窗口
+    startup_seconds       从启动进程到主窗口第一次绘制（含解释器启动）
+并检查启动时是否已经导入了只有扫描或拷贝时才需要的重模块（PIL、SQLite、哈希后端、拷卡引擎等）。
+另外用 python -X importtime 多启动一次，列出自身导入耗时最长的模块（这次不计入中位数）。
+多次测量取中位数，与预算比较：全部满足时退出码为 0，超出预算或导入了重模块时为 1，测量失败时为 2，
+可以直接放进持续集成。
+
+示例（没有显示器的机器上默认使用 Qt 的 offscreen 平台）：
+    python startup_benchmark.py --repeat 5 --budget 1.0 --output startup.json
+"""
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+
+STARTUP_BENCHMARK_VERSION = 1
+# 默认预算（秒）：从启动进程到窗口第一次绘制，以及其中导入 main 的部分
+DEFAULT_STARTUP_BUDGET = 1.0
+DEFAULT_IMPORT_BUDGET = 0.4
+# 第一次绘制前不应该导入的模块：它们只在扫描、拷贝或生成预览时才用到
+DEFERRED_MODULES = ('PIL', 'sqlite3', 'xxhash', 'card_scanner', 'capture_metadata', 'copy_engine', 'hashing',
+                    'ingest_engine', 'library_index', 'previews', 'routing', 'staging', 'checksum_manifest')
+# 子进程等待窗口绘制的最长时间
+PROBE_TIMEOUT_SECONDS = 30
+_SPAWN_TIME_ENV = 'SD_COPY_HUB_SPAWN_TIME'
+
+
+def probe():
+    """子进程：启动界面，窗口第一次绘制时把各阶段耗时以 JSON 输出到标准输出后退出"""
+    spawned_at = float(os.environ.get(_SPAWN_TIME_ENV) or time.time())
+    start = time.perf_counter()
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    import main
+    imported = time.perf_counter()
+
+    from PyQt5.QtCore import QEvent, QObject, QTimer
+    from PyQt5.QtWidgets import QApplication
+
+    app = QApplication(sys.argv[:1])
+    window = main.MainWindow()
+    created = time.perf_counter()
+    report = {}
+
+    class FirstPaint(QObject):
+        def eventFilter(self, obj, event):
+            if event.type() == QEvent.Paint and not report:
+                report.update({
+                    'import_seconds': round(imported - start, 4),
+                    'window_seconds': round(created - imported, 4),
+                    'startup_seconds': round(time.time() - spawned_at, 4),
+                    'loaded_deferred_modules': sorted(name for name in DEFERRED_MODULES if name in sys.modules),
+                })
+                QTimer.singleShot(0, app.quit)
+            return False
+
+    paint_filter = FirstPaint()
+    window.installEventFilter(paint_filter)
+    window.show()
+    QTimer.singleShot(PROBE_TIMEOUT_SECONDS * 1000, app.quit)
+    app.exec_()
+    if not report:
+        print(json.dumps({'error': f'window was not painted within {PROBE_TIMEOUT_SECONDS} s'}))
+        return 2
+    print(json.dumps(report))
+    return 0
+
+
+def parse_importtime(stderr, top):
+    """解析 -X importtime 的输出，返回自身耗时最长的 top 个模块 [(模块, 毫秒)]"""
+    modules = []
+    for line in stderr.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        try:
+            self_us, _, name = line[len('import time:'):].split('|')
+            modules.append((name.strip(), round(int(self_us) / 1000, 2)))
+        except ValueError:
+            continue
+    modules.sort(key=lambda item: item[1], reverse=True)
+    return modules[:top]
+
+
+def run_once(python, env, importtime=False):
+    """启动一次子进程测量；importtime 为 True 时同时返回 -X importtime 的输出"""
+    command = [python] + (['-X', 'importtime'] if importtime else []) + [os.path.abspath(__file__), '--probe']
+    env = dict(env, **{_SPAWN_TIME_ENV: repr(time.time())})
+    completed = subprocess.run(command, env=env, capture_output=True, text=True, timeout=PROBE_TIMEOUT_SECONDS + 30)
+    lines = [line for line in completed.stdout.splitlines() if line.startswith('{')]
+    if completed.returncode != 0 or not lines:
+        detail = lines[-1] if lines else completed.stderr.strip().splitlines()[-1:] or ['no output']
+        raise RuntimeError(f'startup probe failed (exit {completed.returncode}): {detail}')
+    return json.loads(lines[-1]), completed.stderr
+
+
+def _median(values):
+    values = sorted(values)
+    middle = len(values) // 2
+    return values[middle] if len(values) % 2 else round((values[middle - 1] + values[middle]) / 2, 4)
+
+
+def summarize(runs):
+    summary = {key: _median([run[key] for run in runs])
+               for key in ('import_seconds', 'window_seconds', 'startup_seconds')}
+    summary['loaded_deferred_modules'] = sorted({name for run in runs for name in run['loaded_deferred_modules']})
+    return summary
+
+
+def check_budget(summary, startup_budget, import_budget):
+    """返回超出预算的项目说明（空列表表示全部满足）"""
+    violations = []
+    if startup_budget and summary['startup_seconds'] > startup_budget:
+        violations.append(f"startup {summary['startup_seconds']} s exceeds budget {startup_budget} s")
+    if import_budget and summary['import_seconds'] > import_budget:
+        violations.append(f"import {summary['import_seconds']} s exceeds budget {import_budget} s")
+    if summary['loaded_deferred_modules']:
+        violations.append(f"modules imported before first paint: {', '.join(summary['loaded_deferred_modules'])}")
+    return violations
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description='启动性能基准：测量图形界面从启动到窗口第一次绘制的耗时')
+    parser.add_argument('--repeat', type=int, default=3, help='测量次数，结果取中位数')
+    parser.add_argument('--budget', type=float, default=DEFAULT_STARTUP_BUDGET,
+                        help='启动预算（秒）：从启动进程到窗口第一次绘制，0 表示不检查')
+    parser.add_argument('--import-budget', type=float, default=DEFAULT_IMPORT_BUDGET,
+                        help='导入 main 的预算（秒），0 表示不检查')
+    parser.add_argument('--top-imports', type=int, default=10, help='结果中列出自身导入耗时最长的模块数，0 表示不统计')
+    parser.add_argument('--platform', help='Qt 平台插件（QT_QPA_PLATFORM），没有显示器时默认为 offscreen')
+    parser.add_argument('--output', help='把结果写入 JSON 文件')
+    parser.add_argument('--probe', action='store_true', help=argparse.SUPPRESS)
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    if args.probe:
+        return probe()
+    env = dict(os.environ)
+    if args.platform:
+        env['QT_QPA_PLATFORM'] = args.platform
+    elif sys.platform.startswith('linux') and not env.get('DISPLAY') and not env.get('WAYLAND_DISPLAY'):
+        env['QT_QPA_PLATFORM'] = 'offscreen'
+    runs = []
+    slowest_imports = []
+    try:
+        for _ in range(max(1, args.repeat)):
+            runs.append(run_once(sys.executable, env)[0])
+        if args.top_imports > 0:
+            slowest_imports = parse_importtime(run_once(sys.executable, env, importtime=True)[1], args.top_imports)
+    except (OSError, RuntimeError, subprocess.TimeoutExpired) as e:
+        print(f'错误：{e}', file=sys.stderr)
+        return 2
+
+    summary = summarize(runs)
+    violations = check_budget(summary, args.budget, args.import_budget)
+    report = {
+        'startup_benchmark_version': STARTUP_BENCHMARK_VERSION,
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'environment': {
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'qt_platform': env.get('QT_QPA_PLATFORM', ''),
+        },
+        'budget': {'startup_seconds': args.budget, 'import_seconds': args.import_budget},
+        'runs': runs,
+        'summary': summary,
+        'slowest_imports_ms': slowest_imports,
+        'violations': violations,
+    }
+    text = json.dumps(report, ensure_ascii=False, indent=2)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(text + '\n')
+    print(text)
+    return 1 if violations else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,98 @@
+"""校验清单：写出的 md5/sha256/ASC MHL 能被读回，重复拷卡不重复记录，按路径查询哈希"""
+import hashlib
+import os
+
+import pytest
+
+from checksum_manifest import (MHL_CHAIN_NAME, MHL_DIR_NAME, ChecksumIndex, ChecksumManifestWriter, check_formats,
+                               is_checksum_name, load_checksums, locate_event_folder)
+
+
+@pytest.fixture
+def event_folder(tmp_path):
+    folder = tmp_path / 'target' / '20250530_test'
+    (folder / '原图').mkdir(parents=True)
+    (folder / '原图' / 'IMG_0001.JPG').write_bytes(b'photo')
+    (folder / 'C0001.MP4').write_bytes(b'video')
+    return str(folder)
+
+
+def digest(algorithm, data):
+    return hashlib.new(algorithm, data).hexdigest()
+
+
+def write_manifests(event_folder, formats, copy_algorithm):
+    writer = ChecksumManifestWriter(formats, copy_algorithm)
+    for rel_path in ('原图/IMG_0001.JPG', 'C0001.MP4'):
+        path = os.path.join(event_folder, *rel_path.split('/'))
+        with open(path, 'rb') as f:
+            # 只传入拷贝算法的哈希，其余算法由写入器补算
+            writer.add(event_folder, rel_path, path, {copy_algorithm: digest(copy_algorithm, f.read())})
+    writer.close()
+
+
+def test_text_manifests_round_trip(event_folder):
+    write_manifests(event_folder, ['md5', 'sha256'], 'sha256')
+    name = os.path.basename(event_folder)
+    with open(os.path.join(event_folder, name + '.md5'), encoding='utf-8') as f:
+        assert f.read() == f"{digest('md5', b'photo')}  原图/IMG_0001.JPG\n{digest('md5', b'video')}  C0001.MP4\n"
+    checksums = load_checksums(event_folder)
+    assert checksums['原图/IMG_0001.JPG'] == {'md5': digest('md5', b'photo'), 'sha256': digest('sha256', b'photo')}
+    assert checksums['C0001.MP4']['sha256'] == digest('sha256', b'video')
+
+
+def test_repeated_ingest_does_not_duplicate_lines(event_folder):
+    write_manifests(event_folder, ['md5'], 'md5')
+    write_manifests(event_folder, ['md5'], 'md5')
+    with open(os.path.join(event_folder, os.path.basename(event_folder) + '.md5'), encoding='utf-8') as f:
+        assert len(f.readlines()) == 2
+
+
+def test_mhl_generations_and_chain(event_folder):
+    write_manifests(event_folder, ['mhl'], 'md5')
+    mhl_dir = os.path.join(event_folder, MHL_DIR_NAME)
+    assert load_checksums(event_folder)['原图/IMG_0001.JPG'] == {'md5': digest('md5', b'photo')}
+    # 文件变化后再拷一次：追加新的一代，链文件记录两代
+    with open(os.path.join(event_folder, 'C0001.MP4'), 'wb') as f:
+        f.write(b'video 2')
+    write_manifests(event_folder, ['mhl'], 'md5')
+    generations = sorted(name for name in os.listdir(mhl_dir) if name.endswith('.mhl'))
+    assert [name[:4] for name in generations] == ['0001', '0002']
+    with open(os.path.join(mhl_dir, MHL_CHAIN_NAME), encoding='utf-8') as f:
+        chain = f.read()
+    assert all(name in chain for name in generations)
+    assert load_checksums(event_folder)['C0001.MP4'] == {'md5': digest('md5', b'video 2')}
+
+
+def test_imports_manifests_from_other_tools(event_folder):
+    with open(os.path.join(event_folder, 'other.md5'), 'w', encoding='utf-8') as f:
+        f.write(f"# md5sum\nMD5 (C0001.MP4) = {digest('md5', b'video').upper()}\n")
+    with open(os.path.join(event_folder, 'other.xxh'), 'w', encoding='utf-8') as f:
+        f.write('0123456789abcdef0123456789abcdef *原图\\IMG_0001.JPG\n')
+    checksums = load_checksums(event_folder)
+    assert checksums['C0001.MP4'] == {'md5': digest('md5', b'video')}
+    assert checksums['原图/IMG_0001.JPG'] == {'xxh128': '0123456789abcdef0123456789abcdef'}
+
+
+def test_checksum_index_lookup(event_folder):
+    write_manifests(event_folder, ['sha256'], 'sha256')
+    root = os.path.dirname(event_folder)
+    path = os.path.join(event_folder, '原图', 'IMG_0001.JPG')
+    assert locate_event_folder(path, [root]) == (event_folder, '原图/IMG_0001.JPG')
+    assert locate_event_folder(os.path.join(root, 'loose.jpg'), [root]) == (None, None)
+    index = ChecksumIndex([root])
+    assert index.lookup(path, 'sha256') == digest('sha256', b'photo')
+    assert index.lookup(path, 'md5') is None
+
+
+@pytest.mark.parametrize('name, expected', [
+    ('20250530_test.md5', True), ('20250530_test.SHA256', True), ('a.xxh', True), ('0001_a.mhl', True),
+    (MHL_DIR_NAME, True), (MHL_CHAIN_NAME, True), ('IMG_0001.JPG', False), ('C0001M01.XML', False),
+])
+def test_is_checksum_name(name, expected):
+    assert is_checksum_name(name) is expected
+
+
+def test_unknown_format_raises_value_error():
+    with pytest.raises(ValueError):
+        check_formats(['crc32'])
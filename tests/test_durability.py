@@ -0,0 +1,78 @@
+"""临时文件提交：主目标和备份始终同名，不覆盖已有文件"""
+import os
+
+from durability import commit_partial, commit_partials, discard_partials, partial_path, suffixed_path
+
+
+def write(path, data):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'wb') as f:
+        f.write(data)
+
+
+def read(path):
+    with open(path, 'rb') as f:
+        return f.read()
+
+
+def test_partial_path_is_hidden_in_same_folder(tmp_path):
+    path = str(tmp_path / 'C0001.MP4')
+    assert partial_path(path) == str(tmp_path / '.C0001.MP4.sdcopy_part')
+
+
+def test_suffixed_path_keeps_extension():
+    assert suffixed_path('/a/IMG_0001.JPG', 2) == '/a/IMG_0001_2.JPG'
+
+
+def test_commit_partial_renames_to_final_name(tmp_path):
+    path = str(tmp_path / 'IMG_0001.JPG')
+    write(partial_path(path), b'new')
+    assert commit_partial(path) == path
+    assert read(path) == b'new'
+    assert not os.path.exists(partial_path(path))
+
+
+def test_commit_partial_never_overwrites(tmp_path):
+    path = str(tmp_path / 'IMG_0001.JPG')
+    write(path, b'old')
+    write(partial_path(path), b'new')
+    committed = commit_partial(path)
+    assert committed == str(tmp_path / 'IMG_0001_1.JPG')
+    assert read(path) == b'old'
+    assert read(committed) == b'new'
+
+
+def test_commit_partials_keeps_backup_name_in_step(tmp_path):
+    primary = str(tmp_path / 'main' / 'IMG_0001.JPG')
+    backup = str(tmp_path / 'backup' / 'IMG_0001.JPG')
+    for path in (primary, backup):
+        write(partial_path(path), b'new')
+    # 只有备份中出现了同名文件：主目标也要一起改用 _1
+    write(backup, b'other')
+    committed = commit_partials([primary, backup])
+    assert committed == [suffixed_path(primary, 1), suffixed_path(backup, 1)]
+    assert not os.path.exists(primary)
+    assert read(backup) == b'other'
+    assert all(read(path) == b'new' for path in committed)
+    assert not any(os.path.exists(partial_path(path)) for path in (primary, backup))
+
+
+def test_commit_partials_skips_suffix_taken_anywhere(tmp_path):
+    primary = str(tmp_path / 'main' / 'IMG_0001.JPG')
+    backup = str(tmp_path / 'backup' / 'IMG_0001.JPG')
+    for path in (primary, backup):
+        write(partial_path(path), b'new')
+    write(primary, b'a')
+    write(suffixed_path(backup, 1), b'b')
+    assert commit_partials([primary, backup]) == [suffixed_path(primary, 2), suffixed_path(backup, 2)]
+    assert read(suffixed_path(backup, 1)) == b'b'
+
+
+def test_discard_partials_removes_only_temp_files(tmp_path):
+    path = str(tmp_path / 'IMG_0001.JPG')
+    missing = str(tmp_path / 'IMG_0002.JPG')
+    write(path, b'final')
+    write(partial_path(path), b'partial')
+    assert discard_partials([path, missing]) == 1
+    assert read(path) == b'final'
+    assert not os.path.exists(partial_path(path))
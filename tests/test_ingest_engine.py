@@ -0,0 +1,137 @@
+"""重复拷卡和断点续传：已拷贝的跳过，相同文件不拷出 _1 副本，拷到一半的续传到原来的名字（含附属文件）"""
+import os
+
+import pytest
+
+from durability import partial_path
+from ingest_engine import IngestEngine, IngestOptions
+from ingest_manifest import MANIFEST_FILE_NAME, IngestManifest
+
+CLIP = 'PRIVATE/M4ROOT/CLIP/C0001.MP4'
+CLIP_SIDECAR = 'PRIVATE/M4ROOT/CLIP/C0001M01.XML'
+PHOTO = 'DCIM/100TEST/IMG_0001.JPG'
+PHOTO_SIDECAR = 'DCIM/100TEST/IMG_0001.XMP'
+
+
+def make_card(root, seed):
+    contents = {
+        CLIP: os.urandom(300 * 1024),
+        CLIP_SIDECAR: f'<clip seed="{seed}"/>'.encode(),
+        PHOTO: os.urandom(40 * 1024),
+        PHOTO_SIDECAR: f'<x:xmpmeta seed="{seed}"/>'.encode(),
+    }
+    for rel_path, data in contents.items():
+        path = os.path.join(root, rel_path)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'wb') as f:
+            f.write(data)
+        # 同名卡上的文件大小、修改时间也相同，只有内容不同
+        os.utime(path, (1748571072, 1748571072))
+    return root
+
+
+def destination_files(*roots):
+    files = []
+    for root in roots:
+        for folder, _, names in os.walk(root):
+            files += [os.path.relpath(os.path.join(folder, name), root) for name in names
+                      if name != MANIFEST_FILE_NAME and not name.startswith(MANIFEST_FILE_NAME)]
+    return sorted(files)
+
+
+@pytest.fixture
+def layout(tmp_path):
+    card = make_card(str(tmp_path / 'card'), 'a')
+    target = str(tmp_path / 'target')
+    backup = str(tmp_path / 'backup')
+    os.makedirs(target)
+    return card, target, backup
+
+
+def ingest(card, target, backup):
+    options = IngestOptions(target, target, card, event_name='test', backup_roots=[backup], hash_algorithm='sha256')
+    result = IngestEngine(options).run()
+    assert not result.failed_tasks
+    return result
+
+
+def test_first_ingest_copies_media_and_sidecars(layout):
+    card, target, backup = layout
+    result = ingest(card, target, backup)
+    assert len(result.tasks) == 4
+    files = destination_files(target)
+    assert files == destination_files(backup)
+    assert len(files) == 4
+    # 视频按默认模板改名，附属文件跟随改名
+    video = next(name for name in files if name.endswith('.MP4'))
+    assert video[:-len('.MP4')] + 'M01.XML' in files
+
+
+def test_reingest_skips_everything(layout):
+    card, target, backup = layout
+    ingest(card, target, backup)
+    before = destination_files(target, backup)
+    result = ingest(card, target, backup)
+    assert result.tasks == []
+    assert result.skipped_files == 4
+    assert destination_files(target, backup) == before
+
+
+def test_reingest_without_manifest_finds_identical_files(layout):
+    card, target, backup = layout
+    ingest(card, target, backup)
+    before = destination_files(target, backup)
+    os.remove(os.path.join(target, MANIFEST_FILE_NAME))
+    result = ingest(card, target, backup)
+    assert result.tasks == []
+    assert result.identical_files == 4
+    assert destination_files(target, backup) == before
+
+
+def test_other_card_with_same_names_gets_suffixed_pairs(layout, tmp_path):
+    card, target, backup = layout
+    ingest(card, target, backup)
+    other = make_card(str(tmp_path / 'other'), 'b')
+    result = ingest(other, target, backup)
+    assert len(result.tasks) == 4
+    files = destination_files(target)
+    assert files == destination_files(backup)
+    video = next(name for name in files if name.endswith('_1.MP4'))
+    assert video[:-len('.MP4')] + 'M01.XML' in files
+
+
+@pytest.mark.parametrize('rel_path', [CLIP, CLIP_SIDECAR, PHOTO_SIDECAR])
+def test_interrupted_copy_resumes_to_recorded_name(layout, rel_path):
+    card, target, backup = layout
+    ingest(card, target, backup)
+    before = destination_files(target, backup)
+    # 模拟拷到一半时断电：记录回到 partial，目标只剩临时文件
+    st = os.stat(os.path.join(card, rel_path))
+    manifest = IngestManifest.for_root(target)
+    record = manifest.lookup(rel_path, st.st_size, st.st_mtime_ns)
+    manifest.begin(record.key, record.dst_paths)
+    manifest.commit()
+    manifest.close()
+    for path in record.dst_paths:
+        os.rename(path, partial_path(path))
+
+    result = ingest(card, target, backup)
+    assert [task.dst_paths for task in result.tasks] == [record.dst_paths]
+    assert destination_files(target, backup) == before
+    assert not any(os.path.exists(partial_path(path)) for path in record.dst_paths)
+
+
+def test_stale_partial_is_removed_when_not_resumed(layout):
+    card, target, backup = layout
+    ingest(card, target, backup)
+    st = os.stat(os.path.join(card, CLIP_SIDECAR))
+    manifest = IngestManifest.for_root(target)
+    record = manifest.lookup(CLIP_SIDECAR, st.st_size, st.st_mtime_ns)
+    manifest.close()
+    # 已完成的文件旁边遗留了一次放弃的拷贝
+    for path in record.dst_paths:
+        with open(partial_path(path), 'wb') as f:
+            f.write(b'stale')
+    result = ingest(card, target, backup)
+    assert result.tasks == []
+    assert not any(os.path.exists(partial_path(path)) for path in record.dst_paths)
@@ -0,0 +1,82 @@
+"""图库索引：按 (大小, 部分哈希) 查找已归档的文件，用完整哈希确认，过期记录自动移除"""
+import os
+
+import pytest
+
+from library_index import LIBRARY_DB_NAME, PARTIAL_HASH_SIZE, LibraryIndex, partial_hash
+
+
+def write(path, data):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'wb') as f:
+        f.write(data)
+    return path
+
+
+@pytest.fixture
+def library(tmp_path):
+    root = str(tmp_path / 'library')
+    write(os.path.join(root, '20250530_a', 'IMG_0001.JPG'), b'a' * 1000)
+    write(os.path.join(root, '20250530_a', '20250530_a.md5'), b'0' * 1000)
+    write(os.path.join(root, '20250530_a', 'ascmhl', '0001_a.mhl'), b'1' * 1000)
+    index = LibraryIndex(root)
+    index.ensure_built()
+    yield index
+    index.close()
+
+
+def test_finds_duplicate_anywhere_in_library(library, tmp_path):
+    source = write(str(tmp_path / 'card' / 'DSC0001.JPG'), b'a' * 1000)
+    assert library.find_duplicate(source, 1000) == os.path.join(library.root, '20250530_a', 'IMG_0001.JPG')
+
+
+def test_same_size_different_content_is_not_a_duplicate(library, tmp_path):
+    source = write(str(tmp_path / 'card' / 'DSC0001.JPG'), b'b' * 1000)
+    assert library.find_duplicate(source, 1000) is None
+
+
+def test_same_partial_hash_is_confirmed_by_full_hash(tmp_path):
+    root = str(tmp_path / 'library')
+    size = 3 * PARTIAL_HASH_SIZE
+    head_tail = b'h' * PARTIAL_HASH_SIZE
+    write(os.path.join(root, 'a', 'big.MP4'), head_tail + b'x' * PARTIAL_HASH_SIZE + head_tail)
+    source = write(str(tmp_path / 'card' / 'C0001.MP4'), head_tail + b'y' * PARTIAL_HASH_SIZE + head_tail)
+    assert partial_hash(source, size) == partial_hash(os.path.join(root, 'a', 'big.MP4'), size)
+    index = LibraryIndex(root)
+    try:
+        index.ensure_built()
+        cache = {}
+        assert index.find_duplicate(source, size, cache) is None
+        assert set(cache) == {'partial', 'full'}
+    finally:
+        index.close()
+
+
+def test_shared_source_cache_skips_rereading(library, tmp_path):
+    source = write(str(tmp_path / 'card' / 'DSC0001.JPG'), b'b' * 1000)
+    cache = {'partial': partial_hash(source, 1000)}
+    os.remove(source)
+    # 源文件的部分哈希已在缓存中（另一个图库查过），没有候选文件时不再读取源文件
+    assert library.find_duplicate(source, 1000, cache) is None
+    assert 'full' not in cache
+
+
+def test_stale_entries_are_dropped(library, tmp_path):
+    os.remove(os.path.join(library.root, '20250530_a', 'IMG_0001.JPG'))
+    source = write(str(tmp_path / 'card' / 'DSC0001.JPG'), b'a' * 1000)
+    assert library.find_duplicate(source, 1000) is None
+    assert library._conn.execute('SELECT COUNT(*) FROM files WHERE name = ?', ('IMG_0001.JPG',)).fetchone()[0] == 0
+
+
+def test_registered_files_are_found_without_refresh(library, tmp_path):
+    path = write(os.path.join(library.root, '20250531_b', 'C0001.MP4'), b'v' * 5000)
+    library.register(path)
+    library.commit()
+    source = write(str(tmp_path / 'card' / 'C0001.MP4'), b'v' * 5000)
+    assert library.find_duplicate(source, 5000) == path
+
+
+def test_index_skips_own_database_and_checksum_manifests(library):
+    names = {name for (name,) in library._conn.execute('SELECT name FROM files')}
+    assert names == {'IMG_0001.JPG'}
+    assert os.path.exists(os.path.join(library.root, LIBRARY_DB_NAME))
@@ -0,0 +1,51 @@
+"""重命名模板：编译、字段拼接、空字段省略分隔符、附属文件跟随改名"""
+import datetime
+from types import SimpleNamespace
+
+import pytest
+
+from rename_template import compile_template, sidecar_name
+
+
+def entry(name='C0001.MP4', camera='ILCE-7SM3', captured_at=datetime.datetime(2025, 5, 30, 10, 11, 12)):
+    return SimpleNamespace(name=name, camera=camera, captured_at=captured_at,
+                           mtime=datetime.datetime(2024, 1, 2, 3, 4, 5).timestamp())
+
+
+@pytest.mark.parametrize('template', ['', '   ', None])
+def test_empty_template_keeps_original_name(template):
+    assert compile_template(template) is None
+
+
+def test_render_fields_and_keep_extension():
+    template = compile_template('{date}_{time}_{camera}_{orig}')
+    assert template.render(entry()) == '20250530_101112_ILCE-7SM3_C0001.MP4'
+    assert compile_template('{year}-{month}-{day}').render(entry()) == '2025-05-30.MP4'
+
+
+def test_empty_field_drops_its_separator():
+    template = compile_template('{date}_{camera}_{orig}')
+    assert template.render(entry(camera=None)) == '20250530_C0001.MP4'
+
+
+def test_missing_capture_time_falls_back_to_mtime():
+    assert compile_template('{date}_{orig}').render(entry(captured_at=None)) == '20240102_C0001.MP4'
+
+
+def test_unsafe_characters_are_replaced():
+    assert compile_template('{camera}_{orig}').render(entry(camera='Canon EOS R5/C')) == 'Canon-EOS-R5-C_C0001.MP4'
+
+
+def test_blank_result_falls_back_to_original_name():
+    assert compile_template('{camera}').render(entry(camera='')) == 'C0001.MP4'
+
+
+@pytest.mark.parametrize('template', ['{unknown}', '{date', '{date}}'])
+def test_invalid_template_raises_value_error(template):
+    with pytest.raises(ValueError):
+        compile_template(template)
+
+
+def test_sidecar_follows_media_rename():
+    sidecar = SimpleNamespace(name='C0001M01.XML')
+    assert sidecar_name(sidecar, 'C0001.MP4', '20250530_C0001_1.MP4') == '20250530_C0001_1M01.XML'
@@ -0,0 +1,88 @@
+"""路由规则：编译、按条件匹配、附属文件后缀、规则错误"""
+import datetime
+from types import SimpleNamespace
+
+import pytest
+
+from routing import KIND_IMAGE, KIND_VIDEO, TARGET_SKIP, compile_rules, default_routing, load_routing
+
+
+def entry(ext, size=1024, camera=None, date='20250530'):
+    return SimpleNamespace(ext=ext, size=size, camera=camera, date=date,
+                           captured_at=datetime.datetime(2025, 5, 30), mtime=0)
+
+
+def test_default_rules():
+    table = default_routing()
+    assert table.kind_for('.arw') == KIND_IMAGE
+    assert table.kind_for('.mp4') == KIND_VIDEO
+    assert table.kind_for('.txt') is None
+    assert table.is_raw('.arw') and not table.is_raw('.jpg')
+    assert 'M01.XML' in table.sidecar_suffixes
+    assert table.route(entry('.arw')).subfolder_parts(True) == ['原图', 'RAW']
+    assert table.route(entry('.jpg')).subfolder_parts(False) == ['原图']
+    assert table.route(entry('.mp4')).subfolder_parts(False) == []
+
+
+def test_load_routing_without_path_uses_defaults():
+    assert load_routing(None) is default_routing()
+
+
+RULES = '''
+[proxy]
+extensions = mp4
+kind = video
+target = skip
+max_size = 10M
+
+[fx3]
+extensions = .MP4
+kind = video
+camera = ILCE-FX3, ILCE-7SM3
+subfolder = FX3/Clips
+date_from = 2025-01-01
+
+[video]
+extensions = .mp4
+kind = video
+
+[sidecar]
+kind = sidecar
+suffixes = .xmp m01.xml
+'''
+
+
+def test_first_matching_rule_wins():
+    table = compile_rules(RULES)
+    assert table.route(entry('.mp4', size=1024)).target == TARGET_SKIP
+    big = 50 * 1024 * 1024
+    assert table.route(entry('.mp4', size=big, camera='ilce-fx3')).name == 'fx3'
+    assert table.route(entry('.mp4', size=big, camera='ILCE-FX3')).subfolder_parts(False) == ['FX3', 'Clips']
+    assert table.route(entry('.mp4', size=big, camera='ILCE-FX3', date='20241231')).name == 'video'
+    assert table.route(entry('.mp4', size=big)).name == 'video'
+    assert table.route(entry('.mov')) is None
+    assert table.sidecar_suffixes == ('.XMP', 'M01.XML')
+
+
+def test_rules_after_unconditional_rule_are_unreachable():
+    table = compile_rules(RULES + '''
+[late]
+extensions = .mp4
+kind = video
+camera = ILCE-1
+''')
+    big = 50 * 1024 * 1024
+    assert table.route(entry('.mp4', size=big, camera='ILCE-1')).name == 'video'
+
+
+@pytest.mark.parametrize('text', [
+    '[a]\nextensions = .jpg\nkind = audio\n',
+    '[a]\nextensions = .jpg\nkind = image\ntarget = elsewhere\n',
+    '[a]\nextensions = .jpg\nkind = image\nmin_size = lots\n',
+    '[a]\nextensions = .jpg\nkind = image\ndate_from = 2025\n',
+    '[a]\nextensions = .jpg\nkind = image\n[b]\nextensions = .jpg\nkind = video\n',
+    'extensions = .jpg\n',
+])
+def test_invalid_rules_raise_value_error(text):
+    with pytest.raises(ValueError):
+        compile_rules(text)
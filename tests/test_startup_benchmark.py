@@ -0,0 +1,43 @@
+"""启动性能基准：真实启动一次界面，第一次绘制前的耗时和导入的模块要在预算内"""
+import json
+
+import pytest
+
+import startup_benchmark
+
+
+def test_check_budget_reports_each_violation():
+    summary = {'startup_seconds': 1.5, 'import_seconds': 0.5, 'window_seconds': 0.1,
+               'loaded_deferred_modules': ['PIL']}
+    assert len(startup_benchmark.check_budget(summary, 1.0, 0.4)) == 3
+    summary.update(startup_seconds=0.5, import_seconds=0.1, loaded_deferred_modules=[])
+    assert startup_benchmark.check_budget(summary, 1.0, 0.4) == []
+    # 预算为 0 表示不检查
+    assert startup_benchmark.check_budget(dict(summary, startup_seconds=9), 0, 0) == []
+
+
+def test_summarize_takes_median_and_union_of_modules():
+    runs = [{'import_seconds': value, 'window_seconds': value, 'startup_seconds': value,
+             'loaded_deferred_modules': modules} for value, modules in ((0.3, []), (0.1, ['PIL']), (0.2, []))]
+    summary = startup_benchmark.summarize(runs)
+    assert summary['startup_seconds'] == 0.2
+    assert summary['loaded_deferred_modules'] == ['PIL']
+
+
+def test_parse_importtime_lists_slowest_modules():
+    stderr = ('import time: self [us] | cumulative | imported package\n'
+              'import time:       120 |        120 | json\n'
+              'import time:      5000 |       6000 | PyQt5.QtWidgets\n')
+    assert startup_benchmark.parse_importtime(stderr, 1) == [('PyQt5.QtWidgets', 5.0)]
+
+
+def test_first_paint_within_budget(tmp_path, monkeypatch):
+    pytest.importorskip('PyQt5.QtWidgets')
+    # 不读取开发者自己的配置和日志目录
+    monkeypatch.setenv('HOME', str(tmp_path))
+    output = tmp_path / 'startup.json'
+    code = startup_benchmark.main(['--repeat', '3', '--top-imports', '0', '--output', str(output)])
+    assert code != 2, 'startup probe failed to run'
+    report = json.loads(output.read_text(encoding='utf-8'))
+    assert report['violations'] == []
+    assert code == 0
@@ -0,0 +1,110 @@
+import logging
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from durability import write_back
+from hashing import DEFAULT_ALGORITHM, new_hasher
+from instrumentation import instrumentation
+
+VERIFY_CHUNK_SIZE = 4 * 1024 * 1024
+# 校验线程数：校验读的是目标盘，不和拷贝线程抢读卡带宽
+VERIFY_WORKERS = 2
+
+# macOS 上对单个文件描述符关闭缓存的 fcntl 命令（旧版 Python 的 fcntl 模块中没有这个常量）
+_F_NOCACHE = 48
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+
+def drop_page_cache(fd):
+    """把文件写到磁盘并从页缓存中丢弃，之后的读取才会真正访问磁盘
+
+    Linux 使用 posix_fadvise(DONTNEED)（脏页无法丢弃，所以先回写，见 durability.write_back）；
+    macOS 使用 F_NOCACHE；都不支持时只做回写，返回 False 表示无法绕过缓存。
+    真正的落盘（fsync）由 durability.SyncBatcher 按策略分批进行。
+    """
+    write_back(fd)
+    if hasattr(os, 'posix_fadvise'):
+        os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_DONTNEED)
+        return True
+    if fcntl is not None and sys.platform == 'darwin':
+        fcntl.fcntl(fd, getattr(fcntl, 'F_NOCACHE', _F_NOCACHE), 1)
+        return True
+    return False
+
+
+def hash_file_uncached(file_path, algorithm=DEFAULT_ALGORITHM, chunk_size=VERIFY_CHUNK_SIZE, on_chunk=None):
+    """绕过页缓存读取文件并计算哈希，证明数据确实写到了目标盘上
+
+    不使用 O_DIRECT：它要求缓冲区和偏移按扇区对齐，对 Python 的文件对象不友好，
+    fadvise/F_NOCACHE 已足以让读取落到磁盘上。on_chunk(字节数) 在每读一块后调用（如用于限速）。
+    """
+    buffer = bytearray(chunk_size)
+    view = memoryview(buffer)
+    file_hash = new_hasher(algorithm)
+    with open(file_path, 'rb') as f:
+        fd = f.fileno()
+        try:
+            drop_page_cache(fd)
+        except OSError as e:
+            logging.debug(f"Failed to drop page cache for {file_path}: {e}")
+        while True:
+            read_size = f.readinto(buffer)
+            if not read_size:
+                break
+            file_hash.update(view[:read_size])
+            if on_chunk is not None:
+                on_chunk(read_size)
+        # 校验读入的数据同样不留在缓存中，避免挤掉拷贝需要的缓存
+        if hasattr(os, 'posix_fadvise'):
+            os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_DONTNEED)
+    return file_hash.hexdigest()
+
+
+class VerificationPipeline:
+    """与拷贝并行运行的校验队列
+
+    拷贝完成的任务通过 submit() 进入队列，由独立的校验线程从目标盘重新读取并比对哈希，
+    结果写入 task.failed_paths / task.error，然后回调 on_verified(task)（在校验线程中调用）。
+    """
+    def __init__(self, workers=VERIFY_WORKERS, on_verified=None):
+        self.on_verified = on_verified
+        self._pool = ThreadPoolExecutor(max_workers=max(1, workers), thread_name_prefix='verify')
+        self._lock = threading.Lock()
+        self.verified_count = 0
+        self.failed_count = 0
+
+    def submit(self, task):
+        self._pool.submit(self._verify, task)
+
+    def _verify(self, task):
+        start = time.perf_counter() if task.timings is not None else 0.0
+        try:
+            task.failed_paths = [dst_path for dst_path, write_path in zip(task.dst_paths, task.write_paths)
+                                 if hash_file_uncached(write_path, task.hash_algorithm) != task.source_hash]
+        except Exception as e:
+            task.error = e
+        if task.timings is not None:
+            seconds = time.perf_counter() - start
+            task.timings['verify'] = seconds
+            instrumentation.add_time('verify', seconds)
+            instrumentation.count('verify.bytes', task.size * len(task.dst_paths))
+            if not task.verified:
+                instrumentation.count('verify.failed')
+        with self._lock:
+            if task.verified:
+                self.verified_count += 1
+            else:
+                self.failed_count += 1
+        if self.on_verified:
+            self.on_verified(task)
+
+    def close(self):
+        """等待队列中的校验全部完成"""
+        self._pool.shutdown(wait=True)